@@ -0,0 +1,89 @@
+"""Memory used by in-memory debate histories, old dict turns vs. the compact store.
+
+Run from the repository root:
+
+    python -m benchmarks.conversation_memory --users 5000 --turns 20
+"""
+import argparse
+import random
+import tracemalloc
+
+from bot.conversation_store import ConversationStore
+
+WORDS = (
+    "argument evidence premise conclusion policy society students university "
+    "freedom responsibility economy government research example because therefore "
+    "however although consider point counter rebuttal claim support"
+).split()
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _simulated_turns(seed, turns):
+    rng = random.Random(seed)
+    for index in range(turns):
+        if index % 2 == 0:
+            yield "user", _sentence(rng, rng.randint(8, 40))
+        else:
+            yield "assistant", " ".join(_sentence(rng, rng.randint(10, 25)) for _ in range(rng.randint(3, 8)))
+
+
+def _measure(*steps):
+    """Run the steps in order and return the traced memory growth after each one."""
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    usage = []
+    for step in steps:
+        step()
+        snapshot = tracemalloc.take_snapshot()
+        usage.append(sum(stat.size_diff for stat in snapshot.compare_to(baseline, "filename")))
+    tracemalloc.stop()
+    return usage
+
+
+def build_dict_history(users, turns):
+    history = {}
+    for user_id in range(users):
+        history[user_id] = []
+        for role, content in _simulated_turns(user_id, turns):
+            history[user_id].append({"role": role, "content": content})
+    return history
+
+
+def build_compact_history(users, turns):
+    store = ConversationStore()
+    for user_id in range(users):
+        store.reset(user_id)
+        for role, content in _simulated_turns(user_id, turns):
+            store.append(user_id, role, content)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    held = {}
+    (dict_bytes,) = _measure(lambda: held.update(dicts=build_dict_history(args.users, args.turns)))
+    held.clear()
+
+    compact_bytes, compressed_bytes = _measure(
+        lambda: held.update(store=build_compact_history(args.users, args.turns)),
+        lambda: held["store"].compress_idle(0),
+    )
+
+    print(f"{args.users} debates x {args.turns} turns")
+    for label, used in (
+        ("list of dicts", dict_bytes),
+        ("compact store", compact_bytes),
+        ("compact store, idle compressed", compressed_bytes),
+    ):
+        print(f"  {label:32} {used / args.users:10.0f} bytes/debate  {used / 2 ** 20:8.1f} MiB total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""In-memory stand-ins for Firestore, Telegram and SMTP.
+
+`install()` must run before any `bot`, `database` or `mail` module is
+imported: it registers a fake `firebase_admin` package so importing
+`database.database_support` needs no credentials, and a fake `yagmail`
+so no email leaves the machine. The fakes only implement the calls this
+codebase makes. The LLM is replaced with bot.llm.FakeBackend.
+"""
+import itertools
+import sys
+import types
+from datetime import datetime, timezone
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, reference=None):
+        self.id = doc_id
+        self._data = None if data is None else dict(data)
+        self.reference = reference
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def _apply(current, updates):
+    for field, value in updates.items():
+        if value is DELETE_FIELD:
+            current.pop(field, None)
+        elif value is SERVER_TIMESTAMP:
+            current[field] = datetime.now(timezone.utc)
+        elif isinstance(value, Increment):
+            current[field] = current.get(field, 0) + value.value
+        else:
+            current[field] = value
+    return current
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection.name}/{self.id}"
+
+    def get(self, *args, **kwargs):
+        self._collection.client.reads += 1
+        return FakeSnapshot(self.id, self._collection.docs.get(self.id), self)
+
+    def set(self, data, merge=False):
+        self._collection.client.writes += 1
+        current = dict(self._collection.docs.get(self.id, {})) if merge else {}
+        self._collection.docs[self.id] = _apply(current, data)
+
+    def create(self, data):
+        if self.id in self._collection.docs:
+            from google.api_core.exceptions import AlreadyExists
+            raise AlreadyExists(f"Document already exists: {self.path}")
+        self.set(data)
+
+    def update(self, data):
+        if self.id not in self._collection.docs:
+            raise KeyError(f"No document to update: {self.path}")
+        self._collection.client.writes += 1
+        self._collection.docs[self.id] = _apply(dict(self._collection.docs[self.id]), data)
+
+    def delete(self):
+        self._collection.client.writes += 1
+        self._collection.docs.pop(self.id, None)
+
+
+class FakeQuery:
+    _OPS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+    }
+
+    def __init__(self, collection, filters=(), order=None, limit=None, start_after=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._order = order
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        params = dict(filters=self._filters, order=self._order, limit=self._limit, start_after=self._start_after)
+        params.update(changes)
+        return FakeQuery(self._collection, **params)
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        # Document id is always the final tie-breaker here, so only keep the main field
+        if field == "__name__" and self._order:
+            return self
+        return self._copy(order=field)
+
+    def select(self, field_paths):
+        return self
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot)
+
+    def _matches(self):
+        rows = sorted(self._collection.docs.items())
+        if self._order and self._order != "__name__":
+            rows.sort(key=lambda item: (item[1].get(self._order) is None, item[1].get(self._order), item[0]))
+        for doc_id, data in rows:
+            if all(field in data and self._OPS[op](data.get(field), value) for field, op, value in self._filters):
+                yield doc_id, data
+
+    def stream(self):
+        rows = list(self._matches())
+        if self._start_after is not None:
+            cursor = self._start_after
+            if not isinstance(cursor, dict):
+                cursor = dict(cursor.to_dict(), __name__=cursor.id)
+            if self._order and self._order != "__name__":
+                position = (cursor[self._order], str(cursor["__name__"]))
+                rows = [(doc_id, data) for doc_id, data in rows if (data.get(self._order), doc_id) > position]
+            else:
+                rows = [(doc_id, data) for doc_id, data in rows if doc_id > str(cursor["__name__"])]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for doc_id, data in rows:
+            self._collection.client.reads += 1
+            yield FakeSnapshot(doc_id, data, FakeDocumentReference(self._collection, doc_id))
+
+    def get(self):
+        return list(self.stream())
+
+    def count(self, alias=None):
+        return FakeAggregation(self, alias or "count")
+
+
+class FakeAggregation:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self):
+        self._query._collection.client.reads += 1
+        value = sum(1 for _ in self._query._matches())
+        return [[types.SimpleNamespace(alias=self._alias, value=value)]]
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(self)
+        self.client = client
+        self.name = name
+        self.docs = {}
+        self._ids = itertools.count(1)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, str(doc_id) if doc_id is not None else f"auto{next(self._ids)}")
+
+    def on_snapshot(self, callback):
+        """Deliver the current documents once as added; later writes are not streamed."""
+        added = types.SimpleNamespace(name="ADDED")
+        snapshots = [FakeSnapshot(doc_id, data, FakeDocumentReference(self, doc_id))
+                     for doc_id, data in sorted(self.docs.items())]
+        callback(snapshots, [types.SimpleNamespace(type=added, document=snapshot) for snapshot in snapshots],
+                 datetime.now(timezone.utc))
+        return types.SimpleNamespace(unsubscribe=lambda: None)
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, data):
+        self._ops.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError("Firestore batches are limited to 500 operations")
+        for op in self._ops:
+            op()
+        self._client.batches += 1
+        self._ops = []
+
+
+class FakeFirestore:
+    """Dictionary-backed Firestore client counting reads, writes and batch commits."""
+
+    def __init__(self):
+        self._collections = {}
+        self.reads = 0
+        self.writes = 0
+        self.batches = 0
+
+    def collection(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = FakeCollection(self, name)
+        return collection
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeBot:
+    """Records Telegram Bot API calls instead of performing them."""
+
+    def __init__(self):
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    def _record(self, method, kwargs):
+        self.calls.append((method, kwargs))
+        return types.SimpleNamespace(message_id=next(self._message_ids), chat_id=kwargs.get("chat_id"))
+
+    async def send_message(self, **kwargs):
+        return self._record("send_message", kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        return self._record("edit_message_text", kwargs)
+
+    async def send_chat_action(self, **kwargs):
+        return self._record("send_chat_action", kwargs)
+
+    async def answer_callback_query(self, **kwargs):
+        return self._record("answer_callback_query", kwargs)
+
+
+class FakeSMTP:
+    sent = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def send(self, to, subject, contents):
+        FakeSMTP.sent.append((to, subject))
+
+
+firestore_client = FakeFirestore()
+
+
+def install():
+    """Register the fake firebase_admin and yagmail modules. Safe to call more than once."""
+    if isinstance(sys.modules.get("firebase_admin"), types.ModuleType) and getattr(
+        sys.modules["firebase_admin"], "_debatebot_fake", False
+    ):
+        return firestore_client
+
+    firestore_module = types.ModuleType("firebase_admin.firestore")
+    firestore_module.client = lambda *args, **kwargs: firestore_client
+    firestore_module.DELETE_FIELD = DELETE_FIELD
+    firestore_module.SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    firestore_module.Increment = Increment
+
+    credentials_module = types.ModuleType("firebase_admin.credentials")
+    credentials_module.Certificate = lambda *args, **kwargs: object()
+
+    firebase_module = types.ModuleType("firebase_admin")
+    firebase_module._debatebot_fake = True
+    firebase_module.initialize_app = lambda *args, **kwargs: object()
+    firebase_module.firestore = firestore_module
+    firebase_module.credentials = credentials_module
+
+    yagmail_module = types.ModuleType("yagmail")
+    yagmail_module.SMTP = FakeSMTP
+
+    sys.modules["firebase_admin"] = firebase_module
+    sys.modules["firebase_admin.firestore"] = firestore_module
+    sys.modules["firebase_admin.credentials"] = credentials_module
+    sys.modules["yagmail"] = yagmail_module
+    return firestore_client
@@ -0,0 +1,320 @@
+"""Replay recorded traffic against the real bot to find its capacity.
+
+Feeds a recording made with TRAFFIC_RECORD_FILE (see bot/traffic.py) into
+the Application built by main.py, at one or more speed-ups. Telegram is
+replaced at the HTTP request layer, Firestore and SMTP by the fakes in
+benchmarks/fakes.py, and the LLM by a FakeBackend with a configurable
+generation time. Everything else - handlers, debouncing, admission control,
+outbound rate limits - is the production code with the settings from
+config.txt.
+
+For every speed the report shows update-to-reply latency percentiles, load
+shed replies and updates never answered; the first speed that breaks the
+latency objective or sheds load is the saturation point.
+
+    python -m benchmarks.replay traffic.jsonl.gz
+    python -m benchmarks.replay traffic.jsonl.gz --speeds 1,5,10,20 --copies 4 --llm-latency 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from collections import defaultdict, deque
+
+from benchmarks import fakes
+
+firestore_client = fakes.install()
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import main as bot_main  # noqa: E402
+from bot.admission import admission  # noqa: E402
+from bot.config import Config  # noqa: E402
+from bot.delivery import outbound  # noqa: E402
+from bot.llm import FakeBackend  # noqa: E402
+from bot.loop_monitor import loop_monitor  # noqa: E402
+from bot.traffic import read_traffic  # noqa: E402
+from bot.utils import load_messages  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "DebateBot", "username": "debate_bot"}
+# Copies of the trace get user ids in separate ranges
+COPY_STRIDE = 2 ** 48
+SHED_KEYS = ("server_busy", "too_many_messages", "daily_budget_exceeded")
+
+
+class ResponseTracker:
+    """Pairs updates with the bot's replies in the same chat.
+
+    A reply answers every update of its chat that is still waiting, which is
+    how debounced messages are answered together.
+    """
+
+    def __init__(self):
+        self.waiting = defaultdict(deque)
+        self.latencies = []
+        self.replies = 0
+        self.shed = 0
+        self.shed_texts = {load_messages(language)[key] for language in ("en", "ru") for key in SHED_KEYS}
+
+    def arrived(self, chat_id) -> None:
+        self.waiting[chat_id].append(time.monotonic())
+
+    def replied(self, chat_id, text) -> None:
+        now = time.monotonic()
+        self.replies += 1
+        if text in self.shed_texts:
+            self.shed += 1
+        waiting = self.waiting[chat_id]
+        while waiting:
+            self.latencies.append(now - waiting.popleft())
+
+    @property
+    def unanswered(self) -> int:
+        return sum(len(waiting) for waiting in self.waiting.values())
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, reporting sent and edited messages to the tracker."""
+
+    def __init__(self, tracker, latency=0.0):
+        self.tracker = tracker
+        self.latency = latency
+        self._message_ids = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, parameters)}).encode()
+
+    def _result(self, endpoint, parameters):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return []
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(parameters["chat_id"])
+            self.tracker.replied(chat_id, parameters.get("text"))
+            self._message_ids += 1
+            return {
+                "message_id": int(parameters.get("message_id", self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": parameters.get("text", ""),
+            }
+        return True
+
+
+def make_update(update_id, user_id, kind, payload, bot):
+    user = {"id": user_id, "is_bot": False, "first_name": "Student"}
+    chat = {"id": user_id, "type": "private"}
+    now = int(time.time())
+    if kind == "c":
+        data = {"update_id": update_id, "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": payload,
+            "message": {"message_id": 1, "date": now, "chat": chat, "from": BOT_USER, "text": "menu"},
+        }}
+    else:
+        message = {"message_id": update_id, "date": now, "chat": chat, "from": user, "text": payload}
+        if payload.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(payload.split()[0])}]
+        data = {"update_id": update_id, "message": message}
+    return Update.de_json(data, bot)
+
+
+def load_trace(path, copies, max_gap):
+    """Return [(offset seconds, user id, kind, payload)] with idle gaps shortened to `max_gap`."""
+    records, offset, previous = [], 0.0, None
+    for arrived, user, kind, payload in read_traffic(path):
+        if previous is not None:
+            offset += min(max(0.0, arrived - previous), max_gap)
+        previous = arrived
+        for copy in range(copies):
+            records.append((offset, user + copy * COPY_STRIDE, kind, payload))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def seed_users(user_ids, state) -> None:
+    for collection in list(firestore_client._collections.values()):
+        collection.docs.clear()
+    if state == "none":
+        return
+    users = firestore_client.collection('users')
+    for user_id in user_ids:
+        users.document(str(user_id)).set({
+            'email': f"student{user_id}@student.ehu.lt",
+            'conversation_state': state,
+            'topic': "Universities should abolish exams",
+            'side': "for",
+            'language': "en",
+        })
+
+
+def _percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def replay_config(args, workdir):
+    # Any config.txt key can be overridden this way, as with environment variables in production
+    per_piece = FakeBackend("probe")
+    pieces = math.ceil(len(per_piece.reply) / per_piece.chunk_size)
+    overrides = {
+        'TELEGRAM_BOT_TOKEN': "123456:replay",
+        'METRICS_PORT': "0",
+        'CONFIG_RELOAD_SECONDS': "0",
+        'LLM_BACKENDS': "replay",
+        'LLM_REPLAY_TYPE': "fake",
+        'LLM_REPLAY_DELAY': str(args.llm_latency / pieces),
+        'ANALYSIS_WORKERS': "0",
+        'ANALYSIS_DB_PATH': os.path.join(workdir, "analysis.sqlite3"),
+        'TRANSCRIPT_EXPORT': "0",
+        'TRAFFIC_RECORD_FILE': "",
+        'HISTORY_SNAPSHOT_FILE': "",
+        'USER_CACHE': "off",
+        'DEDUPE_BACKEND': "memory",
+        'BROADCAST_DIR': os.path.join(workdir, "broadcasts"),
+        'PROFILE_DIR': os.path.join(workdir, "profiles"),
+    }
+    if not args.keep_user_limits:
+        # A sped-up trace would otherwise trip the per-user flood limits
+        overrides.update(USER_MESSAGES_PER_MINUTE="0", DAILY_TOKEN_BUDGET="0")
+    return Config(args.config, environ=overrides, secrets_dir=os.path.join(workdir, "no-secrets"))
+
+
+async def replay_once(records, speed, args, workdir, next_update_id):
+    tracker = ResponseTracker()
+    builder = (
+        Application.builder()
+        .request(FakeTelegramRequest(tracker, args.telegram_latency))
+        .get_updates_request(FakeTelegramRequest(tracker))
+    )
+    application = bot_main.build_application(replay_config(args, workdir), builder)
+    seed_users({user for _, user, _, _ in records}, args.seed_state)
+
+    peaks = {"update_queue": 0, "inflight_llm": 0, "outbound": 0}
+
+    async def sample():
+        while True:
+            peaks["update_queue"] = max(peaks["update_queue"], application.update_queue.qsize())
+            peaks["inflight_llm"] = max(peaks["inflight_llm"], admission.inflight_llm)
+            peaks["outbound"] = max(peaks["outbound"], outbound.depth())
+            await asyncio.sleep(0.05)
+
+    async with application:
+        # run_polling normally calls the hooks; here the updates come from the trace instead
+        await application.post_init(application)
+        await application.start()
+        sampler = asyncio.get_running_loop().create_task(sample())
+
+        started = time.monotonic()
+        for offset, user_id, kind, payload in records:
+            delay = started + offset / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_update_id += 1
+            tracker.arrived(user_id)
+            await application.update_queue.put(make_update(next_update_id, user_id, kind, payload, application.bot))
+        fed_in = time.monotonic() - started
+
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline and (tracker.unanswered or application.update_queue.qsize()):
+            await asyncio.sleep(0.05)
+
+        sampler.cancel()
+        await application.stop()
+        await application.post_shutdown(application)
+
+    return {
+        "speed": speed,
+        "updates": len(records),
+        "rate": len(records) / fed_in if fed_in else float("inf"),
+        "p50": _percentile(tracker.latencies, 0.50),
+        "p95": _percentile(tracker.latencies, 0.95),
+        "p99": _percentile(tracker.latencies, 0.99),
+        "max": max(tracker.latencies, default=float("nan")),
+        "shed": tracker.shed,
+        "unanswered": tracker.unanswered,
+        **peaks,
+    }, next_update_id
+
+
+async def run(args):
+    records = load_trace(args.trace, args.copies, args.max_gap)
+    if not records:
+        raise SystemExit(f"{args.trace} contains no updates")
+    users = len({user for _, user, _, _ in records})
+    duration = records[-1][0]
+    print(f"{len(records)} updates from {users} users over {duration:.0f}s of recorded time "
+          f"(LLM {args.llm_latency:.2f}s per reply, objective p95 <= {args.slo:.1f}s)")
+    print(f"{'speed':>6} {'upd/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'shed':>5} "
+          f"{'lost':>5} {'queue':>6} {'llm':>4} {'out':>5}")
+
+    saturated = None
+    next_update_id = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        for speed in args.speeds:
+            result, next_update_id = await replay_once(records, speed, args, workdir, next_update_id)
+            print(f"{result['speed']:>5g}x {result['rate']:7.1f} {result['p50']:7.2f} {result['p95']:7.2f} "
+                  f"{result['p99']:7.2f} {result['max']:7.2f} {result['shed']:5d} {result['unanswered']:5d} "
+                  f"{result['update_queue']:6d} {result['inflight_llm']:4d} {result['outbound']:5d}")
+            if saturated is None and (result['p95'] > args.slo or result['shed'] or result['unanswered']):
+                saturated = result
+
+    await outbound.stop()
+    await loop_monitor.stop()
+
+    if saturated is None:
+        print(f"No saturation up to {args.speeds[-1]:g}x ({users} users in the trace).")
+    else:
+        print(f"Saturated at {saturated['speed']:g}x: {saturated['rate']:.1f} updates/s "
+              f"from {users} users in the trace.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded DebateBot traffic with fake backends")
+    parser.add_argument("trace", help="file written by TRAFFIC_RECORD_FILE")
+    parser.add_argument("--speeds", type=lambda value: [float(v) for v in value.split(",")], default=[1.0],
+                        help="comma-separated speed-ups to run, e.g. 1,2,5,10")
+    parser.add_argument("--copies", type=int, default=1,
+                        help="replay the trace this many times in parallel with distinct users")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds the fake LLM takes per reply")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per fake Bot API call")
+    parser.add_argument("--slo", type=float, default=5.0, help="p95 update-to-reply latency objective in seconds")
+    parser.add_argument("--max-gap", type=float, default=60.0, help="shorten idle gaps in the trace to this")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for replies after the trace")
+    parser.add_argument("--seed-state", default="CHAT_GPT",
+                        help="conversation state of the pre-created users, or 'none' to start unregistered")
+    parser.add_argument("--keep-user-limits", action="store_true", help="keep the per-user flood limits")
+    parser.add_argument("--config", default="config.txt")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("telegram").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Microbenchmarks for the code that runs on every update.
+
+Everything runs offline against the fakes in benchmarks/fakes.py. Results are
+compared with benchmarks/baselines.json; a benchmark more than `--threshold`
+slower than its baseline is reported as a regression and the run exits with
+status 1.
+
+    python -m benchmarks.run                 # compare with the stored baselines
+    python -m benchmarks.run --save          # record new baselines
+    python -m benchmarks.run -k history      # only benchmarks whose name contains "history"
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+import types
+
+from benchmarks import fakes
+
+firestore_client = fakes.install()
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from bot import handlers  # noqa: E402
+from bot.config import Config  # noqa: E402
+from bot.conversation_store import ConversationStore  # noqa: E402
+from bot.delivery import outbound  # noqa: E402
+from bot.flow import TEXT, event_of, callback, load_user_context  # noqa: E402
+from bot.llm import llm_router  # noqa: E402
+from bot.topics import TopicCatalog, topic_id_for  # noqa: E402
+from bot.turn_routing import turn_router  # noqa: E402
+from bot.usage import usage_tracker  # noqa: E402
+from bot.utils import generate_verification_code, load_messages  # noqa: E402
+from database.user_cache import user_cache, LocalChangeFeed  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_THRESHOLD = 0.25
+
+BENCH_CONFIG = {
+    'PROMPT': "You are debating {debate_topic}. The student argues {debate_side}. Take the opposite side.",
+    'GPT_MODEL': "fake-model",
+    'MESSAGE_DEBOUNCE_SECONDS': '0',
+}
+
+
+def _bench_config(**values):
+    """A validated Config holding only BENCH_CONFIG and `values`, ignoring config.txt and the environment."""
+    overrides = dict(BENCH_CONFIG, TELEGRAM_BOT_TOKEN="bench", **values)
+    return Config(os.devnull, environ={}, secrets_dir=os.devnull, overrides=overrides)
+
+BENCHMARKS = {}
+
+
+def benchmark(number):
+    """Register a benchmark; `number` is the count of calls per timed sample."""
+
+    def register(func):
+        BENCHMARKS[func.__name__.replace("bench_", "")] = (func, number)
+        return func
+
+    return register
+
+
+def _seed_user(user_id, state, topic="Universities should abolish exams", side="for"):
+    firestore_client.collection('users').document(str(user_id)).set({
+        'email': f"student{user_id}@student.ehu.lt",
+        'verification_code': None,
+        'conversation_state': state,
+        'topic': topic,
+        'side': side,
+        'language': 'en',
+    })
+
+
+def _fake_update(user_id, text):
+    user = types.SimpleNamespace(id=user_id)
+    chat = types.SimpleNamespace(id=user_id)
+    message = types.SimpleNamespace(text=text, from_user=user, chat_id=user_id)
+    return types.SimpleNamespace(effective_user=user, effective_chat=chat, message=message, callback_query=None,
+                                 inline_query=None)
+
+
+def _fake_context():
+    application = types.SimpleNamespace(
+        update_queue=asyncio.Queue(),
+        create_task=asyncio.ensure_future,
+    )
+    return types.SimpleNamespace(
+        bot=fakes.FakeBot(),
+        bot_data={'config': _bench_config()},
+        user_data={},
+        chat_data={},
+        application=application,
+    )
+
+
+@benchmark(number=2000)
+def bench_load_messages():
+    def run():
+        load_messages('en')
+    return run
+
+
+@benchmark(number=5000)
+def bench_generate_verification_code():
+    return generate_verification_code
+
+
+@benchmark(number=5000)
+def bench_keyboard_building():
+    msgs = load_messages('en')
+
+    def run():
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton(msgs["resend_verification"], callback_data='resend_verification')],
+            [InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')],
+        ])
+    return run
+
+
+@benchmark(number=5000)
+def bench_history_append_trim():
+    store = ConversationStore(max_turns=20)
+    store.reset(1)
+    turns = (("user", "I believe exams measure memory rather than understanding."),
+             ("assistant", "Exams also give students a clear, comparable standard."))
+
+    def run():
+        for role, content in turns:
+            store.append(1, role, content)
+    return run
+
+
+@benchmark(number=5000)
+def bench_prompt_construction():
+    store = ConversationStore()
+    store.reset(1)
+    for index in range(20):
+        store.append(1, "user" if index % 2 == 0 else "assistant", f"Argument number {index} " * 10)
+    template = BENCH_CONFIG['PROMPT']
+
+    def run():
+        prompt = template.format(debate_topic="Universities should abolish exams", debate_side="for")
+        list(store.messages(1, prompt))
+    return run
+
+
+@benchmark(number=20000)
+def bench_flow_route():
+    update = _fake_update(1000, "hello")
+    flow = handlers.DEBATE_FLOW
+
+    def run():
+        flow.route("CHAT_GPT", event_of(update))
+        flow.route("AWAITING_DEBATE_SIDE", callback("for"))
+        flow.route("VERIFIED", TEXT)
+    return run
+
+
+@benchmark(number=1000)
+def bench_topic_search():
+    subjects = ("Universities", "Governments", "Social networks", "Schools", "Cities", "Employers", "Parents",
+                "Scientists", "Museums", "Banks")
+    actions = ("should abolish", "should fund", "should regulate", "should ban", "should require", "should tax",
+               "should publish", "should replace", "should subsidise", "should limit")
+    objects = ("exams", "nuclear power", "remote work", "homework", "private cars", "advertising to children",
+               "open data", "artificial intelligence", "space exploration", "fast food", "tourism",
+               "plastic packaging", "cryptocurrencies", "online anonymity", "animal testing", "gap years",
+               "school uniforms", "voting at sixteen", "facial recognition", "zoos")
+    catalog = TopicCatalog()
+    for subject in subjects:
+        for action in actions:
+            for obj in objects:
+                title = f"{subject} {action} {obj}"
+                catalog.add(topic_id_for(title), title)
+    queries = ("univ abol", "remote work", "nuclaer powr", "")
+
+    def run():
+        for query in queries:
+            catalog.search(query)
+    return run
+
+
+@benchmark(number=300)
+def bench_state_dispatch():
+    # No topic yet, so the VERIFIED handler only replies and the state stays the same
+    _seed_user(1001, "VERIFIED", topic=None, side=None)
+    update = _fake_update(1001, "hello")
+    context = _fake_context()
+
+    async def run():
+        await load_user_context(update, context)
+        await handlers.global_message_handler(update, context)
+    return run
+
+
+@benchmark(number=300)
+def bench_gpt_turn():
+    _seed_user(1002, "CHAT_GPT")
+    update = _fake_update(1002, "Exams are unfair to students with anxiety.")
+    context = _fake_context()
+
+    async def run():
+        handlers.conversation_history.reset(1002)
+        await load_user_context(update, context)
+        await handlers.gpt_reply(update, context)
+    return run
+
+
+@benchmark(number=1000)
+def bench_state_dispatch_cached():
+    # Registered last: the user cache stays live for the rest of the run
+    _seed_user(1003, "VERIFIED", topic=None, side=None)
+    update = _fake_update(1003, "hello")
+    context = _fake_context()
+    feed = LocalChangeFeed()
+    user_cache.start(feed)
+    feed.publish(1003, firestore_client.collection('users').document('1003').get().to_dict())
+
+    async def run():
+        await load_user_context(update, context)
+        await handlers.global_message_handler(update, context)
+    return run
+
+
+def _time(func, number, repeat):
+    """Return the best seconds per call over `repeat` samples of `number` calls."""
+    samples = []
+    if asyncio.iscoroutinefunction(func):
+        loop = asyncio.get_event_loop()
+
+        async def sample():
+            start = time.perf_counter()
+            for _ in range(number):
+                await func()
+            return time.perf_counter() - start
+
+        for _ in range(repeat):
+            samples.append(loop.run_until_complete(sample()))
+    else:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append(time.perf_counter() - start)
+    return min(samples) / number
+
+
+def _prepare():
+    llm_router.configure(_bench_config(LLM_BACKENDS='fake', LLM_FAKE_TYPE='fake'))
+    outbound.configure(_bench_config(TELEGRAM_GLOBAL_RATE='1e9', TELEGRAM_CHAT_RATE='1e9', TELEGRAM_CHAT_BURST='1e9'))
+    usage_tracker.messages_per_minute = 0
+    usage_tracker.daily_token_budget = 0
+    turn_router.summary_every = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the DebateBot microbenchmarks")
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="timed samples per benchmark")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    args = parser.parse_args()
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    _prepare()
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+            baselines = json.load(f).get("results", {})
+
+    results = {}
+    regressions = []
+    for name, (factory, number) in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        func = factory()
+        _time(func, max(1, number // 10), 1)  # warm-up
+        seconds = _time(func, number, args.repeat)
+        results[name] = seconds * 1e6
+
+        line = f"{name:32} {results[name]:10.2f} us/op"
+        baseline = baselines.get(name)
+        if baseline:
+            change = results[name] / baseline - 1
+            line += f"   baseline {baseline:10.2f} us/op  {change:+7.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    asyncio.get_event_loop().run_until_complete(outbound.stop())
+
+    if args.save:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": {**baselines, **{name: round(value, 3) for name, value in results.items()}},
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines saved to {BASELINE_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}: "
+              + ", ".join(regressions))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
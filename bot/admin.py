@@ -0,0 +1,26 @@
+import functools
+import logging
+
+
+def admin_ids(config) -> set:
+    """Telegram user ids listed in ADMIN_USER_IDS (comma separated)."""
+    raw = config.get('ADMIN_USER_IDS', '') or ''
+    return {int(part) for part in raw.replace(' ', '').split(',') if part.isdigit()}
+
+
+def is_admin(user_id, config) -> bool:
+    return user_id in admin_ids(config)
+
+
+def admin_only(handler):
+    """Run the handler only for admins; other users get no reaction at all."""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        user_id = update.effective_user.id
+        if not is_admin(user_id, context.bot_data.get('config', {})):
+            logging.warning(f"User {user_id} tried to use admin command {handler.__name__}")
+            return None
+        return await handler(update, context)
+
+    return wrapper
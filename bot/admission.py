@@ -0,0 +1,77 @@
+import functools
+import logging
+from contextlib import contextmanager
+
+from bot.delivery import outbound
+from bot.flow import user_context
+from bot.metrics import registry
+
+DEFAULT_MAX_INFLIGHT_LLM = 20
+DEFAULT_MAX_UPDATE_QUEUE = 100
+
+shed_total = registry.counter("debatebot_shed_total", "Updates rejected because the bot was saturated")
+inflight_llm_gauge = registry.gauge("debatebot_inflight_llm_calls", "LLM generations currently running")
+
+
+class AdmissionController:
+    """Decides whether an expensive turn may start, based on current load.
+
+    Load is the number of updates waiting in the application's update queue
+    and the number of LLM generations already in flight. Cheap flows are
+    never routed through here, so they keep working while GPT turns are shed.
+    """
+
+    def __init__(self, max_inflight_llm=DEFAULT_MAX_INFLIGHT_LLM, max_update_queue=DEFAULT_MAX_UPDATE_QUEUE):
+        self.max_inflight_llm = max_inflight_llm
+        self.max_update_queue = max_update_queue
+        self.inflight_llm = 0
+
+    def configure(self, config) -> None:
+        self.max_inflight_llm = config.get_int('MAX_INFLIGHT_LLM', DEFAULT_MAX_INFLIGHT_LLM)
+        self.max_update_queue = config.get_int('MAX_UPDATE_QUEUE', DEFAULT_MAX_UPDATE_QUEUE)
+
+    def overload_reason(self, application):
+        """Return why new LLM turns should be rejected right now, or None to admit."""
+        if self.max_inflight_llm and self.inflight_llm >= self.max_inflight_llm:
+            return "inflight_llm"
+        if self.max_update_queue and application.update_queue.qsize() >= self.max_update_queue:
+            return "update_queue"
+        return None
+
+    @contextmanager
+    def llm_call(self):
+        """Count an LLM generation as in flight for the duration of the block."""
+        self.inflight_llm += 1
+        inflight_llm_gauge.set(self.inflight_llm)
+        try:
+            yield
+        finally:
+            self.inflight_llm -= 1
+            inflight_llm_gauge.set(self.inflight_llm)
+
+
+admission = AdmissionController()
+
+
+def shed_when_busy(handler):
+    """Wrap an LLM-backed handler so it answers with a short "busy" reply under overload."""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        reason = admission.overload_reason(context.application)
+        if reason is None:
+            return await handler(update, context)
+
+        shed_total.inc(reason=reason)
+        user_id = update.effective_user.id
+        logging.warning(f"Shedding {handler.__name__} for user {user_id}: {reason}")
+        msgs = user_context(update, context).msgs
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["server_busy"],
+        )
+        # Stay in the current conversation state
+        return None
+
+    return wrapper
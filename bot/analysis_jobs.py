@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from bot.admission import admission
+from bot.conversation_store import conversation_history
+from bot.delivery import outbound, PRIORITY_BULK
+from bot.llm import llm_router
+from bot.metrics import registry
+from bot.tenants import TenantLocal, run_blocking
+from bot.utils import load_messages
+
+JOB_SCORE = "score"
+JOB_CRITIQUE = "critique"
+
+DEFAULT_DB_PATH = "analysis_jobs.sqlite3"
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_POLL_SECONDS = 5.0
+DEFAULT_MAX_INTERACTIVE_LLM = 2
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_TOKENS = 600
+
+LANGUAGE_NAMES = {"en": "English", "ru": "Russian"}
+
+SCORE_PROMPT = (
+    "You are an impartial debate judge. For each numbered argument below, rate how strong it is "
+    "on a scale from 1 to 10 and give one short reason. Answer only with a JSON array of objects "
+    'with the keys "id", "score" and "reason".'
+)
+CRITIQUE_PROMPT = (
+    "You are a debate coach. A student argued {side} the motion \"{topic}\" against an AI opponent. "
+    "Read the debate and write constructive feedback: the student's strongest points, the weakest "
+    "ones, and two concrete ways to improve. Keep it under 200 words and write in {language}."
+)
+
+jobs_total = registry.counter("debatebot_analysis_jobs_total", "Background analysis jobs by kind and outcome")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (kind, status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, kind, status);
+"""
+
+
+class JobStore:
+    """Durable job queue in a local SQLite file.
+
+    A claimed job is leased: its status becomes 'running' and run_after moves
+    to the end of the lease. Jobs whose lease ran out (the process died while
+    working on them) can be claimed again. All methods are blocking and are
+    called from a worker thread.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def enqueue(self, kind, user_id, chat_id, payload) -> int:
+        with self._lock:
+            cursor = self._db().execute(
+                "INSERT INTO jobs (kind, user_id, chat_id, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, user_id, chat_id, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, kind, limit, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Lease up to `limit` ready jobs of one kind, oldest first."""
+        now = time.time()
+        # Critiques wait until every earlier score of the same user is finished
+        ordering = "" if kind == JOB_SCORE else """
+            AND NOT EXISTS (
+                SELECT 1 FROM jobs AS score
+                WHERE score.user_id = jobs.user_id AND score.kind = 'score'
+                AND score.status IN ('pending', 'running') AND score.id < jobs.id
+            )"""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    f"""SELECT id, user_id, chat_id, payload, attempts FROM jobs
+                    WHERE kind = ? AND status IN ('pending', 'running') AND run_after <= ? {ordering}
+                    ORDER BY id LIMIT ?""",
+                    (kind, now, limit),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, run_after = ? WHERE id = ?",
+                    [(now + lease_seconds, row[0]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [
+            {"id": job_id, "user_id": user_id, "chat_id": chat_id, "payload": json.loads(payload),
+             "attempts": attempts + 1}
+            for job_id, user_id, chat_id, payload, attempts in rows
+        ]
+
+    def complete(self, results) -> None:
+        """Mark jobs done; `results` is a list of (job id, JSON-serialisable result)."""
+        with self._lock:
+            self._db().executemany(
+                "UPDATE jobs SET status = 'done', result = ? WHERE id = ?",
+                [(json.dumps(result, ensure_ascii=False), job_id) for job_id, result in results],
+            )
+
+    def fail(self, jobs, max_attempts) -> None:
+        """Retry the jobs later with backoff, or give up after `max_attempts`."""
+        now = time.time()
+        with self._lock:
+            self._db().executemany(
+                "UPDATE jobs SET status = ?, run_after = ? WHERE id = ?",
+                [
+                    ("failed" if job["attempts"] >= max_attempts else "pending", now + 60 * 2 ** job["attempts"],
+                     job["id"])
+                    for job in jobs
+                ],
+            )
+
+    def scores_for(self, user_id, topic, side, before_id):
+        """Finished scores of one debate, oldest first."""
+        with self._lock:
+            rows = self._db().execute(
+                """SELECT payload, result FROM jobs
+                WHERE user_id = ? AND kind = 'score' AND status = 'done' AND id < ? ORDER BY id""",
+                (user_id, before_id),
+            ).fetchall()
+        scores = []
+        for payload, result in rows:
+            payload = json.loads(payload)
+            if payload.get("topic") == topic and payload.get("side") == side:
+                scores.append((payload["argument"], json.loads(result)))
+        return scores
+
+    def forget_user(self, user_id) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM jobs WHERE user_id = ?", (user_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _parse_scores(text):
+    """Extract the JSON array from a judge reply, tolerating surrounding prose."""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("Judge reply contains no JSON array")
+    return {int(item["id"]): item for item in json.loads(text[start:end + 1])}
+
+
+class AnalysisWorkers:
+    """Worker pool for debate analysis that is too slow for the reply path.
+
+    Handlers only insert a row into the SQLite queue. Workers pick jobs up
+    when interactive load is low (no more than ANALYSIS_MAX_INTERACTIVE_LLM
+    replies generating and the bot not shedding load), so feedback is
+    produced off-peak. Per-turn scores are batched, ANALYSIS_BATCH_SIZE
+    arguments to one model request, and stored; a critique includes the
+    scores of its debate and is sent to the student when ready.
+    """
+
+    def __init__(self):
+        self.store = JobStore()
+        self.workers = DEFAULT_WORKERS
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.poll_seconds = DEFAULT_POLL_SECONDS
+        self.max_interactive_llm = DEFAULT_MAX_INTERACTIVE_LLM
+        self.max_attempts = DEFAULT_MAX_ATTEMPTS
+        self.max_tokens = DEFAULT_MAX_TOKENS
+        self.model = None
+        self.score_turns = False
+        self._tasks = []
+
+    def configure(self, config) -> None:
+        self.store = JobStore(config.get('ANALYSIS_DB_PATH', DEFAULT_DB_PATH))
+        self.workers = config.get_int('ANALYSIS_WORKERS', DEFAULT_WORKERS)
+        self.batch_size = config.get_int('ANALYSIS_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.poll_seconds = config.get_float('ANALYSIS_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+        self.max_interactive_llm = config.get_int('ANALYSIS_MAX_INTERACTIVE_LLM', DEFAULT_MAX_INTERACTIVE_LLM)
+        self.max_attempts = config.get_int('ANALYSIS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        self.max_tokens = config.get_int('ANALYSIS_MAX_TOKENS', DEFAULT_MAX_TOKENS)
+        self.model = config.get('ANALYSIS_MODEL', '') or None
+        self.score_turns = config.get_bool('ANALYSIS_SCORE_TURNS')
+
+    async def _call(self, func, *args):
+        return await run_blocking(func, *args)
+
+    async def enqueue(self, kind, user_id, chat_id, payload) -> int:
+        job_id = await self._call(self.store.enqueue, kind, user_id, chat_id, payload)
+        jobs_total.inc(kind=kind, outcome="queued")
+        return job_id
+
+    async def forget_user(self, user_id) -> None:
+        await self._call(self.store.forget_user, user_id)
+
+    def start(self, application) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._tasks = [application.create_task(self._work(application)) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._call(self.store.close)
+
+    def _off_peak(self, application) -> bool:
+        return (
+            admission.inflight_llm <= self.max_interactive_llm
+            and admission.overload_reason(application) is None
+        )
+
+    async def _work(self, application) -> None:
+        while True:
+            try:
+                busy = False
+                if self._off_peak(application):
+                    jobs = await self._call(self.store.claim, JOB_SCORE, self.batch_size)
+                    if jobs:
+                        await self._run_scores(jobs)
+                    else:
+                        jobs = await self._call(self.store.claim, JOB_CRITIQUE, 1)
+                        for job in jobs:
+                            await self._run_critique(application.bot, job)
+                    busy = bool(jobs)
+                if not busy:
+                    await asyncio.sleep(self.poll_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Error in analysis worker")
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _complete(self, messages) -> str:
+        response = ""
+        async for chunk in llm_router.stream(messages, model=self.model, max_tokens=self.max_tokens):
+            response += chunk.text
+        return response
+
+    async def _run_scores(self, jobs) -> None:
+        arguments = "\n\n".join(
+            f"{job['id']}. Motion: {job['payload']['topic']} (student argues {job['payload']['side']})\n"
+            f"Argument: {job['payload']['argument']}"
+            for job in jobs
+        )
+        try:
+            scores = _parse_scores(await self._complete([
+                {"role": "system", "content": SCORE_PROMPT},
+                {"role": "user", "content": arguments},
+            ]))
+        except Exception:
+            logging.exception(f"Scoring {len(jobs)} arguments failed")
+            await self._call(self.store.fail, jobs, self.max_attempts)
+            jobs_total.inc(len(jobs), kind=JOB_SCORE, outcome="failed")
+            return
+
+        done = [job for job in jobs if job["id"] in scores]
+        missing = [job for job in jobs if job["id"] not in scores]
+        await self._call(self.store.complete, [
+            (job["id"], {"score": scores[job["id"]].get("score"), "reason": scores[job["id"]].get("reason")})
+            for job in done
+        ])
+        if missing:
+            await self._call(self.store.fail, missing, self.max_attempts)
+        jobs_total.inc(len(done), kind=JOB_SCORE, outcome="done")
+        jobs_total.inc(len(missing), kind=JOB_SCORE, outcome="failed")
+
+    async def _run_critique(self, bot, job) -> None:
+        payload = job["payload"]
+        msgs = load_messages(payload["language"])
+        scores = await self._call(self.store.scores_for, job["user_id"], payload["topic"], payload["side"], job["id"])
+        transcript = "\n\n".join(f"{role.upper()}: {content}" for role, content in payload["turns"])
+        if scores:
+            transcript += "\n\nJudge scores for the student's arguments:\n" + "\n".join(
+                f"- {score.get('score')}/10: {score.get('reason')}" for _, score in scores
+            )
+        try:
+            critique = await self._complete([
+                {"role": "system", "content": CRITIQUE_PROMPT.format(
+                    topic=payload["topic"], side=payload["side"],
+                    language=LANGUAGE_NAMES.get(payload["language"], "English"),
+                )},
+                {"role": "user", "content": transcript},
+            ])
+            if not critique.strip():
+                raise ValueError("Received empty critique from the LLM backend")
+            await outbound.send_message(
+                bot,
+                chat_id=job["chat_id"],
+                text=msgs["feedback_ready"].format(topic=payload["topic"]) + "\n\n" + critique,
+                priority=PRIORITY_BULK,
+                wait=True,
+            )
+        except Exception:
+            logging.exception(f"Critique job {job['id']} failed")
+            await self._call(self.store.fail, [job], self.max_attempts)
+            jobs_total.inc(kind=JOB_CRITIQUE, outcome="failed")
+            return
+        await self._call(self.store.complete, [(job["id"], {"critique": critique})])
+        jobs_total.inc(kind=JOB_CRITIQUE, outcome="done")
+
+
+analysis_workers = TenantLocal(AnalysisWorkers)
+
+
+async def request_critique(user_id, chat_id, topic, side, language) -> bool:
+    """Queue feedback on the user's current debate. Returns False if there is nothing to review."""
+    conversation = conversation_history.get(user_id)
+    if conversation is None or not any(role == "user" for role, _ in conversation.turns()):
+        return False
+    await analysis_workers.enqueue(JOB_CRITIQUE, user_id, chat_id, {
+        "topic": topic,
+        "side": side,
+        "language": language,
+        "turns": list(conversation.turns()),
+    })
+    return True
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+from bot.admin import admin_only
+from bot.delivery import outbound, PRIORITY_BULK
+from bot.rate_limit import TokenBucket
+from bot.tenants import TenantLocal, run_blocking
+from bot.utils import known_languages
+from database.database_support import get_users_page
+
+DEFAULT_BROADCAST_DIR = "broadcasts"
+DEFAULT_RATE = 20
+DEFAULT_PAGE_SIZE = 200
+PAGE_RETRIES = 3
+
+# Students who finished email verification
+VERIFIED_STATES = ("VERIFIED", "AWAITING_DEBATE_TOPIC", "AWAITING_DEBATE_SIDE", "CHAT_GPT")
+
+USAGE = (
+    "Usage:\n"
+    "/broadcast [state=CHAT_GPT,VERIFIED] [language=en]\n"
+    "en: Text for English users\n"
+    "ru: Text for Russian users\n\n"
+    "/broadcast status - show running broadcasts\n"
+    "/broadcast cancel <id> - stop a broadcast"
+)
+
+
+def parse_broadcast(text):
+    """Parse the /broadcast message into (states, language, texts by language).
+
+    The first line holds optional `state=` and `language=` filters. The body
+    is either plain text for everyone or sections starting with `en:` / `ru:`;
+    only languages with a message catalog start a section, so lines like
+    "at: 10:00" stay part of the text.
+    """
+    languages = known_languages()
+    first_line, _, body = text.partition("\n")
+    states, language = list(VERIFIED_STATES), None
+    for argument in first_line.split()[1:]:
+        key, _, value = argument.partition("=")
+        if key == "state" and value:
+            states = [] if value.lower() == "all" else value.upper().split(",")
+        elif key == "language" and value:
+            language = None if value.lower() == "all" else value.lower()
+            if language is not None and language not in languages:
+                raise ValueError(f"Unknown language: {value} (known: {', '.join(languages)})")
+        else:
+            raise ValueError(f"Unknown argument: {argument}")
+
+    texts, current = {}, None
+    for line in body.splitlines():
+        tag, separator, rest = line.partition(":")
+        if separator and tag in languages:
+            current = tag
+            texts[current] = rest.strip()
+        elif current is None:
+            texts["en"] = (texts.get("en", "") + "\n" + line).strip()
+        else:
+            texts[current] = (texts[current] + "\n" + line).strip()
+
+    if not any(texts.values()):
+        raise ValueError("The announcement text is empty")
+    return states, language, texts
+
+
+class BroadcastRunner:
+    """Sends announcements to many users with checkpointing.
+
+    Users are read page by page with a cursor query; after every page the
+    cursor and counters are written to a JSON checkpoint file, so a broadcast
+    interrupted by a crash or restart continues from the last finished page
+    (a user on the interrupted page may receive the message twice). Messages
+    go through the outbound queue at bulk priority and are additionally paced
+    by a broadcast-wide token bucket.
+    """
+
+    def __init__(self):
+        self.directory = DEFAULT_BROADCAST_DIR
+        self.rate = DEFAULT_RATE
+        self.page_size = DEFAULT_PAGE_SIZE
+        self._tasks = {}
+        self._suspended = False
+
+    def configure(self, config) -> None:
+        self.directory = config.get('BROADCAST_DIR', DEFAULT_BROADCAST_DIR)
+        self.rate = config.get_float('BROADCAST_RATE', DEFAULT_RATE)
+        self.page_size = config.get_int('BROADCAST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+    def _path(self, broadcast_id):
+        return os.path.join(self.directory, f"{broadcast_id}.json")
+
+    def _save(self, state) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(state["id"])
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def create(self, admin_chat_id, states, language, texts):
+        state = {
+            "id": uuid.uuid4().hex[:8],
+            "admin_chat_id": admin_chat_id,
+            "status_message_id": None,
+            "states": states,
+            "language": language,
+            "texts": texts,
+            "cursor": None,
+            "sent": 0,
+            "failed": 0,
+            "elapsed": 0.0,
+            "status": "running",
+        }
+        self._save(state)
+        return state
+
+    def start(self, application, state) -> None:
+        self._tasks[state["id"]] = application.create_task(self._run(application.bot, state))
+
+    def resume_unfinished(self, application) -> int:
+        """Restart every broadcast whose checkpoint is still marked running."""
+        if not os.path.isdir(self.directory):
+            return 0
+        resumed = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("status") == "running" and state["id"] not in self._tasks:
+                logging.info(f"Resuming broadcast {state['id']} after user {state['cursor']}")
+                self.start(application, state)
+                resumed += 1
+        return resumed
+
+    def cancel(self, broadcast_id) -> bool:
+        task = self._tasks.get(broadcast_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def suspend(self) -> int:
+        """Stop every broadcast for a shutdown, leaving the checkpoints to be resumed."""
+        self._suspended = True
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    def running(self):
+        return [broadcast_id for broadcast_id, task in self._tasks.items() if not task.done()]
+
+    @staticmethod
+    def _progress(state):
+        rate = state["sent"] / state["elapsed"] if state["elapsed"] else 0.0
+        return (
+            f"Broadcast {state['id']}: {state['status']}\n"
+            f"Sent: {state['sent']}, failed: {state['failed']}, {rate:.1f} msg/s"
+        )
+
+    async def _report(self, bot, state) -> None:
+        text = self._progress(state)
+        try:
+            if state["status_message_id"] is None:
+                message = await outbound.send_message(bot, chat_id=state["admin_chat_id"], text=text, wait=True)
+                state["status_message_id"] = message.message_id
+            else:
+                await outbound.edit_message_text(
+                    bot,
+                    chat_id=state["admin_chat_id"],
+                    message_id=state["status_message_id"],
+                    text=text,
+                    wait=True,
+                )
+        except Exception:
+            logging.exception(f"Could not report progress of broadcast {state['id']}")
+
+    async def _send_one(self, bot, user_id, text) -> bool:
+        try:
+            await outbound.send_message(bot, chat_id=int(user_id), text=text, priority=PRIORITY_BULK, wait=True)
+            return True
+        except Exception as e:
+            # Typically the user blocked the bot or deleted their account
+            logging.info(f"Broadcast message to {user_id} failed: {e}")
+            return False
+
+    async def _run(self, bot, state) -> None:
+        loop = asyncio.get_running_loop()
+        bucket = TokenBucket(self.rate, max(1, self.rate))
+        default_text = state["texts"].get("en") or next(text for text in state["texts"].values() if text)
+        await self._report(bot, state)
+
+        try:
+            retries = 0
+            while True:
+                started = time.monotonic()
+                page = await run_blocking(
+                    get_users_page, state["states"], state["language"], self.page_size, state["cursor"]
+                )
+                if page is None:
+                    retries += 1
+                    if retries > PAGE_RETRIES:
+                        state["status"] = "paused"
+                        break
+                    await asyncio.sleep(5 * retries)
+                    continue
+                retries = 0
+                if not page:
+                    state["status"] = "done"
+                    break
+
+                sends = []
+                for user_id, language in page:
+                    delay = bucket.delay()
+                    while delay > 0:
+                        await asyncio.sleep(delay)
+                        delay = bucket.delay()
+                    bucket.consume()
+                    text = state["texts"].get(language) or default_text
+                    sends.append(loop.create_task(self._send_one(bot, user_id, text)))
+                results = await asyncio.gather(*sends)
+
+                state["cursor"] = page[-1][0]
+                state["sent"] += sum(results)
+                state["failed"] += len(results) - sum(results)
+                state["elapsed"] += time.monotonic() - started
+                self._save(state)
+                await self._report(bot, state)
+        except asyncio.CancelledError:
+            # A shutdown keeps the broadcast marked running so the next start resumes it
+            if not self._suspended:
+                state["status"] = "cancelled"
+            raise
+        finally:
+            self._save(state)
+            await asyncio.shield(self._report(bot, state))
+            logging.info(self._progress(state))
+
+
+broadcaster = TenantLocal(BroadcastRunner)
+
+
+@admin_only
+async def broadcast_command(update, context) -> None:
+    """/broadcast - announce a message to registered users (admins only)."""
+    chat_id = update.effective_chat.id
+    text = update.message.text
+    arguments = context.args or []
+
+    if arguments[:1] == ["status"]:
+        running = broadcaster.running()
+        reply = "Running broadcasts: " + ", ".join(running) if running else "No broadcasts are running."
+    elif arguments[:1] == ["cancel"] and len(arguments) == 2:
+        reply = "Cancelled." if broadcaster.cancel(arguments[1]) else "No such running broadcast."
+    else:
+        try:
+            states, language, texts = parse_broadcast(text)
+        except ValueError as e:
+            await outbound.send_message(context.bot, chat_id=chat_id, text=f"{e}\n\n{USAGE}")
+            return None
+        state = broadcaster.create(chat_id, states, language, texts)
+        broadcaster.start(context.application, state)
+        reply = f"Broadcast {state['id']} started for languages: {', '.join(sorted(texts))}."
+
+    await outbound.send_message(context.bot, chat_id=chat_id, text=reply)
+    return None
@@ -1,10 +1,235 @@
+import asyncio
 import configparser
+import logging
+import os
 
-def load_config(file_path="config.txt"):
-    """Function to read the configuration from the config.txt file."""
-    config = configparser.ConfigParser()
+DEFAULT_CONFIG_PATH = "config.txt"
+DEFAULT_SECRETS_DIR = "/run/secrets"
+
+REQUIRED = ("TELEGRAM_BOT_TOKEN", "PROMPT")
+
+# Keys that must parse as numbers; everything else is free text
+INTEGER_KEYS = {
+    "ANALYSIS_BATCH_SIZE", "ANALYSIS_MAX_ATTEMPTS", "ANALYSIS_MAX_INTERACTIVE_LLM", "ANALYSIS_MAX_TOKENS",
+    "ANALYSIS_WORKERS", "BROADCAST_PAGE_SIZE", "DAILY_TOKEN_BUDGET", "DEDUPE_WINDOW", "HISTORY_MAX_TURNS",
+    "MAX_INFLIGHT_LLM", "MAX_UPDATE_QUEUE", "METRICS_PORT", "ROUTE_SHORT_MESSAGE_WORDS", "ROUTE_SUMMARY_EVERY",
+    "SWEEP_MAX_WRITES", "TELEGRAM_SEND_WORKERS", "TRANSCRIPT_MAX_BYTES", "TRANSCRIPT_QUEUE_SIZE",
+    "USER_MESSAGE_BURST", "VERIFICATION_MAX_ATTEMPTS",
+}
+FLOAT_KEYS = {
+    "ANALYSIS_POLL_SECONDS", "BROADCAST_RATE", "CONFIG_RELOAD_SECONDS", "HISTORY_COMPRESS_IDLE_SECONDS",
+    "HISTORY_EVICT_IDLE_HOURS", "LLM_FAILURE_COOLDOWN_SECONDS", "LOOP_LAG_INTERVAL", "LOOP_LAG_THRESHOLD",
+    "MESSAGE_DEBOUNCE_SECONDS", "PROFILE_SIGNAL_SECONDS", "SHUTDOWN_DRAIN_SECONDS", "STALE_REGISTRATION_DAYS",
+    "STATS_RECONCILE_SECONDS", "STATS_WINDOW_SECONDS", "SWEEP_INTERVAL_SECONDS", "SWEEP_PAUSE_SECONDS",
+    "TELEGRAM_CHAT_BURST", "TELEGRAM_CHAT_RATE", "TELEGRAM_GLOBAL_RATE", "TRANSCRIPT_ROTATE_SECONDS",
+    "USAGE_FLUSH_SECONDS", "USER_MESSAGES_PER_MINUTE", "VERIFICATION_CODE_TTL_SECONDS",
+    "VERIFICATION_RESEND_COOLDOWN_SECONDS",
+}
+BOOLEAN_KEYS = {"ANALYSIS_SCORE_TURNS", "TRANSCRIPT_EXPORT"}
+
+# HTTP settings per traffic class, see bot/transport.py
+for _traffic in ("UPDATES", "TELEGRAM", "LLM"):
+    INTEGER_KEYS.add(f"TRANSPORT_{_traffic}_POOL_SIZE")
+    FLOAT_KEYS.update(f"TRANSPORT_{_traffic}_{key}" for key in (
+        "KEEPALIVE_SECONDS", "CONNECT_TIMEOUT", "READ_TIMEOUT", "WRITE_TIMEOUT", "POOL_TIMEOUT",
+    ))
+    BOOLEAN_KEYS.add(f"TRANSPORT_{_traffic}_HTTP2")
+del _traffic
+
+# Keys applied to new turns when config.txt changes; the rest need a restart
+RELOADABLE_PREFIXES = ("PROMPT", "GPT_MODEL", "ROUTE_")
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+FALSE_VALUES = {"0", "false", "no", "off", ""}
+
+
+class ConfigError(ValueError):
+    """Raised when config.txt, the environment or a secret holds an invalid value."""
+
+
+def _read_file(file_path):
+    """Parse config.txt into a dict with upper-case keys."""
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str.upper
     with open(file_path, 'r') as f:
-        config_string = '[DEFAULT]\n' + f.read()
-    config.read_string(config_string)
-    return config['DEFAULT']
+        parser.read_string('[DEFAULT]\n' + f.read())
+    return dict(parser['DEFAULT'])
+
+
+def _read_secrets(secrets_dir):
+    """Docker secrets: one file per key, named like the key (any case)."""
+    values = {}
+    if os.path.isdir(secrets_dir):
+        for name in os.listdir(secrets_dir):
+            path = os.path.join(secrets_dir, name)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    values[name.upper()] = f.read().strip()
+    return values
+
+
+def _is_reloadable(key) -> bool:
+    return key.startswith(RELOADABLE_PREFIXES)
+
+
+def validate(values) -> None:
+    """Check required keys and value types, reporting every problem at once."""
+    errors = [f"{key} is missing" for key in REQUIRED if not values.get(key)]
+    for key, value in values.items():
+        try:
+            if key in INTEGER_KEYS:
+                int(value)
+            elif key in FLOAT_KEYS:
+                float(value)
+            elif key in BOOLEAN_KEYS and value.lower() not in TRUE_VALUES | FALSE_VALUES:
+                raise ValueError
+        except ValueError:
+            errors.append(f"{key}={value!r} is not a valid {_type_name(key)}")
+    prompt = values.get("PROMPT")
+    if prompt:
+        try:
+            prompt.format(debate_topic="", debate_side="")
+        except (KeyError, IndexError, ValueError) as e:
+            errors.append(f"PROMPT may only use the {{debate_topic}} and {{debate_side}} placeholders: {e}")
+    if errors:
+        raise ConfigError("Invalid configuration:\n  " + "\n  ".join(errors))
+
+
+def _type_name(key):
+    return "integer" if key in INTEGER_KEYS else "number" if key in FLOAT_KEYS else "boolean (0/1)"
+
+
+class Config:
+    """Validated settings, parsed once and shared by the whole bot.
+
+    Values come from, in order of precedence: environment variables, Docker
+    secrets (files in CONFIG_SECRETS_DIR, default /run/secrets) and
+    config.txt. `get` and `[]` return strings like the configparser section
+    this replaces; numbers and flags are read with `get_int`, `get_float` and
+    `get_bool`, so values are only parsed here and in `validate`.
+
+    `reload()` re-reads config.txt and swaps in new values of the reloadable
+    keys (PROMPT, GPT_MODEL and ROUTE_*) in a single assignment, so a turn
+    that already started keeps the settings it read and the next one uses the
+    new ones. Listeners registered with `on_reload` re-apply derived state.
+
+    `overrides` take precedence over all sources; the multi-bot host uses
+    them for each bot's section of TENANTS_FILE.
+    """
+
+    def __init__(self, file_path=DEFAULT_CONFIG_PATH, environ=None, secrets_dir=None, overrides=None):
+        self.file_path = file_path
+        self._environ = os.environ if environ is None else environ
+        self._secrets_dir = secrets_dir or self._environ.get('CONFIG_SECRETS_DIR', DEFAULT_SECRETS_DIR)
+        self._overrides = dict(overrides or {})
+        self._listeners = []
+        self._file_mtime = self._mtime()
+        self._values = self._merge(_read_file(file_path))
+        validate(self._values)
+
+    def _mtime(self):
+        try:
+            return os.stat(self.file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _merge(self, file_values):
+        values = dict(file_values)
+        values.update(_read_secrets(self._secrets_dir))
+        # Environment variables only override keys the bot knows about
+        for key in set(values) | INTEGER_KEYS | FLOAT_KEYS | BOOLEAN_KEYS | set(REQUIRED):
+            if key in self._environ:
+                values[key] = self._environ[key]
+        values.update(self._overrides)
+        return values
+
+    def __getitem__(self, key):
+        key = key.upper()
+        if key in self._environ and key not in self._values:
+            return self._environ[key]
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key.upper() in self._values or key.upper() in self._environ
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_int(self, key, default=0) -> int:
+        return int(self.get(key, default))
+
+    def get_float(self, key, default=0.0) -> float:
+        return float(self.get(key, default))
+
+    def get_bool(self, key, default=False) -> bool:
+        value = self.get(key)
+        return default if value is None else str(value).lower() in TRUE_VALUES
+
+    def on_reload(self, callback) -> None:
+        """Call `callback(config)` after every successful reload."""
+        self._listeners.append(callback)
+
+    def poll_changed(self) -> bool:
+        """True once for each modification of config.txt since the last check."""
+        mtime = self._mtime()
+        if mtime == self._file_mtime:
+            return False
+        self._file_mtime = mtime
+        return True
+
+    def reload(self, file_values=None) -> list:
+        """Apply reloadable keys from config.txt. Returns the keys that changed.
+
+        Invalid files are rejected as a whole and the running settings stay in
+        place. Changes to other keys are only logged, since they need a restart.
+        """
+        merged = self._merge(_read_file(self.file_path) if file_values is None else file_values)
+        validate(merged)
+
+        changed = sorted(key for key in set(merged) | set(self._values) if merged.get(key) != self._values.get(key))
+        applied = [key for key in changed if _is_reloadable(key)]
+        ignored = [key for key in changed if not _is_reloadable(key)]
+        if ignored:
+            logging.warning(f"Config keys changed that need a restart to take effect: {', '.join(ignored)}")
+        if not applied:
+            return []
+
+        values = dict(self._values)
+        for key in applied:
+            if key in merged:
+                values[key] = merged[key]
+            else:
+                values.pop(key, None)
+        self._values = values
+        for callback in self._listeners:
+            callback(self)
+        logging.info(f"Config reloaded: {', '.join(applied)}")
+        return applied
+
+
+_config = None
+
+
+def load_config(file_path=DEFAULT_CONFIG_PATH):
+    """Return the shared Config, reading config.txt on the first call only."""
+    global _config
+    if _config is None or _config.file_path != file_path:
+        _config = Config(file_path)
+    return _config
+
 
+async def reload_config(context) -> None:
+    """JobQueue callback: apply config.txt changes without a restart."""
+    config = context.bot_data['config']
+    if not config.poll_changed():
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        # Read off the event loop, then swap the values on it
+        file_values = await loop.run_in_executor(None, _read_file, config.file_path)
+        config.reload(file_values)
+    except (OSError, ConfigError, configparser.Error) as e:
+        logging.error(f"Keeping the running configuration, config.txt could not be applied: {e}")
@@ -1 +1,228 @@
-conversation_history = {}
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from array import array
+from collections.abc import Sequence
+
+from bot.tenants import TenantLocal
+
+# Roles are stored as one byte per turn; the strings themselves are interned once
+ROLES = tuple(sys.intern(role) for role in ("system", "user", "assistant"))
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+SYSTEM = ROLES[0]
+
+
+class Conversation:
+    """History of one debate: role codes in a byte array and contents in a list.
+
+    Idle conversations can be packed into a single zlib-compressed blob and
+    are unpacked transparently on the next access.
+    """
+
+    __slots__ = ("roles", "contents", "last_active", "_packed")
+
+    def __init__(self):
+        self.roles = array('B')
+        self.contents = []
+        self.last_active = time.monotonic()
+        self._packed = None
+
+    def __len__(self):
+        return len(self.roles)
+
+    @property
+    def compressed(self) -> bool:
+        return self._packed is not None
+
+    def append(self, role, content) -> None:
+        self._unpack()
+        self.roles.append(ROLE_CODES[role])
+        self.contents.append(content)
+        self.last_active = time.monotonic()
+
+    def trim(self, max_turns) -> None:
+        """Keep only the last `max_turns` turns, never starting with an assistant turn."""
+        if max_turns <= 0 or len(self.roles) <= max_turns:
+            return
+        self._unpack()
+        cut = len(self.roles) - max_turns
+        while cut < len(self.roles) and ROLES[self.roles[cut]] != "user":
+            cut += 1
+        del self.roles[:cut]
+        del self.contents[:cut]
+
+    def turns(self):
+        """Yield (role, content) pairs in order."""
+        self._unpack()
+        for code, content in zip(self.roles, self.contents):
+            yield ROLES[code], content
+
+    def compress(self) -> int:
+        """Pack the contents into a compressed blob. Returns the number of bytes saved."""
+        if self._packed is not None or not self.contents:
+            return 0
+        before = sum(sys.getsizeof(content) for content in self.contents) + sys.getsizeof(self.contents)
+        self._packed = zlib.compress(json.dumps(self.contents, ensure_ascii=False).encode('utf-8'))
+        self.contents = None
+        return max(0, before - sys.getsizeof(self._packed))
+
+    def _unpack(self) -> None:
+        if self._packed is not None:
+            self.contents = json.loads(zlib.decompress(self._packed).decode('utf-8'))
+            self._packed = None
+
+
+class MessagesView(Sequence):
+    """Read-only `[system] + history` payload for the chat completions API.
+
+    The handler no longer builds its own `[system] + history` list; the one
+    list per request is the copy the SDK makes while serialising the payload.
+    """
+
+    __slots__ = ("system_prompt", "conversation")
+
+    def __init__(self, system_prompt, conversation):
+        self.system_prompt = system_prompt
+        self.conversation = conversation
+        conversation._unpack()
+
+    def __len__(self):
+        return 1 + len(self.conversation)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index == 0:
+            return {"role": SYSTEM, "content": self.system_prompt}
+        if not 0 < index < len(self):
+            raise IndexError("message index out of range")
+        return {"role": ROLES[self.conversation.roles[index - 1]], "content": self.conversation.contents[index - 1]}
+
+    def __iter__(self):
+        yield {"role": SYSTEM, "content": self.system_prompt}
+        for code, content in zip(self.conversation.roles, self.conversation.contents):
+            yield {"role": ROLES[code], "content": content}
+
+
+class ConversationStore:
+    """In-memory debate histories keyed by Telegram user id."""
+
+    def __init__(self, max_turns=0):
+        self.max_turns = max_turns
+        self.snapshot_file = ""
+        self._conversations = {}
+
+    def configure(self, config) -> None:
+        self.max_turns = config.get_int('HISTORY_MAX_TURNS', 0)
+        self.snapshot_file = config.get('HISTORY_SNAPSHOT_FILE', '')
+
+    def __contains__(self, user_id):
+        return user_id in self._conversations
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def turn_count(self) -> int:
+        return sum(len(conversation) for conversation in list(self._conversations.values()))
+
+    def get(self, user_id):
+        return self._conversations.get(user_id)
+
+    def reset(self, user_id) -> None:
+        """Start an empty history for the user (new topic or side)."""
+        self._conversations[user_id] = Conversation()
+
+    def drop(self, user_id) -> None:
+        self._conversations.pop(user_id, None)
+
+    def append(self, user_id, role, content) -> None:
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = self._conversations[user_id] = Conversation()
+        conversation.append(role, content)
+        conversation.trim(self.max_turns)
+
+    def messages(self, user_id, system_prompt) -> MessagesView:
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            conversation = self._conversations[user_id] = Conversation()
+        return MessagesView(system_prompt, conversation)
+
+    def compress_idle(self, idle_seconds) -> int:
+        """Compress histories untouched for `idle_seconds`. Returns how many were packed."""
+        cutoff = time.monotonic() - idle_seconds
+        packed = 0
+        for conversation in list(self._conversations.values()):
+            if conversation.last_active < cutoff and not conversation.compressed and len(conversation):
+                conversation.compress()
+                packed += 1
+        return packed
+
+    def active_count(self, idle_seconds) -> int:
+        """Number of non-empty histories with a turn in the last `idle_seconds`."""
+        cutoff = time.monotonic() - idle_seconds
+        return sum(
+            1 for conversation in list(self._conversations.values())
+            if conversation.last_active >= cutoff and len(conversation)
+        )
+
+    def evict_idle(self, idle_seconds) -> int:
+        """Forget histories untouched for `idle_seconds`. Returns how many were removed."""
+        cutoff = time.monotonic() - idle_seconds
+        idle = [user_id for user_id, conversation in self._conversations.items() if conversation.last_active < cutoff]
+        for user_id in idle:
+            del self._conversations[user_id]
+        return len(idle)
+
+    def save(self, path) -> int:
+        """Write every history to a gzip JSON snapshot. Returns the number of debates saved.
+
+        Used at shutdown so a restarted or redeployed bot can continue the
+        debates; the file is replaced atomically.
+        """
+        snapshot = {
+            str(user_id): [[role, content] for role, content in conversation.turns()]
+            for user_id, conversation in list(self._conversations.items())
+            if len(conversation)
+        }
+        with gzip.open(path + ".tmp", 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return len(snapshot)
+
+    def restore(self, path) -> int:
+        """Load a snapshot written by `save` and delete it. Returns the number of debates restored.
+
+        The file is removed so that a later crash cannot bring back histories
+        that were reset after this start.
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        for user_id, turns in snapshot.items():
+            if int(user_id) in self._conversations:
+                continue
+            conversation = self._conversations[int(user_id)] = Conversation()
+            for role, content in turns:
+                conversation.append(role, content)
+        os.remove(path)
+        return len(snapshot)
+
+
+conversation_history = TenantLocal(ConversationStore)
+
+
+async def compress_idle_histories(context) -> None:
+    """JobQueue callback packing histories of users who stopped talking."""
+    config = context.bot_data['config']
+    idle_seconds = config.get_float('HISTORY_COMPRESS_IDLE_SECONDS', 600)
+    packed = conversation_history.compress_idle(idle_seconds)
+    if packed:
+        logging.info(f"Compressed {packed} idle conversation histories")
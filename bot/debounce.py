@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from bot.tenants import TenantLocal
+
+
+class MessageDebouncer:
+    """Collects bursts of consecutive messages per user and flushes them as one turn.
+
+    Every new message from a user restarts that user's timer. Once the user has
+    been quiet for the debounce window, the buffered messages are joined and
+    passed to the flush callback in a single call.
+
+    Turns of one user run one at a time: a burst that closes while the
+    user's previous reply is still generating waits for it and keeps
+    collecting messages, so the history and the replies stay in order.
+
+    At shutdown `flush_now` ends every open window at once and later messages
+    are no longer buffered, so the replies can still be generated before exit.
+    """
+
+    def __init__(self, separator="\n"):
+        self.separator = separator
+        self.closing = False
+        self._buffers = {}
+        self._timers = {}
+        self._flushes = {}
+        # Running flush task per user
+        self._running = {}
+
+    def pending(self, user_id) -> bool:
+        """Return True if the user has buffered messages waiting to be flushed."""
+        return user_id in self._buffers
+
+    async def submit(self, context, user_id, text, window, flush) -> None:
+        """Buffer a message and (re)schedule the flush for the user.
+
+        `flush` is an async callable receiving the merged text. With a window
+        of zero or less, the message is flushed immediately.
+        """
+        if window <= 0 and not self.closing and user_id not in self._buffers and user_id not in self._running:
+            self._running[user_id] = asyncio.current_task()
+            try:
+                await flush(text)
+            finally:
+                self._running.pop(user_id, None)
+            return
+        if self.closing:
+            # Shutting down: flush on the next loop iteration, but still as a tracked task
+            window = 0
+
+        self._buffers.setdefault(user_id, []).append(text)
+        self._flushes[user_id] = flush
+
+        timer = self._timers.get(user_id)
+        if timer is not None and not timer.done():
+            timer.cancel()
+
+        self._timers[user_id] = context.application.create_task(
+            self._flush_later(user_id, window, flush)
+        )
+
+    def active(self) -> int:
+        """Number of users with an open window or a flush still running."""
+        return len(self._timers) + len(self._running)
+
+    def flush_now(self) -> int:
+        """Close every open window immediately. Returns the number of bursts flushed."""
+        self.closing = True
+        loop = asyncio.get_running_loop()
+        flushed = 0
+        for user_id, timer in list(self._timers.items()):
+            if timer.done():
+                continue
+            timer.cancel()
+            self._timers[user_id] = loop.create_task(self._flush_later(user_id, 0, self._flushes[user_id]))
+            flushed += 1
+        return flushed
+
+    def cancel_flushing(self) -> int:
+        """Cancel flushes that are still running or waiting for one. Returns how many were cancelled."""
+        tasks = [task for task in (*self._running.values(), *self._timers.values()) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    async def _flush_later(self, user_id, window, flush) -> None:
+        try:
+            await asyncio.sleep(window)
+            # Wait for the user's previous turn; messages arriving meanwhile join this burst
+            running = self._running.get(user_id)
+            while running is not None:
+                await asyncio.wait({running})
+                running = self._running.get(user_id)
+        except asyncio.CancelledError:
+            # A newer message from the same user restarted the window (or shutdown gave up)
+            return
+
+        # Detach the buffer before generating so messages arriving meanwhile
+        # start a new burst, which waits for this one, instead of being lost
+        parts = self._buffers.pop(user_id, [])
+        self._timers.pop(user_id, None)
+        self._flushes.pop(user_id, None)
+        if not parts:
+            return
+
+        if len(parts) > 1:
+            logging.info(f"Merged {len(parts)} messages from user {user_id} into one turn")
+
+        self._running[user_id] = asyncio.current_task()
+        try:
+            await flush(self.separator.join(parts))
+        except Exception:
+            logging.exception(f"Error flushing debounced messages for user {user_id}")
+        finally:
+            self._running.pop(user_id, None)
+
+
+message_debouncer = TenantLocal(MessageDebouncer)
@@ -0,0 +1,94 @@
+import logging
+
+from telegram.ext import ApplicationHandlerStop
+
+from bot.metrics import registry
+from bot.tenants import TenantLocal, run_blocking
+
+DEFAULT_WINDOW = 10000
+
+duplicates_total = registry.counter(
+    "debatebot_duplicate_updates_total", "Updates dropped because they were already processed",
+)
+
+
+class RecentIds:
+    """Bounded set of the most recently seen ids, backed by a ring buffer."""
+
+    __slots__ = ("_ring", "_seen", "_next")
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        self._ring = [None] * max(1, size)
+        self._seen = set()
+        self._next = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, key):
+        return key in self._seen
+
+    def add(self, key) -> bool:
+        """Remember `key`. Returns False if it was already in the window."""
+        if key in self._seen:
+            return False
+        oldest = self._ring[self._next]
+        if oldest is not None:
+            self._seen.discard(oldest)
+        self._ring[self._next] = key
+        self._next = (self._next + 1) % len(self._ring)
+        self._seen.add(key)
+        return True
+
+
+def update_keys(update):
+    """Ids that identify a delivery: the update itself and, for button presses, the callback query."""
+    keys = [f"u{update.update_id}"]
+    if update.callback_query is not None:
+        keys.append(f"c{update.callback_query.id}")
+    return keys
+
+
+class UpdateDeduplicator:
+    """Drops updates that were already dispatched, before any handler runs.
+
+    Every process checks its own ring buffer of recent update and callback
+    query ids. With DEDUPE_BACKEND=firestore the first sighting of an update
+    id is also claimed in Firestore, so that replicas behind one webhook don't
+    both handle a redelivered update. If the shared check fails, the update is
+    processed, which is the behaviour without deduplication.
+    """
+
+    def __init__(self):
+        self.recent = RecentIds()
+        self.shared = False
+
+    def configure(self, config) -> None:
+        self.recent = RecentIds(config.get_int('DEDUPE_WINDOW', DEFAULT_WINDOW))
+        self.shared = config.get('DEDUPE_BACKEND', 'memory') == 'firestore'
+
+    async def is_duplicate(self, update) -> bool:
+        keys = update_keys(update)
+        # Record every key, so a callback query redelivered in a new update is still caught
+        fresh = [key for key in keys if self.recent.add(key)]
+        if len(fresh) < len(keys):
+            duplicates_total.inc(scope="local")
+            return True
+        if self.shared:
+            # Imported lazily so the in-memory mode works without Firestore
+            from database.database_support import claim_update_id
+            claimed = await run_blocking(claim_update_id, keys[0])
+            if claimed is False:
+                duplicates_total.inc(scope="shared")
+                return True
+        return False
+
+
+deduplicator = TenantLocal(UpdateDeduplicator)
+
+
+async def drop_duplicate_updates(update, context) -> None:
+    """TypeHandler callback registered in the first handler group."""
+    if await deduplicator.is_duplicate(update):
+        logging.info(f"Dropped duplicate update {update.update_id}")
+        raise ApplicationHandlerStop
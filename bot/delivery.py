@@ -0,0 +1,289 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.constants import ChatAction
+from telegram.error import RetryAfter
+
+from bot.rate_limit import TokenBucket
+
+# Lower values are delivered first. Short UI responses (prompts, button
+# confirmations, errors) must never wait behind long GPT replies, and
+# announcements to many users only use capacity nobody else needs.
+PRIORITY_UI = 0
+PRIORITY_REPLY = 10
+PRIORITY_BULK = 20
+
+# Telegram allows roughly 30 messages per second per bot and about one
+# message per second per chat, with short bursts tolerated.
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_RATE = 1
+DEFAULT_CHAT_BURST = 3
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+# Telegram shows a chat action for about 5 seconds
+CHAT_ACTION_REFRESH_SECONDS = 4
+
+
+class _OutboundJob:
+    __slots__ = ("priority", "seq", "bot", "method", "chat_id", "kwargs", "future", "attempts", "edit_key")
+
+    def __init__(self, priority, seq, bot, method, chat_id, kwargs, future, edit_key=None):
+        self.priority = priority
+        self.seq = seq
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        self.edit_key = edit_key
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundQueue:
+    """Single delivery path for everything the bot sends to Telegram.
+
+    Each chat's requests are delivered in the order they were made: only the
+    oldest request of a chat is queued, ordered by priority against the other
+    chats, and the chat's next one follows once it is answered. Requests are
+    throttled by a global and a per-chat token bucket, retried after
+    RetryAfter errors, and consecutive edits of the same message that are
+    still queued are collapsed into one call.
+
+    By default a call returns as soon as the request is queued, so a handler
+    never waits out a chat's rate limit while other updates queue up behind
+    it, and failures are logged. Callers that need the result pass
+    `wait=True` and await it exactly as they would await the bot method
+    itself; errors other than flood control are then re-raised to them.
+    """
+
+    def __init__(self, global_rate=DEFAULT_GLOBAL_RATE, chat_rate=DEFAULT_CHAT_RATE,
+                 chat_burst=DEFAULT_CHAT_BURST, workers=DEFAULT_WORKERS,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._prune_at = 1024
+        self._busy_chats = set()
+        # Requests waiting behind the one in the queue, per chat with a request outstanding
+        self._chat_queues = {}
+        self._waiting = 0
+        self._pending_edits = {}
+        self._queue = None
+        self._tasks = []
+        # Requests waiting out a rate limit or flood wait, with their timers
+        self._deferred = {}
+        self._seq = itertools.count()
+
+    def configure(self, config) -> None:
+        """Apply rate settings from config.txt. Must be called before the first send."""
+        global_rate = config.get_float('TELEGRAM_GLOBAL_RATE', DEFAULT_GLOBAL_RATE)
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = config.get_float('TELEGRAM_CHAT_RATE', DEFAULT_CHAT_RATE)
+        self.chat_burst = config.get_float('TELEGRAM_CHAT_BURST', DEFAULT_CHAT_BURST)
+        self.workers = config.get_int('TELEGRAM_SEND_WORKERS', DEFAULT_WORKERS)
+
+    def depth(self) -> int:
+        """Number of requests waiting to be delivered."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def pending(self) -> int:
+        """Requests not yet answered: queued, waiting out a rate limit, or being sent."""
+        return self.depth() + len(self._deferred) + len(self._busy_chats) + self._waiting
+
+    async def send_message(self, bot, chat_id, text, priority=PRIORITY_UI, wait=False, **kwargs):
+        """Queue `bot.send_message`; with `wait` return the sent Message."""
+        params = dict(kwargs, chat_id=chat_id, text=text)
+        return await self._submit(bot, "send_message", chat_id, priority, params, wait=wait)
+
+    async def send_chat_action(self, bot, chat_id, action, priority=PRIORITY_REPLY, wait=False, **kwargs):
+        """Queue `bot.send_chat_action`."""
+        params = dict(kwargs, chat_id=chat_id, action=action)
+        return await self._submit(bot, "send_chat_action", chat_id, priority, params, wait=wait)
+
+    @contextlib.asynccontextmanager
+    async def typing(self, bot, chat_id):
+        """Keep the typing indicator on in `chat_id` until the block ends."""
+        async def refresh():
+            while True:
+                try:
+                    # Waiting here keeps one action per chat queued; cancelling drops an unsent one
+                    await self.send_chat_action(bot, chat_id=chat_id, action=ChatAction.TYPING, wait=True)
+                except Exception as e:
+                    logging.warning(f"Could not send the typing action to chat {chat_id}: {e}")
+                await asyncio.sleep(CHAT_ACTION_REFRESH_SECONDS)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        try:
+            yield
+        finally:
+            task.cancel()
+
+    async def edit_message_text(self, bot, chat_id, message_id, text, priority=PRIORITY_UI, wait=False, **kwargs):
+        """Queue `bot.edit_message_text`, collapsing it into a still-queued edit of the same message."""
+        params = dict(kwargs, chat_id=chat_id, message_id=message_id, text=text)
+        edit_key = (chat_id, message_id)
+
+        pending = self._pending_edits.get(edit_key)
+        if pending is not None and not pending.future.done():
+            # The earlier edit has not been sent yet; only the latest text matters
+            pending.kwargs = params
+            return await asyncio.shield(pending.future) if wait else None
+
+        return await self._submit(bot, "edit_message_text", chat_id, priority, params, wait=wait, edit_key=edit_key)
+
+    async def _submit(self, bot, method, chat_id, priority, params, wait, edit_key=None):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = _OutboundJob(priority, next(self._seq), bot, method, chat_id, params, future, edit_key)
+        if edit_key is not None:
+            self._pending_edits[edit_key] = job
+        waiting = self._chat_queues.get(chat_id)
+        if waiting is None:
+            self._chat_queues[chat_id] = deque()
+            self._queue.put_nowait(job)
+        else:
+            waiting.append(job)
+            self._waiting += 1
+        if not wait:
+            future.add_done_callback(self._log_failure)
+            return None
+        return await future
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"Could not deliver a queued Telegram request: {future.exception()}")
+
+    def _next_in_chat(self, chat_id) -> None:
+        """Queue the chat's next request after the previous one was answered."""
+        waiting = self._chat_queues.get(chat_id)
+        if waiting:
+            self._waiting -= 1
+            self._queue.put_nowait(waiting.popleft())
+        else:
+            self._chat_queues.pop(chat_id, None)
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self) -> None:
+        """Stop the workers. Requests not sent yet are cancelled, so callers waiting on them return."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        abandoned = list(self._deferred)
+        for handle in self._deferred.values():
+            handle.cancel()
+        while self._queue is not None and not self._queue.empty():
+            abandoned.append(self._queue.get_nowait())
+        for waiting in self._chat_queues.values():
+            abandoned.extend(waiting)
+        for job in abandoned:
+            job.future.cancel()
+        if abandoned:
+            logging.warning(f"Dropped {len(abandoned)} unsent Telegram request(s) on stop")
+        self._tasks = []
+        self._queue = None
+        self._deferred = {}
+        self._chat_queues = {}
+        self._pending_edits = {}
+        self._waiting = 0
+
+    def _defer(self, job, delay) -> None:
+        self._deferred[job] = asyncio.get_running_loop().call_later(delay, self._requeue, job)
+
+    def _requeue(self, job) -> None:
+        self._deferred.pop(job, None)
+        if self._queue is not None:
+            self._queue.put_nowait(job)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._prune_at:
+                self._prune_chat_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        """Drop buckets of chats that are back to full capacity."""
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chat_buckets.items() if b.idle(now) and c not in self._chat_queues]:
+            del self._chat_buckets[chat_id]
+        self._prune_at = max(1024, 2 * len(self._chat_buckets))
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.future.done():
+                # The caller went away (e.g. its task was cancelled)
+                self._forget_edit(job)
+                self._next_in_chat(job.chat_id)
+                continue
+
+            now = time.monotonic()
+            chat_bucket = self._chat_bucket(job.chat_id)
+            # Chat actions are not messages and do not count against the per-chat limit
+            counts_for_chat = job.method != "send_chat_action"
+            wait = max(self._global_bucket.delay(now), chat_bucket.delay(now) if counts_for_chat else 0)
+            if wait > 0:
+                self._defer(job, wait)
+                continue
+
+            self._global_bucket.consume(now)
+            if counts_for_chat:
+                chat_bucket.consume(now)
+            self._forget_edit(job)
+            self._busy_chats.add(job.chat_id)
+            try:
+                result = await getattr(job.bot, job.method)(**job.kwargs)
+            except asyncio.CancelledError:
+                # Stopped mid-send: the request may or may not have been delivered
+                job.future.cancel()
+                raise
+            except RetryAfter as e:
+                job.attempts += 1
+                # A flood wait holds back the whole bot, not only this chat
+                chat_bucket.block(float(e.retry_after))
+                self._global_bucket.block(float(e.retry_after))
+                logging.warning(f"Flood control for chat {job.chat_id}, retrying in {e.retry_after}s")
+                if job.attempts > self.max_retries:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    self._next_in_chat(job.chat_id)
+                else:
+                    # Still the chat's oldest request, so nothing overtakes it
+                    if job.edit_key is not None:
+                        self._pending_edits.setdefault(job.edit_key, job)
+                    self._defer(job, float(e.retry_after))
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                self._next_in_chat(job.chat_id)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+                self._next_in_chat(job.chat_id)
+            finally:
+                self._busy_chats.discard(job.chat_id)
+
+    def _forget_edit(self, job) -> None:
+        if job.edit_key is not None and self._pending_edits.get(job.edit_key) is job:
+            del self._pending_edits[job.edit_key]
+
+
+outbound = OutboundQueue()
@@ -0,0 +1,168 @@
+from collections.abc import Mapping
+
+from telegram import MessageEntity, Update
+from telegram.ext import BaseHandler, ConversationHandler
+
+from bot.utils import load_messages
+from database.database_support import get_user
+
+# Event keys: any text that is not a command, "/<command>", or "callback:<data>"
+TEXT = "text"
+
+
+def command(name) -> str:
+    return f"/{name}"
+
+
+def callback(data) -> str:
+    return f"callback:{data}"
+
+
+def event_of(update):
+    """The event key of an update, or None for updates the debate flow ignores."""
+    query = update.callback_query
+    if query is not None:
+        return callback(query.data)
+    message = update.message
+    if message is None or message.text is None:
+        return None
+    entities = getattr(message, 'entities', None)
+    if entities and entities[0].type == MessageEntity.BOT_COMMAND and entities[0].offset == 0:
+        name, _, addressee = message.text[1:entities[0].length].partition('@')
+        if addressee and addressee.lower() != (update.get_bot().username or '').lower():
+            return None
+        return command(name.lower())
+    return TEXT
+
+
+class UserContext:
+    """The user's Firestore document and message catalog, read once per update.
+
+    Values reflect the document when the update arrived; handlers that change
+    the user write to Firestore and return the new state as before.
+    """
+
+    __slots__ = ("user_id", "data", "_msgs")
+
+    def __init__(self, user_id, data):
+        self.user_id = user_id
+        self.data = data
+        self._msgs = None
+
+    @classmethod
+    def load(cls, user_id) -> "UserContext":
+        return cls(user_id, get_user(user_id))
+
+    @property
+    def exists(self) -> bool:
+        return self.data is not None
+
+    @property
+    def state(self):
+        return self.data.get('conversation_state') if self.data is not None else None
+
+    @property
+    def language(self) -> str:
+        return self.data.get('language') or 'en' if self.data is not None else 'en'
+
+    @property
+    def topic(self):
+        return self.data.get('topic') if self.data is not None else None
+
+    @property
+    def topic_id(self):
+        return self.data.get('topic_id') if self.data is not None else None
+
+    @property
+    def side(self):
+        return self.data.get('side') if self.data is not None else None
+
+    @property
+    def email(self):
+        return self.data.get('email') if self.data is not None else None
+
+    @property
+    def msgs(self) -> Mapping:
+        if self._msgs is None:
+            self._msgs = load_messages(self.language)
+        return self._msgs
+
+
+async def load_user_context(update, context) -> None:
+    """TypeHandler callback: read the user once for every handler of this update."""
+    # Inline queries arrive per keystroke and only search the topic catalog
+    if update.effective_user is not None and update.inline_query is None:
+        context.user_context = UserContext.load(update.effective_user.id)
+
+
+def user_context(update, context) -> UserContext:
+    """The UserContext of this update, loaded here if the middleware did not run."""
+    user = getattr(context, 'user_context', None)
+    if user is None or user.user_id != update.effective_user.id:
+        user = context.user_context = UserContext.load(update.effective_user.id)
+    return user
+
+
+class FlowHandler(BaseHandler):
+    """Finds the handler for an update with one dict lookup on its event key."""
+
+    __slots__ = ("routes",)
+
+    def __init__(self, routes):
+        super().__init__(self.dispatch)
+        self.routes = routes
+
+    async def dispatch(self, update, context):
+        return await self.routes[event_of(update)](update, context)
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        event = event_of(update)
+        return self.routes.get(event) if event is not None else None
+
+    async def handle_update(self, update, application, check_result, context):
+        # check_update already found the handler
+        return await check_result(update, context)
+
+
+class FlowTable:
+    """Declarative transition table of a conversation.
+
+    `states` maps each stored state name to {event: handler}. `every_state`
+    routes apply in all states, `fallbacks` when nothing else matches, and
+    `entry` routes start or restart the conversation from any state. Every
+    handler returns the id of the next state from `state_ids`, or None to
+    stay. The tables are merged once here, so dispatch is one lookup of
+    (state, event) and the ConversationHandler is generated from the same data.
+    """
+
+    def __init__(self, state_ids, entry, states, every_state=None, fallbacks=None):
+        self.state_ids = dict(state_ids)
+        self.entry = dict(entry)
+        self.states = {}
+        self._routes = {}
+        for state, routes in states.items():
+            if state not in self.state_ids:
+                raise ValueError(f"Unknown state {state!r} in the flow table")
+            # Precedence matches ConversationHandler with allow_reentry: entry, state, fallbacks
+            merged = {**(fallbacks or {}), **(every_state or {}), **routes}
+            self.states[state] = merged
+            for event, handler in {**merged, **self.entry}.items():
+                self._routes[(state, event)] = handler
+
+    def route(self, state, event):
+        """The handler for `event` in the stored `state`, or None."""
+        return self._routes.get((state, event))
+
+    def transitions(self):
+        """[(state, event, handler name)] in table order, for docs and checks."""
+        return [(state, event, handler.__name__) for (state, event), handler in self._routes.items()]
+
+    def conversation_handler(self, **kwargs) -> ConversationHandler:
+        return ConversationHandler(
+            entry_points=[FlowHandler(self.entry)],
+            states={self.state_ids[state]: [FlowHandler(routes)] for state, routes in self.states.items()},
+            fallbacks=[],
+            **kwargs,
+        )
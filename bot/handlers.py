@@ -1,26 +1,33 @@
 import logging
+import time
 from datetime import datetime
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import ChatAction
 from telegram.ext import ContextTypes, ConversationHandler
 
+from bot.analysis_jobs import analysis_workers, request_critique, JOB_SCORE
 from bot.conversation_store import conversation_history
-from bot.openai_client import openai_client
+from bot.admission import admission, shed_when_busy
+from bot.debounce import message_debouncer
+from bot.delivery import outbound, PRIORITY_REPLY
+from bot.flow import FlowTable, TEXT, callback, command, event_of, user_context
+from bot.llm import llm_router
+from bot.stats import activity_stats
+from bot.topics import topic_catalog
+from bot.usage import usage_tracker
 from bot.utils import generate_verification_code, load_messages
+from bot.transcripts import transcript_exporter
+from bot.turn_routing import turn_router
+from bot.verification_store import get_verification_store, CODE_OK, CODE_EXPIRED, CODE_TOO_MANY_ATTEMPTS
 from database.database_support import (
     insert_user,
-    user_exists,
-    update_user_email,
     update_user_conversation_state,
     reset_user_registration,
-    get_conversation_state,
-    get_user_email,
-    get_verification_code,
+    complete_email_verification,
     update_user_debate_info,
-    get_user_debate_info,
     delete_user_from_db,
     update_user_language,
-    get_user_language,
 )
 from mail.mail_confirmation import send_email
 from bot.config import load_config
@@ -49,61 +56,78 @@ STATE_MAP = {
 }
 
 
+# Reply to a text or button press that has no transition in the user's stored state
+STATE_HINTS = {
+    'STARTED': "complete_registration",
+    'AWAITING_EMAIL': "complete_registration",
+    'AWAITING_VERIFICATION_CODE': "complete_registration",
+    'VERIFIED': "set_topic_side",
+    'AWAITING_DEBATE_TOPIC': "topic_prompt",
+    'AWAITING_DEBATE_SIDE': "side_prompt",
+    'CHAT_GPT': "continue_using_bot",
+}
+REGISTRATION_STATES = ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE")
+
+
 async def global_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = update.effective_user.id
+    """Handle text and buttons the conversation handler is not tracking, e.g. after a restart.
+
+    The update is routed with the same transition table, using the state stored in Firestore.
+    """
+    user = user_context(update, context)
     chat_id = update.effective_chat.id
-    text = update.message.text.strip()
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
 
     # Check if the user exists in the database
-    if not user_exists(user_id):
-        await context.bot.send_message(
+    if not user.exists:
+        if update.callback_query is not None:
+            await update.callback_query.answer()
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
-            text=msgs["not_registered"]
+            text=user.msgs["not_registered"]
         )
-        return
+        return None
 
-    # Get the user's conversation state from the database
-    conversation_state = get_conversation_state(user_id)
+    handler = DEBATE_FLOW.route(user.state, event_of(update))
+    if handler is not None:
+        return await handler(update, context)
 
-    # Handle based on the conversation state
-    if conversation_state in ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE"):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["complete_registration"]
-        )
-    elif conversation_state == "VERIFIED":
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["set_topic_side"]
-        )
-    elif conversation_state == "AWAITING_DEBATE_TOPIC":
-        # Delegate to receive_topic function
-        await receive_topic(update, context)
-    elif conversation_state == "AWAITING_DEBATE_SIDE":
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["side_prompt"]
-        )
-    elif conversation_state == "CHAT_GPT":
-        # Delegate to gpt_reply function
-        await gpt_reply(update, context)
+    if update.callback_query is not None:
+        await update.callback_query.answer()
+    await outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=user.msgs[STATE_HINTS.get(user.state, "error_processing")]
+    )
+    return None
+
+
+async def _reject_unregistered(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Tell users who have not finished registering what to do. Returns True if the update was rejected."""
+    user = user_context(update, context)
+    if not user.exists:
+        message = "not_registered"
+    elif user.state in REGISTRATION_STATES:
+        message = "complete_registration"
     else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["error_processing"]
-        )
-    return conversation_state
+        return False
+
+    await outbound.send_message(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        text=user.msgs[message],
+    )
+    return True
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for the /start command."""
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
+    user = user_context(update, context)
 
     # Check if the user exists in the database
-    if not user_exists(user_id):
+    if not user.exists:
         # New user, insert into database with STARTED status
         insert_user(
             user_id,
@@ -122,7 +146,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await context.bot.send_message(
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text="Welcome! Please choose your language:\nДобро пожаловать! Пожалуйста, выберите язык:",
             reply_markup=reply_markup,
@@ -130,47 +155,52 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return STARTED
 
     else:
-        # Get user's language
-        language = get_user_language(user_id)
-        msgs = load_messages(language)
-
-        # Get the user's conversation state from the database
-        conversation_state = get_conversation_state(user_id)
+        msgs = user.msgs
+        conversation_state = user.state
 
         if conversation_state == "STARTED":
             # User already started but not registered
             keyboard = [[InlineKeyboardButton(msgs["register_button"], callback_data="register")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["register_prompt"],
                 reply_markup=reply_markup,
             )
             return STARTED
 
-        elif conversation_state == "AWAITING_EMAIL":
+        elif (conversation_state in ("AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE")
+              and get_verification_store().get(user_id) is None):
+            if conversation_state == "AWAITING_VERIFICATION_CODE":
+                # The code expired or was lost on restart; ask for the email again
+                update_user_conversation_state(user_id, "AWAITING_EMAIL")
+
             # Include cancel button
             keyboard = [[InlineKeyboardButton(msgs["cancel_button"], callback_data="cancel_registration")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             # User is awaiting email input
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["enter_email_prompt"],
                 reply_markup=reply_markup,
             )
             return AWAITING_EMAIL
 
-        elif conversation_state == "AWAITING_VERIFICATION_CODE":
-            # User is registered but awaiting verification
+        elif conversation_state in ("AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE"):
+            # A code is pending
             keyboard = [
                 [InlineKeyboardButton(msgs["resend_verification"], callback_data="resend_verification")],
                 [InlineKeyboardButton(msgs["cancel_button"], callback_data="cancel_registration")],
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            email = get_user_email(user_id)
-            await context.bot.send_message(
+            pending = get_verification_store().get(user_id)
+            email = pending.email if pending else user.email
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["verification_sent"].format(email=email),
                 reply_markup=reply_markup,
@@ -179,15 +209,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
         elif conversation_state == "VERIFIED":
             # User is registered and verified
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
-                text=msgs["welcome_back"],
+                text=msgs["set_topic_side"],
             )
             return VERIFIED
 
         elif conversation_state == "AWAITING_DEBATE_TOPIC":
             # User is awaiting debate topic
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["topic_prompt"],
             )
@@ -195,7 +227,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
         elif conversation_state == "AWAITING_DEBATE_SIDE":
             # User is awaiting debate side
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["side_prompt"],
             )
@@ -203,9 +236,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
         elif conversation_state == "CHAT_GPT":
             # User can use the GPT chat
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
-                text=msgs["you_can_use_bot"],
+                text=msgs["continue_using_bot"],
             )
             return CHAT_GPT
 
@@ -214,8 +248,7 @@ async def receive_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     """Handler for receiving the email."""
     user_id = update.message.from_user.id
     email = update.message.text.strip()
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    msgs = user_context(update, context).msgs
     logging.info(f"User {user_id} entered email: {email}")
 
     # Check if the email belongs to the allowed domains
@@ -226,31 +259,37 @@ async def receive_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         keyboard = [[InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(
-            msgs["invalid_email"],
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["invalid_email"],
             reply_markup=reply_markup
         )
         return AWAITING_EMAIL
 
+    # Protect the SMTP account from cancel-and-retry loops as well as resend clicks
+    verification_store = get_verification_store()
+    wait = verification_store.resend_wait(user_id, email)
+    if wait > 0:
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["resend_cooldown"].format(seconds=int(wait) + 1),
+        )
+        return AWAITING_EMAIL
+
     # Generate verification code
     verification_code = generate_verification_code()
     logging.info(f"Generated verification code for user {user_id}: {verification_code}")
 
-    # Update the user's email and verification code in the database
-    try:
-        update_user_email(user_id, new_email=email, verification_code=verification_code)
-        logging.info(f"Updated email and verification code for user {user_id} in the database")
-    except Exception as e:
-        logging.exception(f"Exception updating user {user_id} in the database")
-        await update.message.reply_text(
-            msgs["error_processing"]
-        )
-        return ConversationHandler.END
+    # Keep the pending code in memory only; Firestore records the state, and the email once verified
+    verification_store.issue(user_id, email, verification_code)
 
     try:
         # Send the verification code via email
         send_email(email, verification_code)
         logging.info(f"Sent verification email to {email}")
+        update_user_conversation_state(user_id, 'AWAITING_VERIFICATION_CODE')
 
         # Add buttons to resend the verification code and cancel
         keyboard = [
@@ -259,16 +298,21 @@ async def receive_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(
-            msgs["verification_sent"].format(email=email),
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["verification_sent"].format(email=email),
             reply_markup=reply_markup
         )
         return AWAITING_VERIFICATION_CODE
 
     except Exception as e:
         logging.exception(f"Error sending verification email to {email}")
-        await update.message.reply_text(
-            msgs["error_processing"]
+        verification_store.discard(user_id)
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["error_processing"]
         )
         return ConversationHandler.END
 
@@ -277,109 +321,154 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     """Handler for verifying the code."""
     user_id = update.message.from_user.id
     entered_code = update.message.text.strip()
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
-
-    # Get the correct code from the database
-    correct_code = get_verification_code(user_id)
+    msgs = user_context(update, context).msgs
 
-    if correct_code is None:
-        await update.message.reply_text(msgs["error_processing"])
-        return ConversationHandler.END
+    verification_store = get_verification_store()
+    pending = verification_store.get(user_id)
+    result = verification_store.check(user_id, entered_code)
 
-    if entered_code == str(correct_code):
-        # Update the user's state to VERIFIED
-        update_user_conversation_state(user_id, 'VERIFIED')
+    if result == CODE_OK:
+        # Store the verified email and update the user's state to VERIFIED
+        complete_email_verification(user_id, pending.email)
 
-        await update.message.reply_text(
-            msgs["verified"],
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["verified"],
         )
         return VERIFIED
-    else:
-        # Incorrect code
-        keyboard = [
-            [InlineKeyboardButton(msgs["resend_verification"], callback_data='resend_verification')],
-            [InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(
-            msgs["incorrect_code"],
-            reply_markup=reply_markup
+    if result == CODE_EXPIRED:
+        # The code timed out (or the bot restarted); ask for the email again
+        update_user_conversation_state(user_id, 'AWAITING_EMAIL')
+        keyboard = [[InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]]
+        await outbound.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=msgs["verification_expired"],
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        return AWAITING_VERIFICATION_CODE
+        return AWAITING_EMAIL
+
+    # Incorrect code, or too many attempts with this code
+    keyboard = [
+        [InlineKeyboardButton(msgs["resend_verification"], callback_data='resend_verification')],
+        [InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await outbound.send_message(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        text=msgs["too_many_attempts"] if result == CODE_TOO_MANY_ATTEMPTS else msgs["incorrect_code"],
+        reply_markup=reply_markup
+    )
+    return AWAITING_VERIFICATION_CODE
 
 
 async def resend_verification(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for resending the verification email."""
     query = update.callback_query
     user_id = query.from_user.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     await query.answer()
 
-    # Get user's email from the database
-    email = get_user_email(user_id)
+    verification_store = get_verification_store()
+    pending = verification_store.get(user_id)
+
+    if pending is None:
+        # Nothing pending: either already verified or the code expired
+        if user.state == 'VERIFIED':
+            await outbound.edit_message_text(
+                context.bot,
+                chat_id=query.message.chat_id,
+                message_id=query.message.message_id,
+                text=msgs["verified"],
+            )
+            return ConversationHandler.END
+
+        update_user_conversation_state(user_id, 'AWAITING_EMAIL')
+        keyboard = [[InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]]
+        await outbound.edit_message_text(
+            context.bot,
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id,
+            text=msgs["verification_expired"],
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+        return AWAITING_EMAIL
+
+    # Keep the same buttons
+    keyboard = [
+        [InlineKeyboardButton(msgs["resend_verification"], callback_data='resend_verification')],
+        [InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # Protect the SMTP account from repeated resend clicks
+    wait = verification_store.resend_wait(user_id, pending.email)
+    if wait > 0:
+        await outbound.send_message(
+            context.bot,
+            chat_id=query.message.chat_id,
+            text=msgs["resend_cooldown"].format(seconds=int(wait) + 1),
+        )
+        return AWAITING_VERIFICATION_CODE
+
+    email = pending.email
 
     # Generate a new verification code
     verification_code = generate_verification_code()
-    conversation_state = get_conversation_state(user_id)
-
-    if conversation_state == 'VERIFIED':
-        # User is already verified
-        await query.edit_message_text(msgs["verified"])
-        return ConversationHandler.END
-    else:
-        try:
-            # Send the verification code to the user's email
-            send_email(email, verification_code)
 
-            # Update the verification code in the database
-            update_user_email(user_id, email, verification_code)
+    try:
+        # Send the verification code to the user's email
+        send_email(email, verification_code)
 
-            # Keep the same buttons
-            keyboard = [
-                [InlineKeyboardButton(msgs["resend_verification"], callback_data='resend_verification')],
-                [InlineKeyboardButton(msgs["cancel_button"], callback_data='cancel_registration')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        # Replace the pending code
+        verification_store.issue(user_id, email, verification_code)
 
-            # Add timestamp for uniqueness
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Add timestamp for uniqueness
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            # Edit the existing message with updated text
-            await context.bot.edit_message_text(
-                chat_id=query.message.chat_id,
-                message_id=query.message.message_id,
-                text=msgs["verification_resent"].format(email=email, timestamp=timestamp),
-                reply_markup=reply_markup
-            )
+        # Edit the existing message with updated text
+        await outbound.edit_message_text(
+            context.bot,
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id,
+            text=msgs["verification_resent"].format(email=email, timestamp=timestamp),
+            reply_markup=reply_markup
+        )
 
-        except Exception as e:
-            logging.exception("Exception in resend_verification handler")
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=msgs["failed_resend"]
-            )
-            return ConversationHandler.END
+    except Exception as e:
+        logging.exception("Exception in resend_verification handler")
+        await outbound.send_message(
+            context.bot,
+            chat_id=query.message.chat_id,
+            text=msgs["failed_resend"]
+        )
+        return ConversationHandler.END
 
-        return AWAITING_VERIFICATION_CODE
+    return AWAITING_VERIFICATION_CODE
 
 
 async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for canceling the registration."""
     query = update.callback_query
     user_id = query.from_user.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    msgs = user_context(update, context).msgs
 
     # Reset the user's registration data
     reset_user_registration(user_id)
+    get_verification_store().discard(user_id)
 
     await query.answer()
     # Send a message indicating that registration has been canceled
-    await query.edit_message_text(
+    await outbound.edit_message_text(
+        context.bot,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
         text=msgs["registration_canceled"],
     )
 
@@ -387,7 +476,8 @@ async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
     keyboard = [[InlineKeyboardButton(msgs["register_button"], callback_data='register')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=msgs["register_prompt"],
         reply_markup=reply_markup
@@ -397,27 +487,15 @@ async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for the /menu command."""
-    user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     # Check if user is registered and verified
-    if not user_exists(user_id):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["not_registered"],
-        )
+    if await _reject_unregistered(update, context):
         return None
 
-    conversation_state = get_conversation_state(user_id)
-
-    if conversation_state in ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE"):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["complete_registration"],
-        )
-        return None
+    conversation_state = user.state
 
     # Include buttons to change topic and side
     keyboard = [
@@ -428,7 +506,8 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text=msgs["choose_option"],
         reply_markup=reply_markup,
@@ -441,22 +520,23 @@ async def handle_verified_text(update: Update, context: ContextTypes.DEFAULT_TYP
     """Handle text messages in VERIFIED state."""
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     # Check if user has set topic and side
-    user_info = get_user_debate_info(user_id)
-    if user_info and all(user_info):
+    if user.topic and user.side:
         # If topic and side are set, update state to CHAT_GPT
         update_user_conversation_state(user_id, 'CHAT_GPT')
-        await context.bot.send_message(
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=msgs["debate_ready"]
         )
         return CHAT_GPT
     else:
         # Prompt the user to set topic and side
-        await context.bot.send_message(
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=msgs["set_topic_side"]
         )
@@ -468,38 +548,28 @@ async def change_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     query = update.callback_query
     user_id = query.from_user.id
     chat_id = query.message.chat_id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     await query.answer()
 
-    if not user_exists(user_id):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["not_registered"],
-        )
-        return None
-
-    conversation_state = get_conversation_state(user_id)
-
-    if conversation_state in ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE"):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["complete_registration"],
-        )
+    if await _reject_unregistered(update, context):
         return None
 
     # Save the previous state
-    context.user_data["previous_state"] = conversation_state
+    context.user_data["previous_state"] = user.state
 
     update_user_conversation_state(user_id, "AWAITING_DEBATE_TOPIC")
 
-    # Include cancel button
+    # Include cancel button, and a button searching the topic catalog inline when there is one
     keyboard = [[InlineKeyboardButton(msgs["cancel_button"], callback_data="cancel_change_topic")]]
+    if len(topic_catalog):
+        keyboard.insert(0, [InlineKeyboardButton(msgs["browse_topics_button"], switch_inline_query_current_chat="")])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Prompt the user to enter the debate topic
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text=msgs["topic_prompt"],
         reply_markup=reply_markup,
@@ -513,15 +583,20 @@ async def receive_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     user_id = update.message.from_user.id
     chat_id = update.effective_chat.id
     topic = update.message.text.strip()
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
+
+    # Catalog topics (usually picked from the inline search) are stored with their id
+    topic_id = topic_catalog.match(topic)
 
-    user_info = get_user_debate_info(user_id)
     # Update the topic in the database
-    update_user_debate_info(user_id, topic, user_info[1])
+    update_user_debate_info(user_id, topic, user.side, topic_id)
 
     # Clear the conversation history
-    conversation_history[user_id] = []
+    conversation_history.reset(user_id)
+    transcript_exporter.record(
+        "topic", user_id, topic=topic, topic_id=topic_id, side=user.side, language=user.language,
+    )
 
     update_user_conversation_state(user_id, 'AWAITING_DEBATE_SIDE')
 
@@ -534,7 +609,8 @@ async def receive_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Ask the user to choose a side (For/Against)
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text=msgs["topic_set"].format(topic=topic),
         reply_markup=reply_markup
@@ -548,29 +624,16 @@ async def change_side_entry_point(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     user_id = query.from_user.id
     chat_id = query.message.chat_id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     await query.answer()
 
-    if not user_exists(user_id):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["not_registered"],
-        )
-        return None
-
-    conversation_state = get_conversation_state(user_id)
-
-    if conversation_state in ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE"):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=msgs["complete_registration"],
-        )
+    if await _reject_unregistered(update, context):
         return None
 
     # Save the previous state
-    context.user_data["previous_state"] = conversation_state
+    context.user_data["previous_state"] = user.state
 
     update_user_conversation_state(user_id, "AWAITING_DEBATE_SIDE")
 
@@ -583,7 +646,8 @@ async def change_side_entry_point(update: Update, context: ContextTypes.DEFAULT_
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Prompt the user to choose a side
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text=msgs["side_prompt"],
         reply_markup=reply_markup,
@@ -596,8 +660,7 @@ async def cancel_change_topic(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Handler to cancel changing the topic."""
     query = update.callback_query
     user_id = query.from_user.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    msgs = user_context(update, context).msgs
 
     # Retrieve the previous state
     previous_state = context.user_data.get("previous_state", "VERIFIED")
@@ -607,9 +670,15 @@ async def cancel_change_topic(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     await query.answer()
     # Send a message indicating that the topic change has been canceled
-    await query.edit_message_text(text=msgs["topic_change_canceled"])
+    await outbound.edit_message_text(
+        context.bot,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
+        text=msgs["topic_change_canceled"],
+    )
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=msgs["continue_using_bot"],
     )
@@ -624,8 +693,7 @@ async def cancel_change_side(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Handler to cancel changing the side."""
     query = update.callback_query
     user_id = query.from_user.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    msgs = user_context(update, context).msgs
 
     # Retrieve the previous state
     previous_state = context.user_data.get("previous_state", "CHAT_GPT")
@@ -635,9 +703,15 @@ async def cancel_change_side(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await query.answer()
     # Send a message indicating that the side change has been canceled
-    await query.edit_message_text(text=msgs["side_change_canceled"])
+    await outbound.edit_message_text(
+        context.bot,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
+        text=msgs["side_change_canceled"],
+    )
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=msgs["continue_using_bot"],
     )
@@ -655,147 +729,236 @@ async def select_side(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     side = query.data  # 'for' or 'against'
 
     chat_id = update.effective_chat.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    msgs = user.msgs
 
     if side in ['for', 'against']:
-        if not user_exists(user_id):
-            await context.bot.send_message(
+        if not user.exists:
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["not_registered"]
             )
             return None
 
         # Update side in the database
-        user_info = get_user_debate_info(user_id)
-        topic = user_info[0] if user_info else None
-        update_user_debate_info(user_id, topic, side)
+        topic = user.topic
+        update_user_debate_info(user_id, topic, side, user.topic_id)
 
         # Clear the conversation history
-        conversation_history[user_id] = []
+        conversation_history.reset(user_id)
+        transcript_exporter.record(
+            "side", user_id, topic=topic, topic_id=user.topic_id, side=side, language=user.language,
+        )
 
         await query.answer()
-        await query.edit_message_text(
+        await outbound.edit_message_text(
+            context.bot,
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id,
             text=msgs["side_set"].format(side=side)
         )
         update_user_conversation_state(user_id, 'CHAT_GPT')
         return CHAT_GPT
 
     else:
-        await context.bot.send_message(
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=msgs["invalid_selection"]
         )
         return AWAITING_DEBATE_SIDE
 
 
+async def generate_debate_reply(context, user_id, chat_id, user_message, debate_topic, debate_side, msgs,
+                                language=None, topic_id=None) -> None:
+    """Generate and send the GPT reply for one (possibly merged) user turn."""
+    # Pick the model tier and output cap from the turn before it is added to the history
+    conversation = conversation_history.get(user_id)
+    route = turn_router.choose(user_message, len(conversation) if conversation else 0)
+
+    # Add the user's message to the conversation history
+    conversation_history.append(user_id, "user", user_message)
+    transcript = dict(topic=debate_topic, topic_id=topic_id, side=debate_side, language=language)
+    transcript_exporter.record("message", user_id, role="user", content=user_message, **transcript)
+
+    # Get the config from context.bot_data
+    config = context.bot_data.get('config', {})
+
+    # Get the prompt from the config
+    prompt_template = config.get('PROMPT', '')
+    logging.debug(f"Prompt template: {prompt_template}")
+
+    # Format the prompt with debate_topic and debate_side
+    prompt = prompt_template.format(debate_topic=debate_topic, debate_side=debate_side)
+
+    # Add the prompt and conversation history; the SDK makes the only copy of the turns
+    messages = conversation_history.messages(user_id, prompt)
+
+    usage = None
+    started = time.monotonic()
+    try:
+        async with outbound.typing(context.bot, chat_id):
+            with admission.llm_call():
+                # Stream the response from the first available LLM backend
+                response = ""
+                async for chunk in llm_router.stream(messages, model=route.model, max_tokens=route.max_tokens or None):
+                    if chunk.usage:
+                        usage = chunk.usage
+                        usage_tracker.record(user_id, usage.prompt_tokens, usage.completion_tokens)
+                    response += chunk.text
+
+        # Check if the response is empty
+        if not response.strip():
+            raise ValueError("Received empty response from the LLM backend")
+
+        latency = time.monotonic() - started
+        turn_router.observe(route, latency, usage)
+        activity_stats.reply(latency)
+
+        # Add GPT's response to the conversation history
+        conversation_history.append(user_id, "assistant", response)
+        transcript_exporter.record(
+            "message", user_id, role="assistant", content=response,
+            latency_ms=round(latency * 1000),
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+            **transcript,
+        )
+
+        # Send the generated reply to the user
+        await outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=response,
+            priority=PRIORITY_REPLY,
+            wait=True,
+        )
+
+        # Argument scoring runs later in the background workers
+        if analysis_workers.score_turns:
+            await analysis_workers.enqueue(JOB_SCORE, user_id, chat_id, {
+                "topic": debate_topic,
+                "side": debate_side,
+                "argument": user_message,
+            })
+    except Exception as e:
+        logging.exception("Error during GPT reply")
+        await outbound.send_message(
+            context.bot,
+            chat_id=chat_id, text=msgs["error_processing"]
+        )
+
+
+@shed_when_busy
 async def gpt_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for GPT chat replies."""
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     user_message = update.message.text.strip()
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    user = user_context(update, context)
+    language = user.language
+    msgs = user.msgs
 
     # Check if the user is registered and in CHAT_GPT state
-    if not user_exists(user_id):
-        await context.bot.send_message(
+    if not user.exists:
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=msgs["not_registered"],
         )
         return None
 
-    conversation_state = get_conversation_state(user_id)
-
-    if conversation_state != "CHAT_GPT":
-        await context.bot.send_message(
+    if user.state != "CHAT_GPT":
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
-            text=msgs["finish_registration"],
+            text=msgs["complete_registration"],
         )
         return None
 
-    user_info = get_user_debate_info(user_id)
-    if not user_info:
-        await context.bot.send_message(
+    topic, side = user.topic, user.side
+    if not topic or not side:
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
             text=msgs["set_topic_side"],
         )
         return None
 
-    topic, side = user_info  # Unpack the tuple
-    if not topic or not side:
-        await context.bot.send_message(
+    # Per-user flood protection and daily token budget
+    if not usage_tracker.allow_message(user_id):
+        await outbound.send_message(
+            context.bot,
             chat_id=chat_id,
-            text=msgs["set_topic_side"],
+            text=msgs["too_many_messages"],
         )
         return None
 
-    debate_topic = topic
-    debate_side = side
-
-    # Initialize conversation history if not present
-    if user_id not in conversation_history:
-        conversation_history[user_id] = []
-
-    # Add the user's message to the conversation history
-    conversation_history[user_id].append({"role": "user", "content": user_message})
-
-    # Get the config from context.bot_data
-    config = context.bot_data.get('config', {})
+    if usage_tracker.over_budget(user_id):
+        await outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=msgs["daily_budget_exceeded"],
+        )
+        return None
 
-    # Get the prompt and model from the config
-    prompt_template = config.get('PROMPT', '')
-    print(f"Prompt template: {prompt_template}")  # Debug print statement
+    activity_stats.message()
 
-    gpt_model = config.get('GPT_MODEL', '')
+    # Show the typing indicator while the burst window is open; generate_debate_reply keeps it on
+    await outbound.send_chat_action(context.bot, chat_id=chat_id, action=ChatAction.TYPING)
 
-    # Format the prompt with debate_topic and debate_side
-    prompt = prompt_template.format(debate_topic=debate_topic, debate_side=debate_side)
+    config = context.bot_data['config']
+    window = config.get_float('MESSAGE_DEBOUNCE_SECONDS', 1.5)
 
-    # Add the prompt and conversation history
-    messages = [{"role": "system", "content": prompt}] + conversation_history[user_id]
+    async def flush(merged_message):
+        await generate_debate_reply(context, user_id, chat_id, merged_message, topic, side, msgs, language,
+                                    user.topic_id)
 
-    try:
-        # Generate the response using OpenAI GPT, keeping your existing method
-        stream = openai_client.chat.completions.create(
-            model=gpt_model,
-            messages=messages,
-            stream=True,
-        )
+    await message_debouncer.submit(context, user_id, user_message, window, flush)
 
-        response = ""
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            if hasattr(delta, 'content') and delta.content:
-                response += delta.content
+    return CHAT_GPT
 
-        # Check if the response is empty
-        if not response.strip():
-            raise ValueError("Received empty response from OpenAI API")
 
-        # Add GPT's response to the conversation history
-        conversation_history[user_id].append({"role": "assistant", "content": response})
+async def feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler for the /feedback command: queue a critique of the current debate."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    user = user_context(update, context)
+    language = user.language
+    msgs = user.msgs
 
-        # Send the generated reply to the user
-        await context.bot.send_message(
-            chat_id=chat_id, text=response
+    if not user.exists:
+        await outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=msgs["not_registered"],
         )
-    except Exception as e:
-        logging.exception("Error during GPT reply")
-        await context.bot.send_message(
-            chat_id=chat_id, text=msgs["error_processing"]
+        return None
+
+    topic, side = user.topic, user.side
+    if not topic or not side or not await request_critique(user_id, chat_id, topic, side, language):
+        await outbound.send_message(
+            context.bot,
+            chat_id=chat_id,
+            text=msgs["feedback_nothing"],
         )
+        return None
 
-    return CHAT_GPT
+    await outbound.send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=msgs["feedback_queued"],
+    )
+    return None
 
 
 async def change_language_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for the /language command to change the user's language preference."""
-    user_id = update.effective_user.id
     chat_id = update.effective_chat.id
 
     # Retrieve user's current conversation state
-    conversation_state = get_conversation_state(user_id)
+    conversation_state = user_context(update, context).state
     if conversation_state is None:
         conversation_state = 'STARTED'
 
@@ -809,7 +972,8 @@ async def change_language_command(update: Update, context: ContextTypes.DEFAULT_
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text="Please choose your language:\nПожалуйста, выберите язык:",
         reply_markup=reply_markup,
@@ -844,19 +1008,23 @@ async def select_language(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # Now inform the user
     msg = msgs['language_changed']
-    await query.edit_message_text(
+    await outbound.edit_message_text(
+        context.bot,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
         text=msg,
     )
 
-    # Get the user's conversation state from the database
-    conversation_state = get_conversation_state(user_id)
+    # The language update does not change the conversation state read with the update
+    conversation_state = user_context(update, context).state
     # Check if the user is registered
     if conversation_state == "STARTED":
             # User already started but not registered
             keyboard = [[InlineKeyboardButton(msgs["register_button"], callback_data="register")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await context.bot.send_message(
+            await outbound.send_message(
+                context.bot,
                 chat_id=chat_id,
                 text=msgs["register_prompt"],
                 reply_markup=reply_markup,
@@ -873,8 +1041,7 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handler for the registration process."""
     query = update.callback_query
     user_id = query.from_user.id
-    language = get_user_language(user_id)
-    msgs = load_messages(language)
+    msgs = user_context(update, context).msgs
 
     await query.answer()
 
@@ -886,7 +1053,10 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Prompt the user to enter their email
-    await query.edit_message_text(
+    await outbound.edit_message_text(
+        context.bot,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
         text=msgs["enter_email_prompt"],
         reply_markup=reply_markup,
     )
@@ -903,11 +1073,70 @@ async def delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     delete_user_from_db(user_id)
 
     # Remove user from conversation history if present
-    conversation_history.pop(user_id, None)
+    conversation_history.drop(user_id)
+    await analysis_workers.forget_user(user_id)
 
-    await context.bot.send_message(
+    await outbound.send_message(
+        context.bot,
         chat_id=chat_id,
         text="Your data has been deleted. To start again, use the /start command.",
     )
 
-    return ConversationHandler.END
\ No newline at end of file
+    return ConversationHandler.END
+
+# The debate flow: which handler serves each event in each stored conversation state.
+# main.py generates the ConversationHandler from this table and global_message_handler
+# uses it for users whose conversation the handler is not tracking.
+DEBATE_FLOW = FlowTable(
+    STATE_MAP,
+    entry={
+        command("start"): start,
+        command("menu"): menu,
+        command("language"): change_language_command,
+        callback("register"): register,
+    },
+    states={
+        'STARTED': {
+            callback("register"): register,
+            callback("cancel_registration"): cancel_registration,
+        },
+        'AWAITING_EMAIL': {
+            TEXT: receive_email,
+            callback("cancel_registration"): cancel_registration,
+        },
+        'AWAITING_VERIFICATION_CODE': {
+            TEXT: verify_code,
+            callback("resend_verification"): resend_verification,
+            callback("cancel_registration"): cancel_registration,
+        },
+        'VERIFIED': {
+            callback("change_topic"): change_topic,
+            callback("change_side"): change_side_entry_point,
+            TEXT: handle_verified_text,
+        },
+        'AWAITING_DEBATE_TOPIC': {
+            TEXT: receive_topic,
+            callback("cancel_change_topic"): cancel_change_topic,
+        },
+        'AWAITING_DEBATE_SIDE': {
+            callback("for"): select_side,
+            callback("against"): select_side,
+            callback("cancel_change_topic"): cancel_change_topic,
+            callback("cancel_change_side"): cancel_change_side,
+        },
+        'CHAT_GPT': {
+            callback("change_topic"): change_topic,
+            callback("change_side"): change_side_entry_point,
+            TEXT: gpt_reply,
+        },
+    },
+    every_state={
+        callback("language_en"): select_language,
+        callback("language_ru"): select_language,
+    },
+    fallbacks={
+        callback("cancel_registration"): cancel_registration,
+        callback("cancel_change_topic"): cancel_change_topic,
+        callback("cancel_change_side"): cancel_change_side,
+    },
+)
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import threading
+import time
+
+from openai import AsyncOpenAI
+
+from bot.metrics import registry
+from bot.transport import http_transport
+
+DEFAULT_FAILURE_COOLDOWN = 30.0
+DEFAULT_TIMEOUT = 60.0
+# Weight of the newest sample in the moving average of time to first token
+LATENCY_SMOOTHING = 0.2
+
+first_token_histogram = registry.histogram(
+    "debatebot_llm_first_token_seconds", "Time from request to the first streamed token, per backend",
+)
+llm_failures_total = registry.counter("debatebot_llm_failures_total", "LLM requests that failed, per backend")
+
+
+class LLMChunk:
+    """One streamed piece of a reply. The last chunk may carry only usage."""
+
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text="", usage=None):
+        self.text = text
+        self.usage = usage
+
+
+class Usage:
+    __slots__ = ("prompt_tokens", "completion_tokens")
+
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMBackend:
+    """Interface for a chat model that streams its reply."""
+
+    # Whether a per-turn model name may replace the configured one
+    accepts_model_override = False
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+
+    def stream(self, messages, model=None, max_tokens=None):
+        """Return an async iterator of LLMChunk for the given chat messages."""
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI, or any server speaking the OpenAI chat completions API (vLLM, llama.cpp, Ollama)."""
+
+    def __init__(self, name, model, api_key, base_url=None, timeout=DEFAULT_TIMEOUT, stream_usage=True,
+                 accepts_model_override=True, http_client=None):
+        super().__init__(name, model)
+        self.client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url or None, timeout=timeout, http_client=http_client,
+        )
+        self.stream_usage = stream_usage
+        self.accepts_model_override = accepts_model_override
+
+    async def stream(self, messages, model=None, max_tokens=None):
+        kwargs = {}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        if self.stream_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        stream = await self.client.chat.completions.create(
+            model=model or self.model,
+            # The SDK copies the view into its own list while building the payload
+            messages=messages,
+            stream=True,
+            **kwargs,
+        )
+        async for chunk in stream:
+            # The final chunk carries token usage and no choices
+            usage = Usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens) if chunk.usage else None
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text or usage:
+                yield LLMChunk(text or "", usage)
+
+
+class LocalCPUBackend(LLMBackend):
+    """In-process GGUF model via llama-cpp-python, for running without any API.
+
+    llama-cpp-python is an optional dependency and is only imported when a
+    backend of this type is configured. Generation runs in a worker thread,
+    one request at a time, and tokens are handed to the event loop as they
+    are produced.
+    """
+
+    def __init__(self, name, model_path, context_size=4096, threads=None):
+        super().__init__(name, model_path)
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError(
+                f"LLM backend '{name}' needs llama-cpp-python: pip install llama-cpp-python"
+            ) from None
+        self._llama = Llama(model_path=model_path, n_ctx=context_size, n_threads=threads, verbose=False)
+        self._lock = asyncio.Lock()
+
+    def _count_tokens(self, messages) -> int:
+        text = "\n".join(message["content"] for message in messages)
+        return len(self._llama.tokenize(text.encode('utf-8')))
+
+    async def stream(self, messages, model=None, max_tokens=None):
+        # Snapshot for the worker thread: the history may change on the event loop meanwhile
+        messages = list(messages)
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        done = object()
+        cancelled = threading.Event()
+
+        def generate():
+            try:
+                for chunk in self._llama.create_chat_completion(
+                    messages=messages, max_tokens=max_tokens, stream=True,
+                ):
+                    if cancelled.is_set():
+                        break
+                    text = chunk["choices"][0]["delta"].get("content")
+                    if text:
+                        loop.call_soon_threadsafe(pieces.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(pieces.put_nowait, e)
+            loop.call_soon_threadsafe(pieces.put_nowait, done)
+
+        async with self._lock:
+            generation = loop.run_in_executor(None, generate)
+            completion_tokens = 0
+            try:
+                while True:
+                    piece = await pieces.get()
+                    if piece is done:
+                        break
+                    if isinstance(piece, Exception):
+                        raise piece
+                    # llama.cpp streams one token per chunk
+                    completion_tokens += 1
+                    yield LLMChunk(piece)
+            finally:
+                cancelled.set()
+                await asyncio.shield(generation)
+        prompt_tokens = await loop.run_in_executor(None, self._count_tokens, messages)
+        yield LLMChunk(usage=Usage(prompt_tokens, completion_tokens))
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic backend for offline tests and benchmarks.
+
+    Always streams the same reply in fixed-size pieces, with an optional
+    delay per piece. `fail_every` makes every n-th request raise before the
+    first token, to exercise failover.
+    """
+
+    def __init__(self, name, reply="I respectfully disagree, and here is why.", chunk_size=8, delay=0.0,
+                 fail_every=0):
+        super().__init__(name, "fake")
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.fail_every = fail_every
+        self.calls = []
+
+    async def stream(self, messages, model=None, max_tokens=None):
+        # Kept for inspection after the history has moved on
+        messages = list(messages)
+        self.calls.append({"model": model or self.model, "messages": messages, "max_tokens": max_tokens})
+        if self.fail_every and len(self.calls) % self.fail_every == 0:
+            raise ConnectionError(f"Fake backend '{self.name}' failure")
+        reply = self.reply
+        words = reply.split()
+        if max_tokens and len(words) > max_tokens:
+            # One word stands in for one token
+            reply = " ".join(words[:max_tokens])
+        for start in range(0, len(reply), self.chunk_size):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield LLMChunk(reply[start:start + self.chunk_size])
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        yield LLMChunk(usage=Usage(prompt_tokens, len(reply.split())))
+
+
+def create_backend(name, config) -> LLMBackend:
+    """Build the backend described by the LLM_<NAME>_* keys in config.txt."""
+    prefix = f"LLM_{name.upper()}_"
+
+    def option(key, default=None):
+        return config.get(prefix + key, default)
+
+    def timeout():
+        # LLM_<NAME>_TIMEOUT overrides how long to wait for the next streamed chunk
+        read = option('TIMEOUT')
+        return http_transport.llm_timeout(float(read) if read else None)
+
+    backend_type = option('TYPE', 'openai')
+    if backend_type == 'openai':
+        return OpenAIBackend(
+            name,
+            model=option('MODEL', config.get('GPT_MODEL', '')),
+            api_key=option('API_KEY', config.get('OPENAI_API_KEY', '')),
+            base_url=option('BASE_URL'),
+            timeout=timeout(),
+            http_client=http_transport.llm_client(),
+        )
+    if backend_type == 'openai_compatible':
+        # Local servers usually ignore the key but the client requires one
+        return OpenAIBackend(
+            name,
+            model=option('MODEL', ''),
+            api_key=option('API_KEY', 'not-needed'),
+            base_url=option('BASE_URL'),
+            timeout=timeout(),
+            http_client=http_transport.llm_client(),
+            stream_usage=config.get_bool(prefix + 'STREAM_USAGE'),
+            accepts_model_override=False,
+        )
+    if backend_type == 'local_cpu':
+        threads = option('THREADS')
+        return LocalCPUBackend(
+            name,
+            model_path=option('MODEL_PATH'),
+            context_size=config.get_int(prefix + 'CONTEXT_SIZE', 4096),
+            threads=int(threads) if threads else None,
+        )
+    if backend_type == 'fake':
+        return FakeBackend(
+            name,
+            delay=config.get_float(prefix + 'DELAY', 0),
+            fail_every=config.get_int(prefix + 'FAIL_EVERY', 0),
+        )
+    raise ValueError(f"Unknown LLM backend type '{backend_type}' for '{name}'")
+
+
+class LLMRouter:
+    """Chooses a backend for each request and fails over to the next one.
+
+    With LLM_ROUTING=priority backends are tried in the order listed in
+    LLM_BACKENDS; with LLM_ROUTING=latency the one with the lowest moving
+    average time to first token goes first. A backend that fails is skipped
+    for LLM_FAILURE_COOLDOWN_SECONDS. Failover only happens before the first
+    token arrives; an error mid-stream is raised to the caller.
+    """
+
+    def __init__(self):
+        self.backends = []
+        self.routing = "priority"
+        self.failure_cooldown = DEFAULT_FAILURE_COOLDOWN
+        self._latency = {}
+        self._unavailable_until = {}
+
+    def configure(self, config) -> None:
+        names = [name.strip() for name in config.get('LLM_BACKENDS', 'openai').split(",") if name.strip()]
+        self.backends = [create_backend(name, config) for name in names]
+        self.routing = config.get('LLM_ROUTING', 'priority')
+        self.failure_cooldown = config.get_float('LLM_FAILURE_COOLDOWN_SECONDS', DEFAULT_FAILURE_COOLDOWN)
+        self._latency = {}
+        self._unavailable_until = {}
+
+    def _candidates(self):
+        now = time.monotonic()
+        available = [b for b in self.backends if self._unavailable_until.get(b.name, 0) <= now]
+        # When everything is cooling down, still try all of them rather than fail outright
+        candidates = available or list(self.backends)
+        if self.routing == "latency":
+            # Backends without samples yet go first so they get measured
+            candidates.sort(key=lambda b: self._latency.get(b.name, 0.0))
+        return candidates
+
+    def _observe_latency(self, name, seconds) -> None:
+        first_token_histogram.observe(seconds, backend=name)
+        previous = self._latency.get(name)
+        self._latency[name] = seconds if previous is None else (
+            LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * previous
+        )
+
+    def _mark_failed(self, name) -> None:
+        llm_failures_total.inc(backend=name)
+        self._unavailable_until[name] = time.monotonic() + self.failure_cooldown
+
+    async def stream(self, messages, model=None, max_tokens=None):
+        """Stream a reply from the first backend that answers."""
+        if not self.backends:
+            raise RuntimeError("No LLM backends are configured")
+        last_error = None
+        for backend in self._candidates():
+            started = time.monotonic()
+            chunks = backend.stream(
+                messages, model=model if backend.accepts_model_override else None, max_tokens=max_tokens,
+            )
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except Exception as e:
+                logging.warning(f"LLM backend '{backend.name}' failed, trying the next one: {e}")
+                self._mark_failed(backend.name)
+                last_error = e
+                continue
+
+            self._observe_latency(backend.name, time.monotonic() - started)
+            self._unavailable_until.pop(backend.name, None)
+            if first is None:
+                return
+            yield first
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            except Exception:
+                self._mark_failed(backend.name)
+                raise
+            return
+        raise last_error
+
+
+llm_router = LLMRouter()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from bot.metrics import registry
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_THRESHOLD = 0.25
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Frames from these files belong to the bot itself rather than libraries
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+lag_histogram = registry.histogram(
+    "debatebot_event_loop_lag_seconds", "Delay between a scheduled wake-up and the loop running it",
+    buckets=LAG_BUCKETS,
+)
+blocking_total = registry.counter(
+    "debatebot_blocking_calls_total", "Times the event loop was blocked longer than the threshold",
+)
+
+
+def _project_frames(stack):
+    return [
+        frame for frame in stack
+        if frame.filename.startswith(PROJECT_ROOT)
+        and os.sep + "site-packages" + os.sep not in frame.filename
+        and not frame.filename.endswith("loop_monitor.py")
+    ]
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and reports what blocks it.
+
+    A coroutine sleeps for `interval` in a loop and records how late it wakes
+    up. A watchdog thread checks the coroutine's heartbeat; if the loop has not
+    run for longer than `threshold`, it grabs the loop thread's current stack
+    and logs the handler and the line of bot code that is blocking.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, threshold=DEFAULT_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def configure(self, config) -> None:
+        self.interval = config.get_float('LOOP_LAG_INTERVAL', DEFAULT_INTERVAL)
+        self.threshold = config.get_float('LOOP_LAG_THRESHOLD', DEFAULT_THRESHOLD)
+
+    def start(self) -> None:
+        """Start monitoring the running event loop; does nothing if it is already running."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        """Stop monitoring; safe to call more than once."""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            # The watchdog wakes up every threshold / 2, so this is short
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    async def _tick(self) -> None:
+        while True:
+            scheduled = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag_histogram.observe(max(0.0, now - scheduled))
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stopped.wait(self.threshold / 2):
+            blocked_for = time.monotonic() - self._heartbeat - self.interval
+            if blocked_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                # Only one report per blocking episode
+                continue
+            reported = True
+            self._report(blocked_for)
+
+    def _report(self, blocked_for) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        project = _project_frames(stack)
+        # Prefer the outermost handler function; main.py only starts the loop
+        handlers = [f for f in project if f.filename.endswith(os.path.join("bot", "handlers.py"))]
+        callers = handlers or [f for f in project if not f.filename.endswith("main.py")]
+        handler = callers[0].name if callers else "unknown"
+        call_site = f"{project[-1].filename[len(PROJECT_ROOT) + 1:]}:{project[-1].lineno}" if project else "unknown"
+
+        blocking_total.inc(handler=handler)
+        logging.warning(
+            f"Event loop blocked for {blocked_for:.3f}s in {handler} at {call_site}\n"
+            + "".join(traceback.format_list(stack[-8:]))
+        )
+
+
+loop_monitor = LoopLagMonitor()
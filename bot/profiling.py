@@ -0,0 +1,167 @@
+import asyncio
+import cProfile
+import logging
+import os
+import signal
+import time
+import tracemalloc
+from datetime import datetime
+
+from bot.admin import admin_only
+from bot.conversation_store import conversation_history
+from bot.delivery import outbound
+
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_MAX_SECONDS = 300
+DEFAULT_SIGNAL_SECONDS = 30
+
+
+class UpdateProfiler:
+    """cProfile and tracemalloc capture for a bounded window of live traffic.
+
+    A session covers either the next N updates or the next T seconds (whichever
+    limit is set, always capped at DEFAULT_MAX_SECONDS). Results are written as a
+    pstats file, a tracemalloc snapshot and a short text report with the top
+    allocation growth and the size of `conversation_history`.
+    """
+
+    def __init__(self, output_dir=DEFAULT_PROFILE_DIR):
+        self.output_dir = output_dir
+        self._profile = None
+        self._started_at = None
+        self._remaining_updates = None
+        self._stop_job = None
+        self._memory_before = None
+        self._history_before = None
+        self._own_tracemalloc = False
+
+    def configure(self, config) -> None:
+        self.output_dir = config.get('PROFILE_DIR', DEFAULT_PROFILE_DIR)
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, application, updates=None, seconds=None) -> bool:
+        """Begin a session. Returns False if one is already running."""
+        if self.active:
+            return False
+
+        seconds = min(seconds or DEFAULT_MAX_SECONDS, DEFAULT_MAX_SECONDS)
+        self._remaining_updates = updates
+        self._started_at = time.time()
+        self._history_before = self._history_stats()
+
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start(10)
+        self._memory_before = tracemalloc.take_snapshot()
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._stop_job = application.job_queue.run_once(self._stop_job_callback, seconds)
+        logging.info(f"Profiling started for {updates or 'all'} updates, at most {seconds}s")
+        return True
+
+    def on_update(self) -> None:
+        """Count an incoming update and end the session once N updates were handled.
+
+        Updates are processed one at a time, so when update N+1 arrives the
+        previous N have finished.
+        """
+        if not self.active or self._remaining_updates is None:
+            return
+        if self._remaining_updates <= 0:
+            self.stop()
+        else:
+            self._remaining_updates -= 1
+
+    def stop(self):
+        """End the session and write the results. Returns the written paths."""
+        if not self.active:
+            return []
+
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        if self._stop_job is not None:
+            self._stop_job.schedule_removal()
+            self._stop_job = None
+
+        memory_after = tracemalloc.take_snapshot()
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, "profile-" + datetime.now().strftime('%Y%m%d-%H%M%S'))
+        stats_path = base + ".pstats"
+        snapshot_path = base + ".tracemalloc"
+        report_path = base + "-memory.txt"
+
+        profile.dump_stats(stats_path)
+        memory_after.dump(snapshot_path)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(f"Profiled {time.time() - self._started_at:.1f}s\n")
+            f.write(f"conversation_history before: {self._history_before}\n")
+            f.write(f"conversation_history after:  {self._history_stats()}\n\n")
+            f.write("Top allocation growth:\n")
+            for stat in memory_after.compare_to(self._memory_before, "lineno")[:25]:
+                f.write(f"{stat}\n")
+
+        self._memory_before = None
+        logging.info(f"Profiling results written to {stats_path}, {snapshot_path} and {report_path}")
+        return [stats_path, snapshot_path, report_path]
+
+    async def _stop_job_callback(self, context) -> None:
+        self._stop_job = None
+        self.stop()
+
+    @staticmethod
+    def _history_stats():
+        return f"{len(conversation_history)} debates, {conversation_history.turn_count()} turns"
+
+
+profiler = UpdateProfiler()
+
+
+async def count_profiled_update(update, context) -> None:
+    """TypeHandler callback registered ahead of all other handlers."""
+    profiler.on_update()
+
+
+@admin_only
+async def profile_command(update, context) -> None:
+    """/profile [N | Ts | stop] - profile the next N updates or T seconds (admins only)."""
+    chat_id = update.effective_chat.id
+    argument = context.args[0].lower() if context.args else "100"
+
+    if argument == "stop":
+        paths = profiler.stop()
+        text = "Profiling stopped:\n" + "\n".join(paths) if paths else "Profiling is not running."
+    else:
+        try:
+            if argument.endswith("s"):
+                started = profiler.start(context.application, seconds=float(argument[:-1]))
+            else:
+                started = profiler.start(context.application, updates=int(argument))
+        except ValueError:
+            await outbound.send_message(context.bot, chat_id=chat_id, text="Usage: /profile [N | Ts | stop]")
+            return None
+        text = f"Profiling started ({argument})." if started else "Profiling is already running."
+
+    await outbound.send_message(context.bot, chat_id=chat_id, text=text)
+    return None
+
+
+def install_signal_handler(application) -> None:
+    """Toggle a time-bounded profiling session with SIGUSR1 (Unix only)."""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    seconds = application.bot_data['config'].get_float('PROFILE_SIGNAL_SECONDS', DEFAULT_SIGNAL_SECONDS)
+
+    def toggle():
+        if profiler.active:
+            profiler.stop()
+        else:
+            profiler.start(application, seconds=seconds)
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle)
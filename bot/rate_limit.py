@@ -0,0 +1,51 @@
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity` tokens."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now=None) -> float:
+        """Return how many seconds to wait before a token can be consumed."""
+        now = time.monotonic() if now is None else now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now=None) -> bool:
+        """Take one token if available. Returns False if the caller has to wait."""
+        now = time.monotonic() if now is None else now
+        if self.delay(now) > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def block(self, seconds, now=None) -> None:
+        """Refuse all tokens for the given number of seconds (e.g. after a flood error)."""
+        now = time.monotonic() if now is None else now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = max(self.updated, self.blocked_until)
+
+    def idle(self, now=None) -> bool:
+        """Return True if the bucket is full again and holds no state worth keeping."""
+        now = time.monotonic() if now is None else now
+        return self.delay(now) == 0 and self.tokens >= self.capacity
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import signal
+import time
+
+from bot.admission import admission
+from bot.analysis_jobs import analysis_workers
+from bot.broadcast import broadcaster
+from bot.debounce import message_debouncer
+from bot.delivery import outbound
+from bot.tenants import current_tenant
+
+# Docker sends SIGKILL 10 seconds after SIGTERM by default; leave time for the final flushes
+DEFAULT_DRAIN_SECONDS = 8
+POLL_INTERVAL = 0.1
+
+
+class ShutdownCoordinator:
+    """Stops the bot on SIGTERM or SIGINT without dropping accepted work.
+
+    The sequence is:
+    1. stop fetching updates from Telegram;
+    2. stop background producers: analysis workers (their jobs are leased in
+       SQLite and retried later) and broadcasts (resumed from their checkpoint);
+    3. close every open debounce window and keep handling the updates already
+       fetched, until the update queue, running replies, LLM streams and
+       outbound sends are all finished or SHUTDOWN_DRAIN_SECONDS have passed;
+    4. cancel replies still running after the deadline and stop the
+       application, which runs post_shutdown to flush usage, history and
+       transcripts.
+
+    A second signal skips the rest of the wait. With several bots in one
+    process they are drained together against the same deadline.
+    """
+
+    def __init__(self):
+        self.drain_seconds = DEFAULT_DRAIN_SECONDS
+        self._task = None
+        self._deadline = None
+
+    def configure(self, config) -> None:
+        self.drain_seconds = config.get_float('SHUTDOWN_DRAIN_SECONDS', DEFAULT_DRAIN_SECONDS)
+
+    @property
+    def draining(self) -> bool:
+        return self._task is not None
+
+    def install(self, applications, stop) -> None:
+        """Handle the stop signals on the running event loop (Unix only).
+
+        `stop` is called once `applications` are drained, e.g. `Application.stop_running`.
+        """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.begin, applications, stop)
+            except (NotImplementedError, RuntimeError):
+                # No loop signal handlers on this platform; keep the default behaviour
+                return
+
+    def begin(self, applications, stop) -> None:
+        if self._task is not None:
+            logging.warning("Second stop signal, not waiting for the remaining work")
+            self._deadline = time.monotonic()
+            return
+        self._task = asyncio.get_running_loop().create_task(self._shutdown(applications, stop))
+
+    @staticmethod
+    def in_flight(application) -> dict:
+        """Work that is still going on, by kind."""
+        return {
+            "updates": application.update_queue.qsize(),
+            "replies": message_debouncer.active(),
+            "llm": admission.inflight_llm,
+            "sends": outbound.pending(),
+        }
+
+    async def drain(self, application) -> bool:
+        """Run steps 1-3. Returns False if the deadline passed with work left."""
+        started = time.monotonic()
+        if self._deadline is None:
+            self._deadline = started + self.drain_seconds
+        logging.info(f"Shutting down, finishing work in flight for up to {self.drain_seconds:g}s")
+
+        if application.updater is not None and application.updater.running:
+            await application.updater.stop()
+        await analysis_workers.stop()
+        suspended = await broadcaster.suspend()
+        if suspended:
+            logging.info(f"Suspended {suspended} broadcast(s) until the next start")
+        flushed = message_debouncer.flush_now()
+        if flushed:
+            logging.info(f"Flushed {flushed} message burst(s) early")
+
+        while time.monotonic() < self._deadline:
+            if not any(self.in_flight(application).values()):
+                logging.info(f"Drained in {time.monotonic() - started:.1f}s")
+                return True
+            await asyncio.sleep(POLL_INTERVAL)
+
+        remaining = ", ".join(f"{count} {kind}" for kind, count in self.in_flight(application).items() if count)
+        logging.warning(f"Shutdown deadline reached with work left: {remaining}")
+        cancelled = message_debouncer.cancel_flushing()
+        if cancelled:
+            logging.warning(f"Cancelled {cancelled} reply generation(s)")
+        return False
+
+    async def _drain_tenant(self, application) -> bool:
+        # Each gathered coroutine runs in its own task, so this only affects that bot
+        current_tenant.set(application.bot_data.get('tenant', ''))
+        return await self.drain(application)
+
+    async def _shutdown(self, applications, stop) -> None:
+        self._deadline = time.monotonic() + self.drain_seconds
+        try:
+            await asyncio.gather(*(self._drain_tenant(application) for application in applications))
+        except Exception:
+            logging.exception("Error while draining, stopping anyway")
+        stop()
+
+
+shutdown_coordinator = ShutdownCoordinator()
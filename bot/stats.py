@@ -0,0 +1,125 @@
+import logging
+import time
+from collections import deque
+
+from bot.admin import admin_only
+from bot.conversation_store import conversation_history
+from bot.delivery import outbound
+from bot.tenants import TenantLocal, run_blocking
+from bot.utils import known_languages
+from database.database_support import count_users
+from database.user_stats import user_stats
+
+CONVERSATION_STATES = (
+    "STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE", "VERIFIED",
+    "AWAITING_DEBATE_TOPIC", "AWAITING_DEBATE_SIDE", "CHAT_GPT",
+)
+DEFAULT_WINDOW_SECONDS = 300
+DEFAULT_ACTIVE_SECONDS = 600
+
+
+class ActivityStats:
+    """Debate messages and reply latencies over a sliding window of STATS_WINDOW_SECONDS.
+
+    Samples are appended as they happen and dropped once they leave the
+    window, with a running latency sum, so reading the stats costs nothing
+    proportional to the traffic.
+    """
+
+    def __init__(self, window_seconds=DEFAULT_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._messages = deque()
+        self._replies = deque()
+        self._latency_sum = 0.0
+
+    def configure(self, config) -> None:
+        self.window_seconds = config.get_float('STATS_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)
+
+    def _trim(self, now) -> None:
+        cutoff = now - self.window_seconds
+        while self._messages and self._messages[0] < cutoff:
+            self._messages.popleft()
+        while self._replies and self._replies[0][0] < cutoff:
+            self._latency_sum -= self._replies.popleft()[1]
+
+    def message(self) -> None:
+        """A student message accepted for a GPT turn."""
+        now = time.monotonic()
+        self._messages.append(now)
+        self._trim(now)
+
+    def reply(self, latency) -> None:
+        """A GPT reply generated in `latency` seconds."""
+        now = time.monotonic()
+        self._replies.append((now, latency))
+        self._latency_sum += latency
+        self._trim(now)
+
+    def messages_per_minute(self) -> float:
+        self._trim(time.monotonic())
+        return len(self._messages) * 60 / self.window_seconds
+
+    def average_latency(self):
+        """Mean reply latency in seconds, or None without replies in the window."""
+        self._trim(time.monotonic())
+        return self._latency_sum / len(self._replies) if self._replies else None
+
+
+activity_stats = TenantLocal(ActivityStats)
+
+
+def count_all_users():
+    """(by_state, by_language, total) from Firestore count aggregations, or None on errors.
+
+    Users in no known state or without a language are counted under None.
+    """
+    total = count_users()
+    by_state = {state: count_users('conversation_state', state) for state in CONVERSATION_STATES}
+    by_language = {language: count_users('language', language) for language in known_languages()}
+    if total is None or None in by_state.values() or None in by_language.values():
+        return None
+    by_state[None] = total - sum(by_state.values())
+    by_language[None] = total - sum(by_language.values())
+    return by_state, by_language, total
+
+
+async def reconcile_user_stats(context) -> None:
+    """JobQueue callback: correct the incremental user counts with exact ones from Firestore."""
+    counts = await run_blocking(count_all_users)
+    if counts is None:
+        logging.warning("Could not count users in Firestore; keeping the incremental counts")
+        return
+    user_stats.reconcile(*counts)
+
+
+def _format_counts(counts, unknown):
+    if not counts:
+        return ["  none"]
+    ordered = sorted(counts.items(), key=lambda item: (item[0] is None, -item[1]))
+    return [f"  {unknown if name is None else name}: {count}" for name, count in ordered]
+
+
+@admin_only
+async def stats_command(update, context) -> None:
+    """/stats - user counts per stage and language and current debate activity (admins only)."""
+    config = context.bot_data['config']
+    by_state, by_language, total = user_stats.snapshot()
+    reconciled_at = user_stats.reconciled_at
+    counted = f"checked {int((time.time() - reconciled_at) / 60)} min ago" if reconciled_at else "not checked yet"
+    active_seconds = config.get_float('HISTORY_COMPRESS_IDLE_SECONDS', DEFAULT_ACTIVE_SECONDS)
+    latency = activity_stats.average_latency()
+    window_minutes = activity_stats.window_seconds / 60
+
+    lines = [f"Users: {total} ({counted})", "By stage:"]
+    lines += _format_counts(by_state, "other")
+    lines.append("By language:")
+    lines += _format_counts(by_language, "not chosen")
+    lines += [
+        f"Active debates: {conversation_history.active_count(active_seconds)} "
+        f"(a turn in the last {active_seconds / 60:g} min)",
+        f"Messages per minute: {activity_stats.messages_per_minute():.1f} (last {window_minutes:g} min)",
+        "Average reply latency: " + (f"{latency:.2f}s" if latency is not None else "no replies")
+        + f" (last {window_minutes:g} min)",
+    ]
+    await outbound.send_message(context.bot, chat_id=update.effective_chat.id, text="\n".join(lines))
+    return None
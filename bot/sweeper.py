@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from bot.conversation_store import conversation_history
+from bot.metrics import registry
+from bot.tenants import TenantLocal, run_blocking
+from bot.verification_store import get_verification_store
+from database.database_support import (
+    get_stale_users_page,
+    delete_users_batch,
+)
+
+REGISTRATION_STATES = ("STARTED", "AWAITING_EMAIL", "AWAITING_VERIFICATION_CODE")
+FIRESTORE_BATCH_LIMIT = 500
+
+swept_total = registry.counter("debatebot_swept_total", "Stale records removed by the background sweeper")
+
+
+class StaleDataSweeper:
+    """Periodic cleanup of abandoned registrations and idle in-memory state.
+
+    - users stuck in a registration state for STALE_REGISTRATION_DAYS are deleted
+    - debate histories idle for HISTORY_EVICT_IDLE_HOURS are dropped from memory
+    - expired codes are purged from the pending verification store
+
+    Firestore work is done in batches of up to 500 writes in a worker thread,
+    with a pause between batches and a cap on writes per run, so a sweep never
+    competes with live traffic for long.
+    """
+
+    def __init__(self):
+        self.stale_registration_days = 30
+        self.history_idle_hours = 24
+        self.max_writes_per_run = 2000
+        self.pause_seconds = 1.0
+
+    def configure(self, config) -> None:
+        self.stale_registration_days = config.get_float('STALE_REGISTRATION_DAYS', 30)
+        self.history_idle_hours = config.get_float('HISTORY_EVICT_IDLE_HOURS', 24)
+        self.max_writes_per_run = config.get_int('SWEEP_MAX_WRITES', 2000)
+        self.pause_seconds = config.get_float('SWEEP_PAUSE_SECONDS', 1)
+
+    async def _sweep(self, states, older_than, write_batch, budget) -> int:
+        """Apply `write_batch` to matching users page by page. Returns users written."""
+        written, cursor = 0, None
+        while written < budget:
+            page_size = min(FIRESTORE_BATCH_LIMIT, budget - written)
+            page = await run_blocking(get_stale_users_page, states, older_than, page_size, cursor)
+            if not page:
+                break
+            if not await run_blocking(write_batch, [user_id for user_id, _ in page]):
+                break
+            written += len(page)
+            cursor = page[-1]
+            if len(page) < page_size:
+                break
+            await asyncio.sleep(self.pause_seconds)
+        return written
+
+    async def run(self) -> None:
+        evicted = conversation_history.evict_idle(self.history_idle_hours * 3600)
+        expired_codes = get_verification_store().purge_expired()
+
+        now = datetime.now(timezone.utc)
+        budget = self.max_writes_per_run
+        deleted = await self._sweep(
+            REGISTRATION_STATES, now - timedelta(days=self.stale_registration_days), delete_users_batch, budget,
+        )
+
+        swept_total.inc(evicted, kind="history")
+        swept_total.inc(deleted, kind="registration")
+        swept_total.inc(expired_codes, kind="pending_code")
+        if evicted or deleted:
+            logging.info(f"Sweeper evicted {evicted} idle histories, deleted {deleted} abandoned registrations")
+
+
+sweeper = TenantLocal(StaleDataSweeper)
+
+
+async def sweep_stale_data(context) -> None:
+    """JobQueue callback for the periodic sweep."""
+    await sweeper.run()
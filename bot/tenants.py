@@ -0,0 +1,133 @@
+import asyncio
+import configparser
+import contextvars
+import functools
+import os
+import re
+
+from telegram.ext import CallbackContext
+
+from bot.config import Config, ConfigError
+
+# Name of the bot the current update, job or task belongs to; "" when a single bot runs
+current_tenant = contextvars.ContextVar("current_tenant", default="")
+
+TENANT_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+DEFAULT_DATA_DIR = "tenants"
+# Files each bot needs for itself, moved to TENANT_DATA_DIR/<name>/ unless its section sets them
+PER_TENANT_PATHS = ("ANALYSIS_DB_PATH", "BROADCAST_DIR", "HISTORY_SNAPSHOT_FILE")
+PATH_DEFAULTS = {"ANALYSIS_DB_PATH": "analysis_jobs.sqlite3", "BROADCAST_DIR": "broadcasts"}
+
+
+class TenantLocal:
+    """One instance of a stateful service per tenant behind a single module-level name.
+
+    Attribute access is forwarded to the current tenant's instance, which is
+    created with `factory()` on first use, so call sites stay unchanged and a
+    single bot behaves exactly as before.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+
+    def current(self):
+        tenant = current_tenant.get()
+        instance = self._instances.get(tenant)
+        if instance is None:
+            instance = self._instances[tenant] = self._factory()
+        return instance
+
+    def set(self, instance) -> None:
+        """Replace the current tenant's instance."""
+        self._instances[current_tenant.get()] = instance
+
+    def __getattr__(self, name):
+        instance = self._instances.get(current_tenant.get())
+        return getattr(instance if instance is not None else self.current(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.current(), name, value)
+
+    def __len__(self):
+        return len(self.current())
+
+    def __contains__(self, item):
+        return item in self.current()
+
+
+def tenant_collection(name) -> str:
+    """Firestore path of a per-bot collection: `users` or `tenants/<name>/users`."""
+    tenant = current_tenant.get()
+    return f"tenants/{tenant}/{name}" if tenant else name
+
+
+async def run_blocking(func, *args):
+    """`run_in_executor` that keeps the current tenant in the worker thread."""
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+class TenantCallbackContext(CallbackContext):
+    """Sets `current_tenant` from `bot_data['tenant']` before each handler, job and error callback."""
+
+    @classmethod
+    def from_update(cls, update, application):
+        current_tenant.set(application.bot_data.get('tenant', ''))
+        return super().from_update(update, application)
+
+    @classmethod
+    def from_job(cls, job, application):
+        current_tenant.set(application.bot_data.get('tenant', ''))
+        return super().from_job(job, application)
+
+    @classmethod
+    def from_error(cls, update, error, application, job=None, coroutine=None):
+        current_tenant.set(application.bot_data.get('tenant', ''))
+        return super().from_error(update, error, application, job=job, coroutine=coroutine)
+
+
+def load_tenants(base):
+    """Read TENANTS_FILE into [(name, Config)], or [] to run the single bot from config.txt.
+
+    Each section is one bot. Its keys override config.txt for that bot only,
+    including over environment variables, so every section needs at least
+    TELEGRAM_BOT_TOKEN. Data files listed in PER_TENANT_PATHS are kept apart
+    per bot, and services shared by all bots (LLM backends, outbound limits,
+    admission, metrics) use config.txt.
+    """
+    path = base.get('TENANTS_FILE', '')
+    if not path:
+        return []
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str.upper
+    with open(path, 'r', encoding='utf-8') as f:
+        parser.read_file(f)
+
+    data_dir = base.get('TENANT_DATA_DIR', DEFAULT_DATA_DIR)
+    tenants = []
+    tokens = set()
+    for name in parser.sections():
+        if not TENANT_NAME.match(name):
+            raise ConfigError(f"Tenant name {name!r} in {path} may only use letters, digits, '-' and '_'")
+        overrides = dict(parser[name])
+        if not overrides.get('TELEGRAM_BOT_TOKEN'):
+            raise ConfigError(f"Tenant {name} in {path} has no TELEGRAM_BOT_TOKEN")
+        if overrides['TELEGRAM_BOT_TOKEN'] in tokens:
+            raise ConfigError(f"Tenant {name} in {path} reuses another tenant's TELEGRAM_BOT_TOKEN")
+        tokens.add(overrides['TELEGRAM_BOT_TOKEN'])
+
+        for key in PER_TENANT_PATHS:
+            value = base.get(key, PATH_DEFAULTS.get(key, ''))
+            if key not in overrides and value:
+                overrides[key] = os.path.join(data_dir, name, os.path.basename(value.rstrip('/')))
+        # The host serves metrics for all bots on config.txt's port
+        overrides['METRICS_PORT'] = '0'
+        os.makedirs(os.path.join(data_dir, name), exist_ok=True)
+        tenants.append((name, Config(base.file_path, overrides=overrides)))
+    if not tenants:
+        raise ConfigError(f"{path} defines no tenants")
+    return tenants
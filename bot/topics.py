@@ -0,0 +1,249 @@
+import heapq
+import re
+import threading
+from collections import Counter
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from bot.admin import admin_only
+from bot.delivery import outbound
+from bot.tenants import TenantLocal, run_blocking
+from database.database_support import add_topic, delete_topic
+
+NON_WORD = re.compile(r"[\W_]+")
+MAX_ID_LENGTH = 100
+MAX_PREFIX = 20
+INLINE_RESULTS = 20
+INLINE_CACHE_SECONDS = 60
+# Share of the query's trigrams a title needs to be offered as a spelling match
+MIN_SIMILARITY = 0.5
+# Trigrams in more than this share of titles ("should", "the") only score candidates, they do not find them
+COMMON_TRIGRAM_SHARE = 0.1
+
+
+def normalize(text) -> str:
+    """Lower-case words without punctuation, e.g. "Exams: abolish them?" -> "exams abolish them"."""
+    return " ".join(NON_WORD.sub(" ", text.casefold().replace("ё", "е")).split())
+
+
+def topic_id_for(title) -> str:
+    """Normalized topic id (and Firestore document id), e.g. "exams-abolish-them"."""
+    return normalize(title).replace(" ", "-")[:MAX_ID_LENGTH].strip("-")
+
+
+def trigrams(normalized) -> set:
+    """Trigrams of each word padded with spaces, e.g. "exam" -> {" ex", "exa", "xam", "am "}."""
+    grams = set()
+    for word in normalized.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class Topic:
+    __slots__ = ("id", "title", "normalized", "trigrams")
+
+    def __init__(self, topic_id, title):
+        self.id = topic_id
+        self.title = title
+        self.normalized = normalize(title)
+        self.trigrams = trigrams(self.normalized)
+
+
+class TopicCatalog:
+    """In-memory search index over the curated debate topics in Firestore.
+
+    Each word of a title is indexed by its prefixes, so a query matches the
+    topics that have a word starting with every query word, ranked by title.
+    Fewer matches than requested are topped up from a trigram index, which
+    finds titles despite typos. The catalog is filled by the first snapshot
+    of a listener on the `topics` collection; later snapshots and the
+    /topics command update single entries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._by_normalized = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        # Topic ids in title order and their positions, rebuilt on the first search after a change
+        self._ordered = []
+        self._rank = None
+        self._feed = None
+
+    def __len__(self):
+        return len(self._topics)
+
+    def start(self, feed) -> None:
+        self._feed = feed
+        feed.start(self._apply_change)
+
+    def stop(self) -> None:
+        if self._feed is not None:
+            self._feed.stop()
+            self._feed = None
+
+    def _apply_change(self, topic_id, data, read_time) -> None:
+        if data is None or not data.get('title'):
+            self.remove(topic_id)
+        else:
+            self.add(topic_id, data['title'])
+
+    def _unindex(self, topic) -> None:
+        for word in set(topic.normalized.split()):
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                ids = self._prefixes.get(word[:length])
+                if ids is not None:
+                    ids.discard(topic.id)
+                    if not ids:
+                        del self._prefixes[word[:length]]
+        for trigram in topic.trigrams:
+            ids = self._trigrams.get(trigram)
+            if ids is not None:
+                ids.discard(topic.id)
+                if not ids:
+                    del self._trigrams[trigram]
+        if self._by_normalized.get(topic.normalized) == topic.id:
+            del self._by_normalized[topic.normalized]
+
+    def _ranked(self) -> dict:
+        if self._rank is None:
+            self._ordered = [topic.id for topic in sorted(self._topics.values(), key=lambda topic: topic.normalized)]
+            self._rank = {topic_id: position for position, topic_id in enumerate(self._ordered)}
+        return self._rank
+
+    def add(self, topic_id, title) -> None:
+        topic = Topic(topic_id, title)
+        with self._lock:
+            previous = self._topics.get(topic_id)
+            if previous is not None:
+                if previous.title == title:
+                    return
+                self._unindex(previous)
+            self._topics[topic_id] = topic
+            self._by_normalized[topic.normalized] = topic_id
+            for word in set(topic.normalized.split()):
+                for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                    self._prefixes.setdefault(word[:length], set()).add(topic_id)
+            for trigram in topic.trigrams:
+                self._trigrams.setdefault(trigram, set()).add(topic_id)
+            self._rank = None
+
+    def remove(self, topic_id) -> None:
+        with self._lock:
+            topic = self._topics.pop(topic_id, None)
+            if topic is not None:
+                self._unindex(topic)
+                self._rank = None
+
+    def get(self, topic_id):
+        return self._topics.get(topic_id)
+
+    def match(self, text):
+        """The id of the topic whose title is `text` up to case and punctuation, or None."""
+        return self._by_normalized.get(normalize(text))
+
+    def _prefix_matches(self, words) -> set:
+        matches = None
+        # Longest words first: they have the shortest posting lists
+        for word in sorted(words, key=len, reverse=True):
+            ids = self._prefixes.get(word[:MAX_PREFIX], ())
+            if len(word) > MAX_PREFIX:
+                ids = {
+                    topic_id for topic_id in ids
+                    if any(part.startswith(word) for part in self._topics[topic_id].normalized.split())
+                }
+            matches = set(ids) if matches is None else matches & ids
+            if not matches:
+                return set()
+        return matches
+
+    def _similar(self, normalized, exclude, limit):
+        query = trigrams(normalized)
+        common = max(limit, int(len(self._topics) * COMMON_TRIGRAM_SHARE))
+        found = Counter()
+        for trigram in query:
+            ids = self._trigrams.get(trigram, ())
+            if len(ids) <= common:
+                found.update(ids)
+        scored = []
+        # Score the candidates sharing the most rare trigrams by the share of the query they contain
+        for topic_id, _ in found.most_common(limit * 4):
+            if topic_id in exclude:
+                continue
+            score = len(query & self._topics[topic_id].trigrams) / len(query)
+            if score >= MIN_SIMILARITY:
+                scored.append((score, -self._rank[topic_id], topic_id))
+        return [topic_id for _, _, topic_id in heapq.nlargest(limit, scored)]
+
+    def search(self, text, limit=INLINE_RESULTS):
+        """Up to `limit` topics for an autocomplete query, best first."""
+        normalized = normalize(text)
+        with self._lock:
+            rank = self._ranked()
+            if not normalized:
+                ids = self._ordered[:limit]
+            else:
+                matches = self._prefix_matches(normalized.split())
+                ids = heapq.nsmallest(limit, matches, key=rank.__getitem__)
+                if len(ids) < limit and len(normalized) >= 3:
+                    ids += self._similar(normalized, matches, limit - len(ids))
+            return [self._topics[topic_id] for topic_id in ids]
+
+
+topic_catalog = TenantLocal(TopicCatalog)
+
+
+async def inline_topic_query(update, context) -> None:
+    """Answer `@bot <words>` with matching catalog topics; picking one sends its title."""
+    query = update.inline_query
+    topics = topic_catalog.search(query.query)
+    results = [
+        InlineQueryResultArticle(
+            id=str(position),
+            title=topic.title,
+            input_message_content=InputTextMessageContent(topic.title),
+        )
+        for position, topic in enumerate(topics)
+    ]
+    await query.answer(results, cache_time=INLINE_CACHE_SECONDS)
+
+
+@admin_only
+async def topics_command(update, context) -> None:
+    """/topics [add <title> | remove <id> | find <words>] - manage the topic catalog (admins only)."""
+    chat_id = update.effective_chat.id
+    action = context.args[0].lower() if context.args else ""
+    argument = " ".join(context.args[1:]).strip()
+
+    if action == "add" and argument:
+        topic_id = topic_id_for(argument)
+        existing = topic_catalog.match(argument)
+        if not topic_id:
+            text = "A topic title needs at least one letter or digit."
+        elif existing is not None:
+            text = f"Already in the catalog as {existing}."
+        elif await run_blocking(add_topic, topic_id, argument):
+            topic_catalog.add(topic_id, argument)
+            text = f"Added {topic_id}."
+        else:
+            text = "Could not save the topic, see the log."
+    elif action == "remove" and argument:
+        topic_id = argument if topic_catalog.get(argument) is not None else topic_catalog.match(argument)
+        if topic_id is None:
+            text = f"No topic {argument} in the catalog."
+        elif await run_blocking(delete_topic, topic_id):
+            topic_catalog.remove(topic_id)
+            text = f"Removed {topic_id}."
+        else:
+            text = "Could not remove the topic, see the log."
+    elif action == "find":
+        topics = topic_catalog.search(argument)
+        text = "\n".join(f"{topic.id}: {topic.title}" for topic in topics) or "No matching topics."
+    else:
+        text = (f"{len(topic_catalog)} topics in the catalog.\n"
+                "Usage: /topics add <title> | remove <id> | find <words>")
+
+    await outbound.send_message(context.bot, chat_id=chat_id, text=text)
+    return None
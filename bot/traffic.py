@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import logging
+import re
+import secrets
+import time
+
+# Only the domain of an email address is kept, so registration still takes the same path on replay
+EMAIL = re.compile(r"^\s*[^@\s]+@([\w.-]+)\s*$")
+WORD_CHARACTER = re.compile(r"\w")
+
+
+class TrafficRecorder:
+    """Opt-in recording of incoming updates for offline load replay.
+
+    Each message or button press becomes one line of gzip-compressed JSON:
+    arrival time (Unix seconds), a pseudonymous user number, the kind ("m"
+    for text, "c" for callback data) and the anonymised payload. Text keeps its length, spacing and punctuation but every letter
+    and digit is replaced; commands keep the command word; emails keep their
+    domain. Button callback data is a fixed set of ids and is kept as is.
+    Pseudonyms use a random salt per process, so they cannot be linked to
+    Telegram ids, and a restart appends to the same file.
+
+    Enabled by setting TRAFFIC_RECORD_FILE. Replay with
+    `python -m benchmarks.replay <file>`.
+    """
+
+    def __init__(self):
+        self.path = ""
+        self._file = None
+        self._salt = secrets.token_bytes(16)
+
+    def configure(self, config) -> None:
+        self.path = config.get('TRAFFIC_RECORD_FILE', '')
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _pseudonym(self, user_id) -> int:
+        return int.from_bytes(hashlib.sha256(self._salt + str(user_id).encode()).digest()[:6], 'big')
+
+    @staticmethod
+    def anonymize(text) -> str:
+        if text.startswith("/"):
+            command, _, arguments = text.partition(" ")
+            return command + (" " + WORD_CHARACTER.sub("x", arguments) if arguments else "")
+        email = EMAIL.match(text)
+        if email:
+            return f"student@{email.group(1)}"
+        return WORD_CHARACTER.sub("x", text)
+
+    def record(self, update) -> None:
+        if update.effective_user is None:
+            return
+        if update.callback_query is not None:
+            kind, payload = "c", update.callback_query.data
+        elif update.message is not None and update.message.text is not None:
+            kind, payload = "m", self.anonymize(update.message.text)
+        else:
+            return
+
+        if self._file is None:
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+            logging.info(f"Recording traffic to {self.path}")
+        self._file.write(json.dumps(
+            [round(time.time(), 3), self._pseudonym(update.effective_user.id), kind, payload],
+            ensure_ascii=False,
+        ) + "\n")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+traffic_recorder = TrafficRecorder()
+
+
+def read_traffic(path):
+    """Yield (arrival time, user number, kind, payload) from a recording."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                arrived, user, kind, payload = json.loads(line)
+                yield arrived, user, kind, payload
+        except (EOFError, json.JSONDecodeError):
+            # The recording process was killed; everything before the cut is usable
+            logging.warning(f"{path} ends with an incomplete record")
+
+
+async def record_update(update, context) -> None:
+    """TypeHandler callback registered ahead of deduplication."""
+    traffic_recorder.record(update)
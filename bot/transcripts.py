@@ -0,0 +1,200 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from bot.metrics import registry
+
+# 2: added topic_id, the catalog id of the debate topic (null for free-text topics)
+SCHEMA_VERSION = 2
+DEFAULT_TRANSCRIPT_DIR = "transcripts"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_ROTATE_SECONDS = 3600
+DEFAULT_QUEUE_SIZE = 10000
+SALT_FILE = ".salt"
+
+# Every record has exactly these fields, in this order; missing values are null
+FIELDS = (
+    "schema", "event", "user", "topic", "topic_id", "side", "language", "role", "content",
+    "ts", "latency_ms", "prompt_tokens", "completion_tokens",
+)
+
+exported_total = registry.counter("debatebot_transcript_events_total", "Transcript events written to the export")
+dropped_total = registry.counter(
+    "debatebot_transcript_dropped_total", "Transcript events dropped because the export queue was full",
+)
+
+_STOP = object()
+
+
+class TranscriptExporter:
+    """Append-only export of debate transcripts for research.
+
+    Handlers call `record()`, which only puts a dict on a bounded queue and
+    never waits: when the queue is full the event is dropped and counted. A
+    writer thread serialises events to gzip-compressed JSONL and rotates the
+    file when it reaches TRANSCRIPT_MAX_BYTES (uncompressed) or is older than
+    TRANSCRIPT_ROTATE_SECONDS. Files are written as `*.jsonl.gz.part` and
+    renamed when closed, so readers only ever see complete files.
+
+    Telegram ids are replaced by a keyed hash; the key is TRANSCRIPT_SALT or a
+    random one stored next to the export, so the same student gets the same
+    hash across restarts.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = DEFAULT_TRANSCRIPT_DIR
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.rotate_seconds = DEFAULT_ROTATE_SECONDS
+        self._salt = b""
+        self._queue = queue.Queue(maxsize=DEFAULT_QUEUE_SIZE)
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._written = 0
+        self._sequence = 0
+
+    def configure(self, config) -> None:
+        self.enabled = config.get_bool('TRANSCRIPT_EXPORT')
+        self.directory = config.get('TRANSCRIPT_DIR', DEFAULT_TRANSCRIPT_DIR)
+        self.max_bytes = config.get_int('TRANSCRIPT_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.rotate_seconds = config.get_float('TRANSCRIPT_ROTATE_SECONDS', DEFAULT_ROTATE_SECONDS)
+        self._queue = queue.Queue(maxsize=config.get_int('TRANSCRIPT_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        if self.enabled:
+            self._salt = self._load_salt(config.get('TRANSCRIPT_SALT', ''))
+
+    def _load_salt(self, configured) -> bytes:
+        if configured:
+            return configured.encode()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, SALT_FILE)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(secrets.token_hex(32))
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip().encode()
+
+    def user_hash(self, user_id) -> str:
+        return hmac.new(self._salt, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+    def record(self, event, user_id, **fields) -> None:
+        """Queue one transcript event without blocking the caller."""
+        if not self.enabled:
+            return
+        self.start()
+        fields.update(
+            schema=SCHEMA_VERSION, event=event, user=self.user_hash(user_id),
+            ts=datetime.now(timezone.utc).isoformat(),
+        )
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            dropped_total.inc(event=event)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0) -> None:
+        """Write out queued events and close the current file."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logging.warning("Transcript export queue is full, some events will be lost on shutdown")
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            try:
+                # Wake up at least once a second so idle files are still rotated on time
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            try:
+                if self._file is not None and time.monotonic() - self._opened_at >= self.rotate_seconds:
+                    self._close()
+                if item is not None:
+                    self._write(item)
+            except Exception:
+                logging.exception("Error writing transcript export")
+        self._close()
+
+    def _write(self, item) -> None:
+        if self._file is None:
+            self._open()
+        line = json.dumps({field: item.get(field) for field in FIELDS}, ensure_ascii=False) + "\n"
+        data = line.encode('utf-8')
+        self._file.write(data)
+        self._written += len(data)
+        exported_total.inc(event=item["event"])
+        if self._written >= self.max_bytes:
+            self._close()
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        self._sequence += 1
+        name = f"transcripts-{stamp}-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+        self._path = os.path.join(self.directory, name)
+        self._file = gzip.open(self._path + ".part", 'wb')
+        self._opened_at = time.monotonic()
+        self._written = 0
+
+    def _close(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._path + ".part", self._path)
+        self._file = None
+
+
+transcript_exporter = TranscriptExporter()
+
+
+def iter_transcripts(directory=DEFAULT_TRANSCRIPT_DIR, user=None, event=None):
+    """Stream records from every finished export file, oldest first.
+
+    Files are decompressed line by line, so exports larger than memory can be
+    filtered or aggregated in a single pass.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, "transcripts-*.jsonl.gz"))):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if user is not None and record["user"] != user:
+                    continue
+                if event is not None and record["event"] != event:
+                    continue
+                yield record
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Print exported debate transcripts as JSONL")
+    parser.add_argument("directory", nargs="?", default=DEFAULT_TRANSCRIPT_DIR)
+    parser.add_argument("--user", help="only records for this user hash")
+    parser.add_argument("--event", help="only records of this event type (message, topic, side)")
+    args = parser.parse_args(argv)
+    for record in iter_transcripts(args.directory, user=args.user, event=args.event):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import importlib.util
+import logging
+
+import httpx
+from openai import DefaultAsyncHttpxClient
+from telegram.request import BaseRequest, HTTPXRequest
+
+from bot.metrics import registry
+
+# getUpdates long polls, other Bot API calls, and streamed LLM completions
+TRAFFIC_CLASSES = ("updates", "telegram", "llm")
+
+DEFAULTS = {
+    # PTB adds the long-poll timeout to the read timeout of every getUpdates call
+    "updates": dict(pool_size=1, keepalive_seconds=60, connect_timeout=5, read_timeout=5, write_timeout=5,
+                    pool_timeout=1),
+    "telegram": dict(pool_size=32, keepalive_seconds=60, connect_timeout=5, read_timeout=10, write_timeout=10,
+                     pool_timeout=5),
+    # The read timeout applies to every streamed chunk, not to the whole reply
+    "llm": dict(pool_size=64, keepalive_seconds=60, connect_timeout=5, read_timeout=60, write_timeout=10,
+                pool_timeout=10),
+}
+
+pool_size_gauge = registry.gauge("debatebot_http_pool_size", "Maximum connections per HTTP pool")
+in_flight_gauge = registry.gauge("debatebot_http_requests_in_flight", "HTTP requests being sent or streamed")
+utilization_gauge = registry.gauge(
+    "debatebot_http_pool_utilization", "Requests in flight divided by the pool size (above 1 with HTTP/2)",
+)
+connections_gauge = registry.gauge("debatebot_http_connections", "Open HTTP connections by state")
+pool_timeouts_total = registry.counter(
+    "debatebot_http_pool_timeouts_total", "Requests that gave up waiting for a free connection",
+)
+
+
+class TrafficSettings:
+    """Connection pool, keep-alive, protocol and timeouts of one traffic class."""
+
+    __slots__ = ("traffic", "pool_size", "keepalive_seconds", "connect_timeout", "read_timeout",
+                 "write_timeout", "pool_timeout", "http2")
+
+    def __init__(self, traffic, pool_size, keepalive_seconds, connect_timeout, read_timeout, write_timeout,
+                 pool_timeout, http2=False):
+        self.traffic = traffic
+        self.pool_size = pool_size
+        self.keepalive_seconds = keepalive_seconds
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.pool_timeout = pool_timeout
+        self.http2 = http2
+
+    @classmethod
+    def from_config(cls, traffic, config):
+        prefix = f"TRANSPORT_{traffic.upper()}_"
+        defaults = DEFAULTS[traffic]
+
+        def option(key):
+            return config.get_float(prefix + key.upper(), defaults[key])
+
+        http2 = config.get_bool(prefix + 'HTTP2')
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning(f"{prefix}HTTP2=1 needs the h2 package (pip install httpx[http2]); using HTTP/1.1")
+            http2 = False
+        return cls(
+            traffic,
+            pool_size=config.get_int(prefix + 'POOL_SIZE', defaults['pool_size']),
+            keepalive_seconds=option('keepalive_seconds'),
+            connect_timeout=option('connect_timeout'),
+            read_timeout=option('read_timeout'),
+            write_timeout=option('write_timeout'),
+            pool_timeout=option('pool_timeout'),
+            http2=http2,
+        )
+
+    def timeout(self, read=None) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout if read is None else read,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_seconds,
+        )
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that reports when the request stops using its connection."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that keeps the pool metrics of its traffic class up to date.
+
+    A request counts as in flight from the moment it asks for a connection
+    until its response body is closed, which for an LLM stream is the end of
+    the reply.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.in_flight = 0
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=settings.limits(), http1=True, http2=settings.http2,
+        )
+        pool_size_gauge.set(settings.pool_size, traffic=settings.traffic)
+
+    def connections(self):
+        """(active, idle) connections, read from httpcore's pool."""
+        connections = getattr(getattr(self._transport, "_pool", None), "connections", ())
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return len(connections) - idle, idle
+
+    def _update(self) -> None:
+        traffic = self.settings.traffic
+        in_flight_gauge.set(self.in_flight, traffic=traffic)
+        utilization_gauge.set(self.in_flight / max(1, self.settings.pool_size), traffic=traffic)
+        active, idle = self.connections()
+        connections_gauge.set(active, traffic=traffic, state="active")
+        connections_gauge.set(idle, traffic=traffic, state="idle")
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._update()
+
+    async def handle_async_request(self, request):
+        self.in_flight += 1
+        self._update()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.PoolTimeout:
+            pool_timeouts_total.inc(traffic=self.settings.traffic)
+            self._release()
+            raise
+        except BaseException:
+            self._release()
+            raise
+        response.stream = _ReleasingStream(response.stream, self._release)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class TelegramRequest(HTTPXRequest):
+    """PTB request backend using the keep-alive settings and metrics of a traffic class."""
+
+    def __init__(self, settings):
+        # Read by _build_client, which HTTPXRequest.__init__ calls
+        self._settings = settings
+        super().__init__(
+            connection_pool_size=settings.pool_size,
+            read_timeout=settings.read_timeout,
+            write_timeout=settings.write_timeout,
+            connect_timeout=settings.connect_timeout,
+            pool_timeout=settings.pool_timeout,
+            http_version="2" if settings.http2 else "1.1",
+        )
+
+    def _build_client(self) -> httpx.AsyncClient:
+        # HTTPXRequest has no hook for limits or transports; the protocol is chosen by the transport
+        return httpx.AsyncClient(
+            timeout=self._client_kwargs["timeout"],
+            transport=InstrumentedTransport(self._settings),
+        )
+
+
+class SharedRequest(BaseRequest):
+    """One HTTP connection pool used by several bots.
+
+    Every bot initializes and shuts down its request object; the pool is
+    opened by the first and closed by the last.
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._users = 0
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        if self._users == 0:
+            await self._request.initialize()
+        self._users += 1
+
+    async def shutdown(self) -> None:
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await self._request.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        return await self._request.do_request(*args, **kwargs)
+
+
+class HttpTransport:
+    """The bot's HTTP clients, one pool per traffic class, shared process-wide.
+
+    Settings come from the TRANSPORT_<CLASS>_* keys (POOL_SIZE,
+    KEEPALIVE_SECONDS, CONNECT_TIMEOUT, READ_TIMEOUT, WRITE_TIMEOUT,
+    POOL_TIMEOUT, HTTP2) for the classes updates, telegram and llm. Clients
+    are created on first use, so `configure` must run before that.
+    """
+
+    def __init__(self):
+        self.settings = {traffic: TrafficSettings(traffic, **DEFAULTS[traffic]) for traffic in TRAFFIC_CLASSES}
+        self._requests = {}
+        self._llm_client = None
+
+    def configure(self, config) -> None:
+        self.settings = {traffic: TrafficSettings.from_config(traffic, config) for traffic in TRAFFIC_CLASSES}
+
+    def reserve_long_polls(self, count) -> None:
+        """Make room for `count` bots polling getUpdates at the same time."""
+        settings = self.settings["updates"]
+        settings.pool_size = max(settings.pool_size, count)
+
+    def _request(self, traffic) -> SharedRequest:
+        request = self._requests.get(traffic)
+        if request is None:
+            request = self._requests[traffic] = SharedRequest(TelegramRequest(self.settings[traffic]))
+        return request
+
+    def telegram_request(self) -> SharedRequest:
+        return self._request("telegram")
+
+    def updates_request(self) -> SharedRequest:
+        return self._request("updates")
+
+    def llm_client(self) -> httpx.AsyncClient:
+        """httpx client for all OpenAI-compatible backends."""
+        if self._llm_client is None:
+            settings = self.settings["llm"]
+            self._llm_client = DefaultAsyncHttpxClient(
+                timeout=settings.timeout(), transport=InstrumentedTransport(settings),
+            )
+        return self._llm_client
+
+    def llm_timeout(self, read=None) -> httpx.Timeout:
+        return self.settings["llm"].timeout(read)
+
+    async def aclose(self) -> None:
+        """Close the LLM client; the Telegram requests are shut down by their bots."""
+        if self._llm_client is not None:
+            await self._llm_client.aclose()
+            self._llm_client = None
+
+
+http_transport = HttpTransport()
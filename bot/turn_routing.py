@@ -0,0 +1,109 @@
+import logging
+import re
+
+from bot.metrics import registry
+from bot.tenants import TenantLocal
+
+# Route name -> (default output token cap, whether it uses the cheaper model by default)
+DEFAULT_ROUTES = {
+    "opening": (400, False),
+    "clarify": (150, True),
+    "brief": (200, True),
+    "rebuttal": (350, False),
+}
+DEFAULT_SHORT_MESSAGE_WORDS = 12
+# Log per-route averages after this many turns
+DEFAULT_SUMMARY_EVERY = 100
+
+QUESTION_WORDS = re.compile(
+    r"^(what|why|how|who|which|when|where|can|could|do|does|is|are|"
+    r"что|почему|зачем|как|кто|какой|какая|какие|когда|где|разве|неужели)\b",
+    re.IGNORECASE,
+)
+
+route_latency = registry.histogram("debatebot_route_latency_seconds", "Generation time per turn route")
+route_tokens = registry.counter("debatebot_route_tokens_total", "Tokens used per turn route")
+
+
+class Route:
+    __slots__ = ("name", "model", "max_tokens")
+
+    def __init__(self, name, model, max_tokens):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+
+
+def is_question(text) -> bool:
+    text = text.strip()
+    return text.endswith("?") or bool(QUESTION_WORDS.match(text))
+
+
+class TurnRouter:
+    """Picks a model tier and output cap for each debate turn.
+
+    - opening: first turn of a debate, the bot lays out its position
+    - clarify: a short question such as "what do you mean?"
+    - brief: a short remark that needs no full counter-argument
+    - rebuttal: everything else
+
+    Each route has ROUTE_<NAME>_MODEL and ROUTE_<NAME>_MAX_TOKENS keys. An empty
+    model falls back to GPT_MODEL, or to ROUTE_FAST_MODEL for the short routes;
+    a cap of 0 means no limit. Averages per route are logged every
+    ROUTE_SUMMARY_EVERY turns and exported as metrics.
+    """
+
+    def __init__(self):
+        self.short_message_words = DEFAULT_SHORT_MESSAGE_WORDS
+        self.routes = {name: Route(name, None, cap) for name, (cap, _) in DEFAULT_ROUTES.items()}
+        self.summary_every = DEFAULT_SUMMARY_EVERY
+        self._since_summary = 0
+
+    def configure(self, config) -> None:
+        self.short_message_words = config.get_int('ROUTE_SHORT_MESSAGE_WORDS', DEFAULT_SHORT_MESSAGE_WORDS)
+        self.summary_every = config.get_int('ROUTE_SUMMARY_EVERY', DEFAULT_SUMMARY_EVERY)
+        main_model = config.get('GPT_MODEL', '') or None
+        fast_model = config.get('ROUTE_FAST_MODEL', '') or main_model
+        self.routes = {}
+        for name, (cap, fast) in DEFAULT_ROUTES.items():
+            prefix = f"ROUTE_{name.upper()}_"
+            model = config.get(prefix + 'MODEL', '') or (fast_model if fast else main_model)
+            self.routes[name] = Route(name, model, config.get_int(prefix + 'MAX_TOKENS', cap))
+
+    def choose(self, text, previous_turns) -> Route:
+        """Route a user message given how many turns the debate already has."""
+        if previous_turns == 0:
+            return self.routes["opening"]
+        if len(text.split()) <= self.short_message_words:
+            return self.routes["clarify" if is_question(text) else "brief"]
+        return self.routes["rebuttal"]
+
+    def observe(self, route, seconds, usage) -> None:
+        """Record latency and token counts for a finished turn."""
+        route_latency.observe(seconds, route=route.name)
+        if usage is not None:
+            route_tokens.inc(usage.prompt_tokens, route=route.name, kind="prompt")
+            route_tokens.inc(usage.completion_tokens, route=route.name, kind="completion")
+        logging.debug(f"Turn route {route.name}: {seconds:.2f}s")
+
+        self._since_summary += 1
+        if self.summary_every and self._since_summary >= self.summary_every:
+            self._since_summary = 0
+            logging.info(self.summary())
+
+    def summary(self) -> str:
+        lines = ["Turn routes since start:"]
+        for name, route in self.routes.items():
+            turns = route_latency.count(route=name)
+            if not turns:
+                continue
+            completion = route_tokens.value(route=name, kind="completion") / turns
+            prompt = route_tokens.value(route=name, kind="prompt") / turns
+            lines.append(
+                f"  {name} ({route.model or 'default model'}, cap {route.max_tokens or 'none'}): {turns} turns, "
+                f"{route_latency.mean(route=name):.2f}s avg, {prompt:.0f} prompt + {completion:.0f} completion tokens avg"
+            )
+        return "\n".join(lines)
+
+
+turn_router = TenantLocal(TurnRouter)
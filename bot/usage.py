@@ -0,0 +1,123 @@
+import logging
+import time
+from datetime import datetime, timezone
+
+from bot.metrics import registry
+from bot.rate_limit import TokenBucket
+from bot.tenants import TenantLocal, run_blocking
+from database.database_support import get_daily_token_usage, increment_token_usage
+
+DEFAULT_MESSAGES_PER_MINUTE = 20
+DEFAULT_MESSAGE_BURST = 5
+DEFAULT_DAILY_TOKEN_BUDGET = 0  # 0 means unlimited
+FIRESTORE_BATCH_LIMIT = 500
+
+tokens_total = registry.counter("debatebot_llm_tokens_total", "Tokens consumed by LLM calls")
+limited_total = registry.counter("debatebot_user_limited_total", "GPT turns refused by per-user limits")
+
+
+def _today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class UsageTracker:
+    """Per-user message rate limiting and daily token accounting.
+
+    Token counts are kept in memory and written to Firestore in batches by
+    `flush_usage`, so a model reply never waits on a usage write. The first
+    budget check of the day for a user reads their stored total once, so
+    budgets survive restarts.
+    """
+
+    def __init__(self):
+        self.messages_per_minute = DEFAULT_MESSAGES_PER_MINUTE
+        self.message_burst = DEFAULT_MESSAGE_BURST
+        self.daily_token_budget = DEFAULT_DAILY_TOKEN_BUDGET
+        self._limiters = {}
+        self._prune_at = 1024
+        self._daily = {}
+        self._unflushed = {}
+
+    def configure(self, config) -> None:
+        self.messages_per_minute = config.get_float('USER_MESSAGES_PER_MINUTE', DEFAULT_MESSAGES_PER_MINUTE)
+        self.message_burst = config.get_float('USER_MESSAGE_BURST', DEFAULT_MESSAGE_BURST)
+        self.daily_token_budget = config.get_int('DAILY_TOKEN_BUDGET', DEFAULT_DAILY_TOKEN_BUDGET)
+
+    def allow_message(self, user_id) -> bool:
+        """Take one token from the user's message bucket. False means the user is flooding."""
+        if self.messages_per_minute <= 0:
+            return True
+        limiter = self._limiters.get(user_id)
+        if limiter is None:
+            if len(self._limiters) >= self._prune_at:
+                now = time.monotonic()
+                for key in [k for k, b in self._limiters.items() if b.idle(now)]:
+                    del self._limiters[key]
+                self._prune_at = max(1024, 2 * len(self._limiters))
+            limiter = self._limiters[user_id] = TokenBucket(self.messages_per_minute / 60, self.message_burst)
+        allowed = limiter.consume()
+        if not allowed:
+            limited_total.inc(reason="flood")
+        return allowed
+
+    def tokens_used_today(self, user_id) -> int:
+        key = (user_id, _today())
+        used = self._daily.get(key)
+        if used is None:
+            used = self._daily[key] = get_daily_token_usage(user_id, key[1])
+        return used
+
+    def over_budget(self, user_id) -> bool:
+        """Return True if the user has spent their daily token budget."""
+        if self.daily_token_budget <= 0:
+            return False
+        over = self.tokens_used_today(user_id) >= self.daily_token_budget
+        if over:
+            limited_total.inc(reason="budget")
+        return over
+
+    def record(self, user_id, prompt_tokens, completion_tokens) -> None:
+        """Account the usage reported by the model for one reply."""
+        key = (user_id, _today())
+        total = prompt_tokens + completion_tokens
+        if key in self._daily:
+            self._daily[key] += total
+        entry = self._unflushed.setdefault(key, [0, 0])
+        entry[0] += prompt_tokens
+        entry[1] += completion_tokens
+        tokens_total.inc(prompt_tokens, kind="prompt")
+        tokens_total.inc(completion_tokens, kind="completion")
+
+    def take_unflushed(self):
+        """Detach the usage recorded since the last flush."""
+        pending, self._unflushed = self._unflushed, {}
+        # Yesterday's totals are no longer needed for budget checks
+        today = _today()
+        for key in [k for k in self._daily if k[1] != today]:
+            del self._daily[key]
+        return [(user_id, day, p, c) for (user_id, day), (p, c) in pending.items()]
+
+    def restore_unflushed(self, entries) -> None:
+        """Put back entries whose write failed so the next flush retries them."""
+        for user_id, day, prompt_tokens, completion_tokens in entries:
+            entry = self._unflushed.setdefault((user_id, day), [0, 0])
+            entry[0] += prompt_tokens
+            entry[1] += completion_tokens
+
+
+usage_tracker = TenantLocal(UsageTracker)
+
+
+async def flush_usage(context=None) -> None:
+    """JobQueue callback writing buffered token usage to Firestore."""
+    entries = usage_tracker.take_unflushed()
+    if not entries:
+        return
+
+    for start in range(0, len(entries), FIRESTORE_BATCH_LIMIT):
+        chunk = entries[start:start + FIRESTORE_BATCH_LIMIT]
+        # Firestore calls are blocking; keep them off the event loop
+        committed = await run_blocking(increment_token_usage, chunk)
+        if not committed:
+            usage_tracker.restore_unflushed(chunk)
+    logging.info(f"Flushed token usage for {len(entries)} user-days")
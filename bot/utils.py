@@ -1,15 +1,29 @@
+import glob
 import random
 import json
 import os
+from types import MappingProxyType
+
+# Parsed message catalogs by requested language, shared by every bot in the process
+_catalogs = {}
 
 def generate_verification_code(length=6) -> str:
     """Generate a random numeric verification code."""
     return ''.join(random.choice('0123456789') for _ in range(length))
 
+def known_languages():
+    """Languages with a message catalog, e.g. ('en', 'ru')."""
+    return tuple(sorted(os.path.basename(path)[len("messages_"):-len(".json")]
+                        for path in glob.glob("messages_*.json")))
+
 def load_messages(language):
-    file_path = f"messages_{language}.json"
-    if not os.path.exists(file_path):
-        # Default to English if file doesn't exist
-        file_path = "messages_en.json"
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
\ No newline at end of file
+    """The read-only message catalog for `language`, parsed on first use."""
+    catalog = _catalogs.get(language)
+    if catalog is None:
+        file_path = f"messages_{language}.json"
+        if not os.path.exists(file_path):
+            # Default to English if file doesn't exist
+            file_path = "messages_en.json"
+        with open(file_path, 'r', encoding='utf-8') as f:
+            catalog = _catalogs[language] = MappingProxyType(json.load(f))
+    return catalog
\ No newline at end of file
@@ -0,0 +1,145 @@
+import hmac
+import time
+
+from bot.tenants import TenantLocal
+
+DEFAULT_CODE_TTL_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RESEND_COOLDOWN_SECONDS = 60
+
+# Results of PendingVerificationStore.check
+CODE_OK = "ok"
+CODE_WRONG = "wrong"
+CODE_EXPIRED = "expired"
+CODE_TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+
+class PendingVerification:
+    __slots__ = ("email", "code", "expires_at", "attempts", "sent_at")
+
+    def __init__(self, email, code, expires_at, sent_at):
+        self.email = email
+        self.code = code
+        self.expires_at = expires_at
+        self.attempts = 0
+        self.sent_at = sent_at
+
+
+class PendingVerificationStore:
+    """Interface for short-lived verification codes that never need to be durable."""
+
+    def __init__(self, ttl_seconds=DEFAULT_CODE_TTL_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 resend_cooldown_seconds=DEFAULT_RESEND_COOLDOWN_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        self.resend_cooldown_seconds = resend_cooldown_seconds
+
+    def issue(self, user_id, email, code) -> None:
+        """Store a freshly sent code, replacing any previous one for the user."""
+        raise NotImplementedError
+
+    def get(self, user_id):
+        """Return the user's unexpired PendingVerification, or None."""
+        raise NotImplementedError
+
+    def check(self, user_id, entered_code) -> str:
+        """Compare an entered code and return one of the CODE_* results."""
+        raise NotImplementedError
+
+    def resend_wait(self, user_id, email) -> float:
+        """Seconds left before the user may be sent another email at this address (0 if allowed).
+
+        The cooldown outlives `discard`, so cancelling and registering again
+        does not send more mail. It is kept per user, so one user entering an
+        address does not hold back anyone else.
+        """
+        raise NotImplementedError
+
+    def discard(self, user_id) -> None:
+        """Drop the user's pending code (the resend cooldown stays)."""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Drop expired entries. Returns how many were removed."""
+        raise NotImplementedError
+
+
+class InMemoryVerificationStore(PendingVerificationStore):
+    """Per-process store. Codes are lost on restart, which only means users request a new one."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = {}
+        # Time of the last email per (user_id, address)
+        self._sent_at = {}
+
+    def issue(self, user_id, email, code) -> None:
+        now = time.monotonic()
+        self._pending[user_id] = PendingVerification(email, code, now + self.ttl_seconds, now)
+        self._sent_at[(user_id, email.lower())] = now
+
+    def get(self, user_id):
+        pending = self._pending.get(user_id)
+        if pending is not None and pending.expires_at <= time.monotonic():
+            del self._pending[user_id]
+            return None
+        return pending
+
+    def check(self, user_id, entered_code) -> str:
+        pending = self.get(user_id)
+        if pending is None:
+            return CODE_EXPIRED
+        if pending.attempts >= self.max_attempts:
+            return CODE_TOO_MANY_ATTEMPTS
+        pending.attempts += 1
+        if hmac.compare_digest(str(entered_code).encode(), str(pending.code).encode()):
+            del self._pending[user_id]
+            return CODE_OK
+        if pending.attempts >= self.max_attempts:
+            return CODE_TOO_MANY_ATTEMPTS
+        return CODE_WRONG
+
+    def resend_wait(self, user_id, email) -> float:
+        sent_at = self._sent_at.get((user_id, email.lower()))
+        if sent_at is None:
+            return 0.0
+        return max(0.0, sent_at + self.resend_cooldown_seconds - time.monotonic())
+
+    def discard(self, user_id) -> None:
+        self._pending.pop(user_id, None)
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired = [user_id for user_id, pending in self._pending.items() if pending.expires_at <= now]
+        for user_id in expired:
+            del self._pending[user_id]
+        cooled = [key for key, sent_at in self._sent_at.items() if sent_at + self.resend_cooldown_seconds <= now]
+        for key in cooled:
+            del self._sent_at[key]
+        return len(expired)
+
+
+STORES = {
+    'memory': InMemoryVerificationStore,
+}
+
+
+def create_verification_store(config) -> PendingVerificationStore:
+    """Build the store named by VERIFICATION_STORE (default: memory)."""
+    store_class = STORES[config.get('VERIFICATION_STORE', 'memory')]
+    return store_class(
+        ttl_seconds=config.get_float('VERIFICATION_CODE_TTL_SECONDS', DEFAULT_CODE_TTL_SECONDS),
+        max_attempts=config.get_int('VERIFICATION_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+        resend_cooldown_seconds=config.get_float('VERIFICATION_RESEND_COOLDOWN_SECONDS', DEFAULT_RESEND_COOLDOWN_SECONDS),
+    )
+
+
+_store = TenantLocal(InMemoryVerificationStore)
+
+
+def configure_verification_store(config) -> None:
+    _store.set(create_verification_store(config))
+
+
+def get_verification_store() -> PendingVerificationStore:
+    return _store.current()
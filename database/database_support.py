@@ -1,6 +1,13 @@
+from datetime import datetime, timedelta, timezone
+
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.base_query import FieldFilter
 from bot.config import load_config
+from bot.tenants import tenant_collection
+from database.user_cache import user_cache, MISS
+from database.user_stats import user_stats
 
 config = load_config()
 
@@ -9,42 +16,82 @@ firebase_admin.initialize_app(cred)
 
 db = firestore.client()
 
+
+def _collection(name):
+    """A per-bot collection; each bot in a multi-bot process has its own users."""
+    return db.collection(tenant_collection(name))
+
+
+def users_collection():
+    """The current bot's `users` collection, for the change feed."""
+    return _collection('users')
+
+
+def topics_collection():
+    """The current bot's curated `topics` collection, for the topic catalog's change feed."""
+    return _collection('topics')
+
+
+def _read_user(user_id):
+    """Return the user's document as a dict, or None if there is no such user.
+
+    Served from the local user cache while its change feed is live.
+    """
+    data = user_cache.get(user_id)
+    if data is MISS:
+        generation = user_cache.begin_read(user_id)
+        doc = _collection('users').document(str(user_id)).get()
+        data = doc.to_dict() if doc.exists else None
+        user_cache.store_read(user_id, data, generation)
+    user_stats.observe(user_id, data)
+    return data
+
+
 def insert_user(user_id, email, verification_code, conversation_state='STARTED', topic=None, side=None, language=None):
     """Insert a new user into Firestore."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
+        user_ref = _collection('users').document(str(user_id))
         user_ref.set({
             'email': email,
             'verification_code': verification_code,
             'conversation_state': conversation_state,
+            'updated_at': firestore.SERVER_TIMESTAMP,
             'topic': topic,
             'side': side,
             'language': language  # Added language field
         }, merge=True)
+        user_cache.invalidate(user_id)
+        user_stats.on_insert(user_id, conversation_state, language)
     except Exception as e:
         print(f"Error inserting user: {e}")
 
 
-def update_user_email(user_id, new_email, verification_code):
-    """Update the user's email and verification code in Firestore."""
+def complete_email_verification(user_id, email):
+    """Store the verified email and mark the user as VERIFIED in one write."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
+        user_ref = _collection('users').document(str(user_id))
         user_ref.update({
-            'email': new_email,
-            'verification_code': verification_code,
-            'conversation_state': 'AWAITING_VERIFICATION_CODE'
+            'email': email,
+            'verification_code': firestore.DELETE_FIELD,
+            'conversation_state': 'VERIFIED',
+            'updated_at': firestore.SERVER_TIMESTAMP,
         })
+        user_cache.invalidate(user_id)
+        user_stats.on_state(user_id, 'VERIFIED')
     except Exception as e:
-        print(f"Error updating email: {e}")
+        print(f"Error completing email verification: {e}")
 
 
 def update_user_conversation_state(user_id, conversation_state):
     """Update the user's conversation state in Firestore."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
+        user_ref = _collection('users').document(str(user_id))
         user_ref.update({
-            'conversation_state': conversation_state
+            'conversation_state': conversation_state,
+            'updated_at': firestore.SERVER_TIMESTAMP,
         })
+        user_cache.invalidate(user_id)
+        user_stats.on_state(user_id, conversation_state)
     except Exception as e:
         print(f"Error updating conversation state: {e}")
 
@@ -52,125 +99,223 @@ def update_user_conversation_state(user_id, conversation_state):
 def reset_user_registration(user_id):
     """Reset the user's registration data in Firestore."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
+        user_ref = _collection('users').document(str(user_id))
         user_ref.update({
             'email': firestore.DELETE_FIELD,
             'verification_code': firestore.DELETE_FIELD,
             'conversation_state': 'STARTED',
+            'updated_at': firestore.SERVER_TIMESTAMP,
             # 'language': firestore.DELETE_FIELD,
         })
+        user_cache.invalidate(user_id)
+        user_stats.on_state(user_id, 'STARTED')
     except Exception as e:
         print(f"Error resetting user registration: {e}")
 
 
-def get_conversation_state(user_id):
-    """Get the user's conversation state from Firestore."""
+def get_user(user_id):
+    """Get the user's whole document from Firestore, or None if there is no such user."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        doc = user_ref.get()
-        if doc.exists:
-            return doc.to_dict().get('conversation_state')
-        else:
-            return None
+        return _read_user(user_id)
     except Exception as e:
-        print(f"Error fetching conversation state: {e}")
+        print(f"Error fetching user: {e}")
         return None
 
 
 def update_user_language(user_id, language):
     """Update the user's language preference in Firestore."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
+        user_ref = _collection('users').document(str(user_id))
         user_ref.update({
-            'language': language
+            'language': language,
+            'updated_at': firestore.SERVER_TIMESTAMP
         })
+        user_cache.invalidate(user_id)
+        user_stats.on_language(user_id, language)
     except Exception as e:
         print(f"Error updating language: {e}")
 
 
-def get_user_language(user_id):
-    """Get the user's language preference from Firestore."""
+def update_user_debate_info(user_id, topic, side, topic_id=None):
+    """Update the user's debate topic and side in Firestore.
+
+    `topic_id` is the catalog id of the topic, or None for a free-text topic.
+    """
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        doc = user_ref.get()
-        if doc.exists:
-            return doc.to_dict().get('language', 'en')  # Default to 'en' if not set
-        else:
-            return 'en'
+        user_ref = _collection('users').document(str(user_id))
+        user_ref.update({
+            'topic': topic,
+            'topic_id': topic_id,
+            'side': side,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        user_cache.invalidate(user_id)
     except Exception as e:
-        print(f"Error fetching user language: {e}")
-        return 'en'
-    
+        print(f"Error updating debate info: {e}")
+
 
-def get_user_email(user_id):
-    """Get the user's email from Firestore."""
+def delete_user_from_db(user_id):
+    """Delete a user from Firestore."""
+    try:
+        user_ref = _collection('users').document(str(user_id))
+        user_ref.delete()
+        user_cache.invalidate(user_id)
+        user_stats.on_delete(user_id)
+    except Exception as e:
+        print(f"Error deleting user: {e}")
+
+def get_daily_token_usage(user_id, day):
+    """Get the number of tokens the user has consumed on the given day (YYYY-MM-DD)."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        doc = user_ref.get()
+        doc = _collection('usage').document(f"{user_id}_{day}").get()
         if doc.exists:
-            return doc.to_dict().get('email')
+            return doc.to_dict().get('total_tokens', 0)
         else:
-            return None
+            return 0
     except Exception as e:
-        print(f"Error fetching user email: {e}")
-        return None
+        print(f"Error fetching token usage: {e}")
+        return 0
+
 
+def increment_token_usage(entries):
+    """Add token counts to per-user daily usage documents in one batched write.
 
-def user_exists(user_id):
-    """Check if the user exists in Firestore."""
+    `entries` is a list of at most 500 (user_id, day, prompt_tokens, completion_tokens)
+    tuples, the Firestore limit for a single batch. Returns True if the batch was committed.
+    """
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        return user_ref.get().exists
+        batch = db.batch()
+        for user_id, day, prompt_tokens, completion_tokens in entries:
+            usage_ref = _collection('usage').document(f"{user_id}_{day}")
+            batch.set(usage_ref, {
+                'user_id': str(user_id),
+                'day': day,
+                'prompt_tokens': firestore.Increment(prompt_tokens),
+                'completion_tokens': firestore.Increment(completion_tokens),
+                'total_tokens': firestore.Increment(prompt_tokens + completion_tokens),
+            }, merge=True)
+        batch.commit()
+        return True
     except Exception as e:
-        print(f"Error checking if user exists: {e}")
+        print(f"Error writing token usage: {e}")
         return False
 
 
-def get_verification_code(user_id):
-    """Get the verification code for the user from Firestore."""
+def claim_update_id(key, ttl_hours=24):
+    """Record an update as handled, across replicas.
+
+    Returns True for the first claim, False if the update was already claimed
+    and None on errors. `expires_at` is meant for a Firestore TTL policy on the
+    processed_updates collection.
+    """
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        doc = user_ref.get()
-        if doc.exists:
-            return doc.to_dict().get('verification_code')
-        else:
-            return None
+        _collection('processed_updates').document(key).create({
+            'expires_at': datetime.now(timezone.utc) + timedelta(hours=ttl_hours),
+        })
+        return True
+    except AlreadyExists:
+        return False
     except Exception as e:
-        print(f"Error fetching verification code: {e}")
+        print(f"Error claiming update id: {e}")
         return None
 
 
-def update_user_debate_info(user_id, topic, side):
-    """Update the user's debate topic and side in Firestore."""
+def get_users_page(states=None, language=None, page_size=200, start_after_id=None):
+    """Get one page of users ordered by document id, optionally filtered.
+
+    Returns a list of (user_id, language) tuples; pass the last user_id back as
+    `start_after_id` to fetch the next page. Only the fields needed are read.
+    """
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        user_ref.update({
-            'topic': topic,
-            'side': side
+        query = _collection('users')
+        if states:
+            query = query.where(filter=FieldFilter('conversation_state', 'in', list(states)))
+        if language:
+            query = query.where(filter=FieldFilter('language', '==', language))
+        query = query.order_by('__name__').limit(page_size)
+        if start_after_id is not None:
+            query = query.start_after({'__name__': str(start_after_id)})
+        return [(doc.id, doc.get('language') or 'en') for doc in query.select(['language']).stream()]
+    except Exception as e:
+        print(f"Error fetching users page: {e}")
+        return None
+
+
+def add_topic(topic_id, title):
+    """Add a topic to the catalog. Returns True on success."""
+    try:
+        topics_collection().document(topic_id).set({
+            'title': title,
+            'created_at': firestore.SERVER_TIMESTAMP,
         })
+        return True
     except Exception as e:
-        print(f"Error updating debate info: {e}")
+        print(f"Error adding topic: {e}")
+        return False
 
 
-def get_user_debate_info(user_id):
-    """Get the user's debate topic and side from Firestore."""
+def delete_topic(topic_id):
+    """Remove a topic from the catalog. Returns True on success."""
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        doc = user_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
-            return data.get('topic'), data.get('side')
-        else:
-            return None
+        topics_collection().document(topic_id).delete()
+        return True
     except Exception as e:
-        print(f"Error fetching debate info: {e}")
+        print(f"Error deleting topic: {e}")
+        return False
+
+
+def count_users(field=None, value=None):
+    """Count users, optionally only those whose `field` equals `value`.
+
+    Uses a Firestore count aggregation, which is billed per 1000 index
+    entries instead of per document. Returns None on errors.
+    """
+    try:
+        query = _collection('users')
+        if field is not None:
+            query = query.where(filter=FieldFilter(field, '==', value))
+        return int(query.count().get()[0][0].value)
+    except Exception as e:
+        print(f"Error counting users: {e}")
         return None
 
 
-def delete_user_from_db(user_id):
-    """Delete a user from Firestore."""
+def get_stale_users_page(states, older_than, page_size=200, start_after=None):
+    """Get users in the given states whose `updated_at` is before `older_than`.
+
+    Ordered by `updated_at` (backed by a composite index on conversation_state
+    and updated_at). Returns a list of (user_id, updated_at) tuples; pass the
+    last tuple back as `start_after` to continue. Users written before
+    `updated_at` existed are not matched.
+    """
     try:
-        user_ref = db.collection('users').document(str(user_id))
-        user_ref.delete()
+        query = (
+            _collection('users')
+            .where(filter=FieldFilter('conversation_state', 'in', list(states)))
+            .where(filter=FieldFilter('updated_at', '<', older_than))
+            .order_by('updated_at')
+            .order_by('__name__')
+            .limit(page_size)
+        )
+        if start_after is not None:
+            query = query.start_after({'updated_at': start_after[1], '__name__': str(start_after[0])})
+        return [(doc.id, doc.get('updated_at')) for doc in query.select(['updated_at']).stream()]
+    except Exception as e:
+        print(f"Error fetching stale users: {e}")
+        return None
+
+
+def delete_users_batch(user_ids):
+    """Delete up to 500 users in one batched write. Returns True on success."""
+    try:
+        batch = db.batch()
+        for user_id in user_ids:
+            batch.delete(_collection('users').document(str(user_id)))
+        batch.commit()
+        for user_id in user_ids:
+            user_cache.invalidate(user_id)
+            user_stats.on_delete(user_id)
+        return True
     except Exception as e:
-        print(f"Error deleting user: {e}")
\ No newline at end of file
+        print(f"Error deleting users: {e}")
+        return False
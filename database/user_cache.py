@@ -0,0 +1,149 @@
+import itertools
+import logging
+import threading
+from datetime import datetime, timezone
+
+from bot.metrics import registry
+from bot.tenants import TenantLocal
+
+# Returned by UserCache.get when the caller has to read Firestore
+MISS = object()
+
+cache_lookups_total = registry.counter("debatebot_user_cache_lookups_total", "User cache lookups by result")
+cache_lag_histogram = registry.histogram(
+    "debatebot_user_cache_lag_seconds", "Delay between a Firestore change and this process seeing it",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class FirestoreChangeFeed:
+    """Delivers changes to a collection, such as `users`, through an `on_snapshot` listener.
+
+    The first snapshot reports every existing document as added, so a cache is
+    filled in one pass; after that only changed documents are delivered.
+    Firestore reconnects the listener by itself after network errors.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._watch = None
+
+    def start(self, on_change) -> None:
+        def callback(documents, changes, read_time):
+            for change in changes:
+                data = None if change.type.name == "REMOVED" else change.document.to_dict()
+                on_change(change.document.id, data, read_time)
+
+        self._watch = self._collection.on_snapshot(callback)
+
+    def active(self) -> bool:
+        return self._watch is not None and getattr(self._watch, "is_active", True)
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+
+class LocalChangeFeed:
+    """In-process stand-in for the Firestore listener, for tests and benchmarks.
+
+    `publish` plays the role of another replica or an admin edit.
+    """
+
+    def __init__(self):
+        self._on_change = None
+
+    def start(self, on_change) -> None:
+        self._on_change = on_change
+
+    def active(self) -> bool:
+        return self._on_change is not None
+
+    def publish(self, user_id, data) -> None:
+        self._on_change(str(user_id), None if data is None else dict(data), datetime.now(timezone.utc))
+
+    def stop(self) -> None:
+        self._on_change = None
+
+
+class UserCache:
+    """Per-process copy of user documents kept coherent by a change feed.
+
+    Reads are only served from memory while the feed is active, so without a
+    listener every lookup still goes to Firestore. Local writes invalidate the
+    entry; the feed then delivers the new document from Firestore, which is
+    also how edits by other replicas or in the Firebase console arrive.
+
+    A read that raced with a change is not cached: `begin_read` returns the
+    entry's generation and `store_read` ignores the result if a change arrived
+    in between. Generations are unique, and only kept from an invalidation
+    until the feed or a read stores the entry again.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self._next_generation = itertools.count(1)
+        self._lock = threading.Lock()
+        self._feed = None
+
+    def start(self, feed) -> None:
+        self._feed = feed
+        feed.start(self._apply_change)
+
+    def stop(self) -> None:
+        if self._feed is not None:
+            self._feed.stop()
+            self._feed = None
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    @property
+    def live(self) -> bool:
+        return self._feed is not None and self._feed.active()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """Return the cached document (None for a known missing user) or MISS."""
+        if not self.live:
+            return MISS
+        data = self._entries.get(str(user_id), MISS)
+        cache_lookups_total.inc(result="miss" if data is MISS else "hit")
+        return data
+
+    def begin_read(self, user_id):
+        return self._generations.get(str(user_id), 0)
+
+    def store_read(self, user_id, data, generation) -> None:
+        if not self.live:
+            return
+        key = str(user_id)
+        with self._lock:
+            # A present entry came from the feed after this read started
+            if key not in self._entries and self._generations.get(key, 0) == generation:
+                self._entries[key] = data
+                self._generations.pop(key, None)
+
+    def invalidate(self, user_id) -> None:
+        key = str(user_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.live:
+                self._generations[key] = next(self._next_generation)
+
+    def _apply_change(self, user_id, data, read_time) -> None:
+        with self._lock:
+            self._entries[user_id] = data
+            self._generations.pop(user_id, None)
+        if read_time is not None:
+            try:
+                cache_lag_histogram.observe(max(0.0, (datetime.now(timezone.utc) - read_time).total_seconds()))
+            except TypeError:
+                logging.debug("Change feed read_time without a timezone")
+
+
+user_cache = TenantLocal(UserCache)
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from bot.tenants import TenantLocal
+
+# Users whose state and language are remembered; the least recently seen are forgotten first
+MAX_KNOWN_USERS = 50000
+
+
+class UserStats:
+    """Number of users per conversation state and per language, kept without reading the collection.
+
+    The write helpers in database_support report every transition here. The
+    state and language of each user are remembered from the last read or
+    write, so a transition moves one user from one count to another; as every
+    update reads its user first, that covers nearly all local writes. Writes
+    for users not seen since the start (or forgotten after MAX_KNOWN_USERS
+    more recent ones), and other replicas' writes, are not counted; `reconcile` replaces the counts with Firestore count aggregations
+    to correct that drift.
+    """
+
+    def __init__(self, max_known=MAX_KNOWN_USERS):
+        self._lock = threading.Lock()
+        self._known = OrderedDict()
+        self.max_known = max_known
+        self.by_state = Counter()
+        self.by_language = Counter()
+        self.total = 0
+        self.reconciled_at = None
+
+    def observe(self, user_id, data) -> None:
+        """Remember the state and language of a user document that was just read."""
+        with self._lock:
+            if data is None:
+                self._known.pop(str(user_id), None)
+            else:
+                self._remember(str(user_id), (data.get('conversation_state'), data.get('language')))
+
+    def _remember(self, key, value) -> None:
+        self._known[key] = value
+        self._known.move_to_end(key)
+        if len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    def _change(self, user_id, state=None, language=None) -> None:
+        # A user not seen since the start is left to the next reconcile
+        previous = self._known.get(str(user_id))
+        if previous is None:
+            return
+        old_state, old_language = previous
+        new_state = old_state if state is None else state
+        new_language = old_language if language is None else language
+        self.by_state[old_state] -= 1
+        self.by_state[new_state] += 1
+        self.by_language[old_language] -= 1
+        self.by_language[new_language] += 1
+        self._remember(str(user_id), (new_state, new_language))
+
+    def on_insert(self, user_id, state, language) -> None:
+        with self._lock:
+            previous = self._known.get(str(user_id))
+            if previous is not None:
+                self.by_state[previous[0]] -= 1
+                self.by_language[previous[1]] -= 1
+            else:
+                self.total += 1
+            self.by_state[state] += 1
+            self.by_language[language] += 1
+            self._remember(str(user_id), (state, language))
+
+    def on_state(self, user_id, state) -> None:
+        with self._lock:
+            self._change(user_id, state=state)
+
+    def on_language(self, user_id, language) -> None:
+        with self._lock:
+            self._change(user_id, language=language)
+
+    def on_delete(self, user_id) -> None:
+        with self._lock:
+            previous = self._known.pop(str(user_id), None)
+            if previous is None:
+                return
+            self.by_state[previous[0]] -= 1
+            self.by_language[previous[1]] -= 1
+            self.total -= 1
+
+    def reconcile(self, by_state, by_language, total) -> None:
+        """Replace the counts with exact ones from Firestore."""
+        with self._lock:
+            self.by_state = Counter(by_state)
+            self.by_language = Counter(by_language)
+            self.total = total
+            self.reconciled_at = time.time()
+
+    def snapshot(self):
+        """(by_state, by_language, total) as plain dicts without empty entries."""
+        with self._lock:
+            return (
+                {state: count for state, count in self.by_state.items() if count > 0},
+                {language: count for language, count in self.by_language.items() if count > 0},
+                max(0, self.total),
+            )
+
+
+user_stats = TenantLocal(UserStats)
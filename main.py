@@ -1,126 +1,290 @@
-from warnings import filterwarnings
-from telegram.warnings import PTBUserWarning
+import asyncio
+import logging
+from telegram import Update
 
 from telegram.ext import (
     Application,
     CommandHandler,
+    TypeHandler,
     MessageHandler,
     filters,
     CallbackQueryHandler,
-    ConversationHandler,
+    ContextTypes,
+    InlineQueryHandler,
 )
 
-from bot.config import load_config
-from bot.handlers import (
-    STARTED,
-    AWAITING_EMAIL,
-    AWAITING_VERIFICATION_CODE,
-    VERIFIED,
-    AWAITING_DEBATE_TOPIC,
-    AWAITING_DEBATE_SIDE,
-    CHAT_GPT,
-    start,
-    menu,
-    register,
-    cancel_registration,
-    receive_email,
-    verify_code,
-    resend_verification,
-    change_topic,
-    change_side_entry_point,
-    cancel_change_topic,
-    cancel_change_side,
-    select_side,
-    receive_topic,
-    gpt_reply,
-    handle_verified_text,
-    global_message_handler,
-    delete_user,
-    change_language_command,
-    select_language,
-)
+from bot.config import load_config, reload_config
+from bot.broadcast import broadcaster, broadcast_command
+from bot.admission import admission
+from bot.analysis_jobs import analysis_workers
+from bot.conversation_store import conversation_history, compress_idle_histories
+from bot.dedupe import deduplicator, drop_duplicate_updates
+from bot.delivery import outbound
+from bot.flow import load_user_context
+from bot.llm import llm_router
+from bot.loop_monitor import loop_monitor
+from bot.metrics import registry, start_metrics_server
+from bot.stats import activity_stats, reconcile_user_stats, stats_command
+from bot.sweeper import sweeper, sweep_stale_data
+from bot.profiling import profiler, count_profiled_update, profile_command, install_signal_handler
+from bot.shutdown import shutdown_coordinator
+from bot.topics import topic_catalog, inline_topic_query, topics_command
+from bot.tenants import current_tenant, load_tenants, TenantCallbackContext
+from bot.transport import http_transport
+from bot.traffic import traffic_recorder, record_update
+from bot.transcripts import transcript_exporter
+from bot.turn_routing import turn_router
+from bot.usage import usage_tracker, flush_usage
+from bot.verification_store import configure_verification_store
+from database.database_support import users_collection, topics_collection
+from database.user_cache import user_cache, FirestoreChangeFeed
+from bot.handlers import DEBATE_FLOW, global_message_handler, delete_user, feedback
 
-filterwarnings(
-    action="ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning
-)
 
-def main() -> None:
-    """Start the bot."""
-    # Load configuration
-    config = load_config()
+async def post_init(application: Application) -> None:
+    """Start background services once the event loop is running."""
+    config = application.bot_data['config']
+
+    registry.gauge(
+        "debatebot_update_queue_depth", "Updates waiting to be processed",
+        callback=application.update_queue.qsize,
+    )
+    registry.gauge(
+        "debatebot_outbound_queue_depth", "Telegram requests waiting to be delivered",
+        callback=outbound.depth,
+    )
+
+    # Report handlers that block the event loop; with several bots the first one starts it
+    loop_monitor.configure(config)
+    loop_monitor.start()
+
+    # Debate feedback and scoring run in background workers
+    analysis_workers.start(application)
+
+    # Serve user reads from memory, kept in sync by a Firestore listener
+    if config.get('USER_CACHE', 'off') == 'listener':
+        user_cache.start(FirestoreChangeFeed(users_collection()))
+
+    # Index the curated debate topics; the listener keeps the index up to date
+    topic_catalog.start(FirestoreChangeFeed(topics_collection()))
+
+    # Continue announcements interrupted by a crash or restart
+    broadcaster.resume_unfinished(application)
+
+    # SIGUSR1 toggles a profiling session without restarting the bot
+    install_signal_handler(application)
 
-    # Create the Application and pass it your bot's token from config.txt
-    application = Application.builder().token(config["TELEGRAM_BOT_TOKEN"]).build()
+    # SIGTERM and SIGINT finish the work in flight before stopping; with
+    # several bots the host installs the handler for all of them
+    if 'tenant' not in application.bot_data:
+        shutdown_coordinator.install([application], application.stop_running)
+
+    # Continue the debates saved by the previous process
+    if conversation_history.snapshot_file:
+        restored = await asyncio.get_running_loop().run_in_executor(
+            None, conversation_history.restore, conversation_history.snapshot_file,
+        )
+        if restored:
+            logging.info(f"Restored {restored} debate histories")
+
+    metrics_port = config.get_int('METRICS_PORT', 0)
+    if metrics_port:
+        application.bot_data['metrics_server'] = await start_metrics_server(metrics_port)
+
+
+async def post_shutdown(application: Application) -> None:
+    """Flush buffered data once the application has stopped."""
+    loop = asyncio.get_running_loop()
+    await analysis_workers.stop()
+    await outbound.stop()
+    await loop_monitor.stop()
+    user_cache.stop()
+    topic_catalog.stop()
+    traffic_recorder.close()
+
+    # Token usage is otherwise only written every USAGE_FLUSH_SECONDS
+    await flush_usage()
+    await http_transport.aclose()
+
+    if conversation_history.snapshot_file:
+        saved = await loop.run_in_executor(None, conversation_history.save, conversation_history.snapshot_file)
+        logging.info(f"Saved {saved} debate histories to {conversation_history.snapshot_file}")
+
+    # The writer thread does blocking file IO, so wait for it off the event loop
+    await loop.run_in_executor(None, transcript_exporter.stop)
+
+
+def configure_shared_services(config) -> None:
+    """Configure the services used by every bot in this process."""
+    # Connection pools and timeouts for Telegram and the LLM backends
+    http_transport.configure(config)
+    # All outgoing messages go through the rate-limited delivery queue
+    outbound.configure(config)
+    # LLM backends with routing and failover
+    llm_router.configure(config)
+    # Reject new GPT turns quickly when the bot is saturated
+    admission.configure(config)
+    # Optional research export of debate transcripts
+    transcript_exporter.configure(config)
+    # Optional anonymised recording of incoming traffic for load replay
+    traffic_recorder.configure(config)
+    # Deadline for finishing work in flight on SIGTERM
+    shutdown_coordinator.configure(config)
+
+
+def build_application(config, builder=None, shared=True) -> Application:
+    """Create the Application with every service and handler of the bot.
+
+    `builder` lets tools such as the traffic replay swap in their own request
+    backend; by default the pools of bot/transport.py are used. With `shared` the
+    process-wide services are configured from `config` too; the multi-bot
+    host configures them once from config.txt instead.
+    """
+    if shared:
+        configure_shared_services(config)
+    if builder is None:
+        builder = (
+            Application.builder()
+            .request(http_transport.telegram_request())
+            .get_updates_request(http_transport.updates_request())
+        )
+    application = (
+        builder
+        .token(config["TELEGRAM_BOT_TOKEN"])
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .context_types(ContextTypes(context=TenantCallbackContext))
+        .build()
+    )
 
     application.bot_data['config'] = config
 
+    # Model tier and output cap chosen per turn, from this bot's GPT_MODEL and ROUTE_* keys;
+    # PROMPT, GPT_MODEL and the routes are re-read when config.txt changes
+    turn_router.configure(config)
+    config.on_reload(turn_router.configure)
+    reload_interval = config.get_float('CONFIG_RELOAD_SECONDS', 5)
+    if reload_interval > 0:
+        application.job_queue.run_repeating(reload_config, interval=reload_interval, first=reload_interval)
+    # Per-user flood limits and daily token budgets for GPT turns
+    usage_tracker.configure(config)
+
+    # Pending email verification codes are kept out of Firestore
+    configure_verification_store(config)
+
+    # Optional cap on the number of turns kept per debate, saved across restarts
+    conversation_history.configure(config)
+    application.job_queue.run_repeating(compress_idle_histories, interval=300, first=300)
+
+    # Clean up abandoned registrations and idle histories in the background
+    sweeper.configure(config)
+    sweep_interval = config.get_float('SWEEP_INTERVAL_SECONDS', 3600)
+    application.job_queue.run_repeating(sweep_stale_data, interval=sweep_interval, first=sweep_interval)
+
+    # User counts are kept incrementally and corrected with Firestore count queries
+    activity_stats.configure(config)
+    reconcile_interval = config.get_float('STATS_RECONCILE_SECONDS', 900)
+    if reconcile_interval > 0:
+        application.job_queue.run_repeating(reconcile_user_stats, interval=reconcile_interval, first=1)
+
+    # Write buffered token usage to Firestore in batches
+    usage_flush_interval = config.get_float('USAGE_FLUSH_SECONDS', 60)
+    application.job_queue.run_repeating(flush_usage, interval=usage_flush_interval, first=usage_flush_interval)
+
+    # Optional anonymised recording of incoming traffic for load replay
+    if traffic_recorder.enabled:
+        application.add_handler(TypeHandler(Update, record_update), group=-4)
+
+    # Redelivered updates are dropped before any other handler sees them
+    deduplicator.configure(config)
+    application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-3)
+
+    # Count updates for on-demand profiling before any other handler runs
+    profiler.configure(config)
+    application.add_handler(TypeHandler(Update, count_profiled_update), group=-2)
+
+    # Read the user's document once for all handlers of the update
+    application.add_handler(TypeHandler(Update, load_user_context), group=-1)
+
     # Register command handlers
     application.add_handler(CommandHandler("delete", delete_user))
+    analysis_workers.configure(config)
+    application.add_handler(CommandHandler("feedback", feedback))
+    application.add_handler(CommandHandler("profile", profile_command))
+    broadcaster.configure(config)
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("topics", topics_command))
+    # Topic autocomplete through `@bot <words>`
+    application.add_handler(InlineQueryHandler(inline_topic_query))
 
-    # Define the conversation handler with states
-    register_conv_handler = ConversationHandler(
-        entry_points=[
-            CommandHandler("start", start),
-            CommandHandler("menu", menu),
-            CommandHandler("language", change_language_command),
-            CallbackQueryHandler(register, pattern="^register$"),
-        ],
-        states={
-            STARTED: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                CallbackQueryHandler(register, pattern="^register$"),
-                CallbackQueryHandler(cancel_registration, pattern="^cancel_registration$"),
-            ],
-            AWAITING_EMAIL: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_email),
-                CallbackQueryHandler(cancel_registration, pattern="^cancel_registration$"),
-        ],
-            AWAITING_VERIFICATION_CODE: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, verify_code),
-                CallbackQueryHandler(resend_verification, pattern="^resend_verification$"),
-                CallbackQueryHandler(cancel_registration, pattern="^cancel_registration$"),
-            ],
-            VERIFIED: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                CallbackQueryHandler(change_topic, pattern="^change_topic$"),
-                CallbackQueryHandler(change_side_entry_point, pattern="^change_side$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_verified_text),
-            ],
-            AWAITING_DEBATE_TOPIC: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_topic),
-                CallbackQueryHandler(cancel_change_topic, pattern="^cancel_change_topic$"),
-            ],
-            AWAITING_DEBATE_SIDE: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                CallbackQueryHandler(select_side, pattern="^(for|against)$"),
-                CallbackQueryHandler(cancel_change_topic, pattern="^cancel_change_topic$"),
-                CallbackQueryHandler(cancel_change_side, pattern="^cancel_change_side$"),
-            ],
-            CHAT_GPT: [
-                CallbackQueryHandler(select_language, pattern="^language_(en|ru)$"),
-                CallbackQueryHandler(change_topic, pattern="^change_topic$"),
-                CallbackQueryHandler(change_side_entry_point, pattern="^change_side$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, gpt_reply),
-            ],
-        },
-        fallbacks=[
-            CallbackQueryHandler(cancel_registration, pattern="^cancel_registration$"),
-            CallbackQueryHandler(cancel_change_topic, pattern="^cancel_change_topic$"),
-            CallbackQueryHandler(cancel_change_side, pattern="^cancel_change_side$"),
-        ],
-        per_chat=True,
-        allow_reentry=True,
-    )
-
-    # Register the conversation handler
-    application.add_handler(register_conv_handler)
+    # The conversation handler is generated from the transition table in bot/handlers.py
+    application.add_handler(DEBATE_FLOW.conversation_handler(per_chat=True, allow_reentry=True))
+    # Text and buttons it is not tracking are routed by the state stored in Firestore
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, global_message_handler))
+    application.add_handler(CallbackQueryHandler(global_message_handler))
+
+    return application
+
+
+async def run_tenants(config, tenants) -> None:
+    """Run one bot per TENANTS_FILE section in this event loop until SIGTERM or SIGINT.
+
+    The bots share the Telegram connection pools, the Firestore client, the
+    LLM router, admission control, the outbound queue and the message
+    catalogs; users, histories and other per-user state are kept per bot.
+    """
+    configure_shared_services(config)
+    # One long poll per bot
+    http_transport.reserve_long_polls(len(tenants))
+
+    applications = []
+    for name, tenant_config in tenants:
+        # Tasks started for this bot (update fetcher, polling, jobs) inherit the tenant
+        current_tenant.set(name)
+        application = build_application(tenant_config, shared=False)
+        application.bot_data['tenant'] = name
+        await application.initialize()
+        await application.post_init(application)
+        await application.updater.start_polling()
+        await application.start()
+        applications.append(application)
+        logging.info(f"Started bot {name} as @{application.bot.username}")
+    current_tenant.set('')
+
+    metrics_port = config.get_int('METRICS_PORT', 0)
+    if metrics_port:
+        await start_metrics_server(metrics_port)
+
+    stopped = asyncio.Event()
+    shutdown_coordinator.install(applications, stopped.set)
+    await stopped.wait()
+
+    for application in applications:
+        current_tenant.set(application.bot_data['tenant'])
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+    for application in applications:
+        current_tenant.set(application.bot_data['tenant'])
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def main() -> None:
+    """Start the bot, or every bot in TENANTS_FILE."""
+    # Load configuration
+    config = load_config()
+
+    tenants = load_tenants(config)
+    if tenants:
+        asyncio.run(run_tenants(config, tenants))
+        return
+
+    application = build_application(config)
 
-    # Run the bot
-    application.run_polling()
+    # Run the bot; the stop signals are handled by the shutdown coordinator
+    application.run_polling(stop_signals=None)
 
 
 if __name__ == "__main__":